@@ -0,0 +1,203 @@
+from typing import Dict, Any, List, Optional, Iterator
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+import zlib
+
+import httpx
+import openai
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cards listed in the shard and final prompts, as a JSON array after "CARDS" (see tools.py and nodes.py)
+CARDS_PATTERN = re.compile(r"CARDS[^:\n]*:\s*(\[.*?\])\s*\n\s*\nTASK", re.DOTALL)
+CARD_NAME_PATTERN = re.compile(r'"name":\s*"((?:[^"\\]|\\.)*)"')
+# The "USER: goal | score | spending | situation" line both prompts start with
+USER_PATTERN = re.compile(r"USER:\s*(.*)")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Rough characters per token of English text, used to size chunks and usage
+CHARACTERS_PER_TOKEN = 4
+
+# Where the simulated provider errors claim to come from
+_FAKE_REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+class FakeChatModel(BaseChatModel):
+    """Offline stand-in for ChatOpenAI with realistic timing, for load tests and benchmarks
+
+    Answers the shard prompts with a JSON array of about half of the cards they list and the
+    final prompt with three of its cards in the numbered format it asks for, so the whole
+    pipeline, including parsing and card extraction, runs on real catalog data. The first
+    token arrives after a log-normally distributed latency and the rest stream at
+    tokens_per_second; error_rate and rate_limit_rate of calls fail like the OpenAI API
+    (InternalServerError and RateLimitError). Token usage is estimated and reported like
+    ChatOpenAI with stream_usage=True.
+    """
+
+    model_name: str = "gpt-3.5-turbo"
+    # Median seconds to the first token, and the sigma of its log-normal distribution
+    latency_seconds: float = 0.8
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 50.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    seed: Optional[int] = None
+
+    def model_post_init(self, __context: Any):
+        super().model_post_init(__context)
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-openai"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _get_ls_params(self, stop: Optional[List[str]] = None, **kwargs: Any):
+        # Reported as the model it stands in for, so metrics and cost estimates match real runs
+        params = super()._get_ls_params(stop=stop, **kwargs)
+        params["ls_provider"] = "openai"
+        params["ls_model_name"] = self.model_name
+        return params
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text = self._respond(messages)
+        chunks = self._chunks(text)
+        time.sleep(self._first_token_delay() + len(chunks) * self._chunk_delay())
+        usage = self._usage(messages, len(chunks))
+        message = AIMessage(content=text, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={
+            "token_usage": {"prompt_tokens": usage["input_tokens"], "completion_tokens": usage["output_tokens"], "total_tokens": usage["total_tokens"]},
+            "model_name": self.model_name
+        })
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text = self._respond(messages)
+        chunks = self._chunks(text)
+        time.sleep(self._first_token_delay())
+        delay = self._chunk_delay()
+        for position, content in enumerate(chunks):
+            if position and delay:
+                time.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=content))
+            if run_manager:
+                run_manager.on_llm_new_token(content, chunk=chunk)
+            yield chunk
+        # Usage comes last, as with stream_usage=True
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, len(chunks))))
+
+    def _first_token_delay(self) -> float:
+        """Sampled time to the first token; raises the simulated provider errors"""
+        delay = self.latency_seconds * math.exp(self.latency_sigma * self._random.gauss(0.0, 1.0))
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            # Rate limits are answered quickly
+            time.sleep(min(delay, 0.05))
+            raise openai.RateLimitError(
+                "Rate limit reached (simulated)",
+                response=httpx.Response(429, headers={"retry-after": "1"}, request=_FAKE_REQUEST),
+                body=None
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            time.sleep(delay)
+            raise openai.InternalServerError(
+                "The server had an error processing your request (simulated)",
+                response=httpx.Response(500, request=_FAKE_REQUEST),
+                body=None
+            )
+        return delay
+
+    def _chunk_delay(self) -> float:
+        # tokens_per_second of 0 streams without pacing, for benchmarks of the code around the LLM
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _chunks(self, text: str) -> List[str]:
+        return [text[start:start + CHARACTERS_PER_TOKEN] for start in range(0, len(text), CHARACTERS_PER_TOKEN)]
+
+    def _usage(self, messages: List[BaseMessage], completion_tokens: int) -> Dict[str, int]:
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // CHARACTERS_PER_TOKEN + 4 * len(messages)
+        return {"input_tokens": prompt_tokens, "output_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        prompt = str(messages[-1].content) if messages else ""
+        cards = self._prompt_cards(prompt)
+        if not cards:
+            return "I can help you find a credit card. Tell me about your goals and credit history."
+        ranked = self._rank(cards, prompt)
+        if "JSON array" in prompt:
+            # Shard prompt: the top half of its cards
+            return json.dumps([
+                {"name": card.get("name", ""), "reasoning": self._reasoning(card)}
+                for card in ranked[:max(1, len(ranked) // 2)]
+            ], indent=2)
+        return "\n\n".join(self._final_entry(position, card) for position, card in enumerate(ranked[:3], start=1))
+
+    def _prompt_cards(self, prompt: str) -> List[Dict[str, Any]]:
+        match = CARDS_PATTERN.search(prompt)
+        if match:
+            try:
+                return [card for card in json.loads(match.group(1)) if isinstance(card, dict) and card.get("name")]
+            except ValueError:
+                pass
+        return [{"name": json.loads(f'"{name}"')} for name in CARD_NAME_PATTERN.findall(prompt)]
+
+    def _rank(self, cards: List[Dict[str, Any]], prompt: str) -> List[Dict[str, Any]]:
+        # Cards sharing the most words with the user's line first; ties broken by a hash of the
+        # name and prompt, so the same prompt gets the same answer
+        user = USER_PATTERN.search(prompt)
+        wanted = set(WORD_PATTERN.findall(user.group(1).lower())) if user else set()
+        prompt_hash = zlib.crc32(prompt.encode("utf-8"))
+
+        def score(card: Dict[str, Any]):
+            text = " ".join(str(card.get(field, "")) for field in ("category", "rewards", "target_audience", "name"))
+            overlap = len(wanted & set(WORD_PATTERN.findall(text.lower())))
+            return (-overlap, zlib.crc32(str(card.get("name")).encode("utf-8")) ^ prompt_hash)
+
+        return sorted(cards, key=score)
+
+    def _reasoning(self, card: Dict[str, Any]) -> str:
+        details = [str(card.get(field)) for field in ("category", "target_audience") if card.get(field)]
+        return f"Good fit for this profile ({', '.join(details)})." if details else "Good fit for this profile."
+
+    def _final_entry(self, position: int, card: Dict[str, Any]) -> str:
+        fields = [
+            ("Issuer", "issuer"), ("Annual Fee", "annual_fee"), ("Credit Score", "credit_score"),
+            ("Regular APR", "regular_apr"), ("Rewards", "rewards"), ("Sign-up Bonus", "signup_bonus"),
+            ("Target Audience", "target_audience")
+        ]
+        lines = [f"{position}. **{card.get('name')}**"]
+        lines.extend(f"   - **{label}:** {card.get(key, 'N/A') or 'N/A'}" for label, key in fields)
+        lines.append("")
+        lines.append(f"   **Reasoning:** {self._reasoning(card)} Its rewards and requirements match the stated goal and credit profile.")
+        return "\n".join(lines)
+
+def create_chat_model(model: str, temperature: float, **kwargs: Any) -> BaseChatModel:
+    """The chat model selected by LLM_PROVIDER: ChatOpenAI ("openai", the default) or the
+    offline FakeChatModel ("fake"), configured from the FAKE_LLM_* settings. kwargs are
+    ChatOpenAI options; the fake ignores them."""
+    if os.getenv("LLM_PROVIDER", "openai").lower() != "fake":
+        return ChatOpenAI(model=model, temperature=temperature, api_key=os.getenv("OPENAI_API_KEY"), **kwargs)
+    seed = os.getenv("FAKE_LLM_SEED")
+    return FakeChatModel(
+        model_name=os.getenv("FAKE_LLM_MODEL", model),
+        latency_seconds=float(os.getenv("FAKE_LLM_LATENCY_MS", "800")) / 1000,
+        latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")),
+        tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50")),
+        error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+        rate_limit_rate=float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0")),
+        seed=int(seed) if seed else None
+    )
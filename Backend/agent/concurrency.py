@@ -0,0 +1,358 @@
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+import uuid
+
+from agent.memory import approx_size
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class IdempotencyConflictError(Exception):
+    """Raised when an idempotency key is reused for a different request"""
+
+class OverloadedError(Exception):
+    """Raised when a request is turned away by admission control"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class KeyedLock:
+    # One lock per key, so requests for the same session are serialized while different
+    # sessions never wait on each other, however long a request holds its lock (the whole LLM
+    # pipeline). A key's lock exists only while a request holds or waits for it, so idle
+    # sessions keep no lock object.
+    #
+    # With a shared_store that shares records (SQLite or Redis), the holder also takes a lease
+    # record there, so requests for the same session on other worker processes wait too. The
+    # lease expires after lease_seconds, in case its worker dies holding it.
+
+    def __init__(self, shared_store: Optional[Any] = None, lease_seconds: float = 600.0, poll_seconds: float = 0.05):
+        self.shared_store = shared_store if shared_store is not None and shared_store.shares_records else None
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        # key -> [lock, requests holding or waiting for it]
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def lock_for(self, key: str):
+        """Hold the lock of key for the block"""
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if self.shared_store is None:
+                    yield
+                else:
+                    with self._lease(key):
+                        yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    @contextmanager
+    def _lease(self, key: str):
+        # Polled with backoff: the other worker's request may hold it for a whole analysis
+        lease = {"owner": uuid.uuid4().hex}
+        delay = self.poll_seconds
+        while not self.shared_store.put_record("lock", key, lease, self.lease_seconds, only_if_absent=True):
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        try:
+            yield
+        finally:
+            try:
+                self.shared_store.delete_record("lock", key, expected=lease)
+            except Exception as e:
+                logger.warning(f" Could not release the shared lock of {key}, it expires on its own: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._guard:
+            return {
+                "locked_sessions": len(self._locks),
+                "waiting": sum(entry[1] - 1 for entry in self._locks.values()),
+                "shared": self.shared_store is not None
+            }
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """Stable digest of a request body, used to detect a key reused for a different request"""
+    canonical = repr(sorted(payload.items()))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class IdempotencyCache:
+    # Results of requests sent with an Idempotency-Key. The first request with a key runs;
+    # retries while it runs wait on the same future and retries after it finished get the
+    # stored result, so a double-click never runs the LLM pipeline twice. Failed requests are
+    # forgotten so they can be retried. Completed results are kept for ttl_seconds.
+    #
+    # With a shared_store that shares records (SQLite or Redis), a request also claims its key
+    # there and stores its result (as JSON) when done, so a retry landing on another worker
+    # process replays it, or polls until the worker running it finishes.
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 600.0, shared_store: Optional[Any] = None,
+                 in_flight_seconds: float = 600.0, poll_seconds: float = 0.25):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_store = shared_store if shared_store is not None and shared_store.shares_records else None
+        # How long another worker's claim on a key holds without a result, in case that worker died
+        self.in_flight_seconds = in_flight_seconds
+        self.poll_seconds = poll_seconds
+        # key -> (fingerprint, future, completed at or None while in flight), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"executed": 0, "replayed": 0, "joined_in_flight": 0, "conflicts": 0}
+
+    def claim(self, key: str, fingerprint: str) -> Tuple[Future, bool]:
+        """Return the future for key and whether the caller must run the request and resolve it.
+        With a shared store this does I/O, so call it off the event loop."""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] != fingerprint:
+                    self.counters["conflicts"] += 1
+                    raise IdempotencyConflictError("Idempotency key was already used for a different request")
+                self.counters["replayed" if entry[1].done() else "joined_in_flight"] += 1
+                return entry[1], False
+
+            while len(self._entries) >= self.max_entries:
+                oldest_key = next(iter(self._entries))
+                if self._entries[oldest_key][2] is None:
+                    # Never drop a request still in flight; allow the cache to grow instead
+                    break
+                del self._entries[oldest_key]
+
+            future = Future()
+            self._entries[key] = (fingerprint, future, None)
+        # Retries of this key on this worker now join the entry, whoever turns out to run it
+        try:
+            record = self._claim_shared(key, fingerprint)
+        except IdempotencyConflictError as e:
+            with self._lock:
+                self.counters["conflicts"] += 1
+            self._fail_local(key, e)
+            raise
+        if record is None:
+            with self._lock:
+                self.counters["executed"] += 1
+            return future, True
+        with self._lock:
+            self.counters["replayed" if record["status"] == "done" else "joined_in_flight"] += 1
+        threading.Thread(target=self._follow_shared, args=(key, fingerprint, record), daemon=True, name="idempotency-follow").start()
+        return future, False
+
+    def complete(self, key: str, result: Any):
+        entry = self._complete_local(key, result)
+        if entry is not None and self.shared_store is not None:
+            try:
+                stored = result.model_dump(mode="json") if hasattr(result, "model_dump") else result
+                self.shared_store.put_record("idempotency", key, {"fingerprint": entry[0], "status": "done", "result": stored}, self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f" Could not share the result of idempotency key {key}: {e}")
+
+    def fail(self, key: str, error: BaseException):
+        entry = self._fail_local(key, error)
+        if entry is not None and self.shared_store is not None:
+            try:
+                self.shared_store.delete_record("idempotency", key, expected={"fingerprint": entry[0], "status": "running"})
+            except Exception as e:
+                logger.warning(f" Could not release idempotency key {key}, it expires on its own: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "shared": self.shared_store is not None, **self.counters}
+
+    def _claim_shared(self, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        # None if this worker runs the request, otherwise the record of the worker that does (or did)
+        if self.shared_store is None:
+            return None
+        claim = {"fingerprint": fingerprint, "status": "running"}
+        try:
+            for _ in range(3):
+                if self.shared_store.put_record("idempotency", key, claim, self.in_flight_seconds, only_if_absent=True):
+                    return None
+                record = self.shared_store.get_record("idempotency", key)
+                if record is None:
+                    # Expired or failed in between; claim it again
+                    continue
+                if record["fingerprint"] != fingerprint:
+                    raise IdempotencyConflictError("Idempotency key was already used for a different request")
+                return record
+        except IdempotencyConflictError:
+            raise
+        except Exception as e:
+            logger.warning(f" Could not claim idempotency key {key} in the shared store, running it here: {e}")
+        return None
+
+    def _follow_shared(self, key: str, fingerprint: str, record: Optional[Dict[str, Any]]):
+        # Resolve this worker's entry from the record another worker keeps for the key
+        deadline = time.monotonic() + self.in_flight_seconds
+        try:
+            while record is not None and record["status"] != "done" and time.monotonic() < deadline:
+                time.sleep(self.poll_seconds)
+                record = self.shared_store.get_record("idempotency", key)
+        except Exception as e:
+            record = None
+            logger.warning(f" Could not read idempotency key {key} from the shared store: {e}")
+        if record is not None and record["status"] == "done" and record["fingerprint"] == fingerprint:
+            self._complete_local(key, record["result"])
+        else:
+            self._fail_local(key, RuntimeError("The earlier request with this idempotency key did not finish; send it again"))
+
+    def _complete_local(self, key: str, result: Any) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries[key] = (entry[0], entry[1], time.monotonic())
+            self._entries.move_to_end(key)
+        entry[1].set_result(result)
+        return entry
+
+    def _fail_local(self, key: str, error: BaseException) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[1].set_exception(error)
+        return entry
+
+    def approx_bytes(self) -> int:
+        """Approximate bytes held by the keys and completed results"""
+        with self._lock:
+            entries = list(self._entries.items())
+        return sum(approx_size(key) + approx_size(future.result()) for key, (_, future, completed_at) in entries if completed_at is not None)
+
+    def _expire(self, now: float):
+        # Completed entries move to the end, so expired ones are at the front
+        while self._entries:
+            key, (_, _, completed_at) = next(iter(self._entries.items()))
+            if completed_at is None or now - completed_at < self.ttl_seconds:
+                break
+            del self._entries[key]
+
+class AdmissionController:
+    # Admission control for the analysis path: at most max_concurrent requests run, up to
+    # max_queued more wait their turn in arrival order, and anything beyond that is rejected
+    # at once with a Retry-After estimated from how fast the queue is currently draining.
+    # Used from the event loop only: acquire() there, and release() via call_soon_threadsafe.
+
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 32, queue_timeout: float = 30.0,
+                 window_seconds: float = 60.0, default_service_seconds: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.window_seconds = window_seconds
+        self.default_service_seconds = default_service_seconds
+        self.in_flight = 0
+        self._waiters = deque()
+        # Completion times within the window, for the drain rate
+        self._completions = deque()
+        self._started = time.monotonic()
+        self.counters = {"admitted": 0, "waited": 0, "rejected": 0, "timed_out": 0}
+
+    async def acquire(self):
+        """Wait for a slot, raising OverloadedError if the queue is full or the wait times out"""
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queued:
+            self.counters["rejected"] += 1
+            raise OverloadedError("Server is at capacity, please retry later", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.counters["waited"] += 1
+        try:
+            # The slot is handed over by release(), already counted in in_flight
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.counters["timed_out"] += 1
+            raise OverloadedError("Timed out waiting for capacity, please retry later", self.retry_after())
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        self.counters["admitted"] += 1
+
+    def check(self):
+        """Raise OverloadedError if acquire() would turn a request away now, without taking a slot"""
+        if (self.in_flight >= self.max_concurrent or self._waiters) and len(self._waiters) >= self.max_queued:
+            self.counters["rejected"] += 1
+            raise OverloadedError("Server is at capacity, please retry later", self.retry_after())
+
+    def release(self):
+        """Free a slot, handing it straight to the next waiter if there is one"""
+        now = time.monotonic()
+        self._completions.append(now)
+        while self._completions and now - self._completions[0] > self.window_seconds:
+            self._completions.popleft()
+        self._hand_over()
+
+    def drain_rate(self) -> Optional[float]:
+        """Requests completed per second over the recent window, None before any completed"""
+        now = time.monotonic()
+        while self._completions and now - self._completions[0] > self.window_seconds:
+            self._completions.popleft()
+        if not self._completions:
+            return None
+        return len(self._completions) / max(1.0, min(self.window_seconds, now - self._started))
+
+    def retry_after(self) -> int:
+        """Seconds until a request arriving now would likely get a slot"""
+        ahead = len(self._waiters) + 1
+        rate = self.drain_rate()
+        if rate:
+            seconds = ahead / rate
+        else:
+            seconds = self.default_service_seconds * math.ceil(ahead / self.max_concurrent)
+        return int(min(300, max(1, math.ceil(seconds))))
+
+    def state(self) -> str:
+        if len(self._waiters) >= self.max_queued:
+            return "saturated"
+        if self.in_flight >= self.max_concurrent:
+            return "queueing"
+        return "ok"
+
+    def stats(self) -> Dict[str, Any]:
+        rate = self.drain_rate()
+        return {
+            "state": self.state(),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "drain_rate_per_second": round(rate, 3) if rate else None,
+            "retry_after_seconds": self.retry_after(),
+            **self.counters
+        }
+
+    def _hand_over(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        elif waiter.done() and not waiter.cancelled():
+            # release() handed this waiter a slot just as it gave up, so pass the slot on
+            self._hand_over()
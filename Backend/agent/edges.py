@@ -1,14 +1,23 @@
-from typing import Dict, Any
-from langchain_openai import ChatOpenAI
-import os
+from typing import Dict, Any, List, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import queue
+import time
+from agent.nodes import State
+from agent.profile_parser import SKIPPED_ANSWER
+from agent.tracing import tracer
+from agent.chat_models import create_chat_model
+
+# Configure logging
+logger = logging.getLogger(__name__)
 
 class ShouldContinueQuestioningEdge:
     
     def __init__(self):
-        self.llm = ChatOpenAI(
+        self.llm = create_chat_model(
             model="gpt-4",
-            temperature=0.1,
-            api_key=os.getenv("OPENAI_API_KEY")
+            temperature=0.1
         )
     
     def should_continue(self, state) -> bool:
@@ -73,8 +82,15 @@ class ConversationManager:
         self.validator = StateValidator()
         self.edge = ShouldContinueQuestioningEdge()
     
-    def submit_complete_profile(self, state, complete_profile: Dict[str, Any]) -> Dict[str, Any]:
-        """Submit a complete user profile and get recommendations in one call"""
+    @tracer.traced("conversation.submit_complete_profile")
+    def submit_complete_profile(self, state, complete_profile: Dict[str, Any], on_event=None, mode: str = None, cancel=None,
+                                session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Submit a complete user profile and get recommendations in one call
+
+        mode "fast" uses the local ranker only, with no LLM calls. Cancelling cancel (a
+        CancelToken) stops the analysis with RequestCancelledError. session_id lets the analysis
+        use a recommendation speculated for the same answers during that session's /chat.
+        """
         try:
             # Submit complete profile
             result = self.question_node.submit_complete_profile(state, complete_profile)
@@ -84,7 +100,9 @@ class ConversationManager:
             
             # If profile is complete, immediately analyze and recommend
             if result.get("profile_complete"):
-                analysis_result = self.analysis_node.analyze_and_recommend(state)
+                if mode == "fast":
+                    return self.analysis_node.analyze_locally(state, on_event=on_event)
+                analysis_result = self.analysis_node.analyze_and_recommend(state, on_event=on_event, cancel=cancel, session_id=session_id)
                 return analysis_result
             
             return result
@@ -96,7 +114,97 @@ class ConversationManager:
                 "error": str(e)
             }
     
-    def process_message(self, state, user_message: str = None) -> Dict[str, Any]:
+    def submit_profiles_batch(self, profiles: List[Dict[str, Any]], mode: str = None, max_concurrency: int = 4,
+                              stats: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[int, State, Dict[str, Any]]]:
+        """Recommend cards for many profiles, yielding (index, state, result) as each profile completes
+
+        Profiles with the same normalized shard profile share one run of the shard sub-agents, and
+        at most max_concurrency shard runs and max_concurrency final selections run at once.
+        mode "fast" ranks every profile locally. If stats is given it receives the batch counts.
+        """
+        started = time.monotonic()
+        # Started rather than entered: a generator must not change its consumer's current span
+        # between yields. The pools' work runs as its children.
+        batch_span = tracer.start_span("conversation.submit_profiles_batch", profiles=len(profiles), mode=mode or "llm")
+        completed = queue.Queue()
+        groups = {}
+        for index, profile in enumerate(profiles):
+            state = State()
+            result = self.question_node.submit_complete_profile(state, profile)
+            if result.get("error"):
+                completed.put((index, state, result))
+            elif mode == "fast":
+                groups.setdefault(None, []).append((index, state))
+            else:
+                shard_profile = self.analysis_node.shard_profile(state.user_profile, state.parsed_profile)
+                groups.setdefault(json.dumps(shard_profile, sort_keys=True), []).append((index, state))
+        
+        shard_runs = len([key for key in groups if key is not None])
+        logger.info(f" Batch of {len(profiles)} profiles needs {shard_runs} shard runs")
+        
+        shard_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch-shards")
+        final_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch-final")
+        
+        def finish(index: int, state: State, shard_results: Optional[Dict[str, Dict[str, Any]]], local_mode: str):
+            with tracer.span("conversation.batch_profile", index=index):
+                finish_profile(index, state, shard_results, local_mode)
+        
+        def finish_profile(index: int, state: State, shard_results: Optional[Dict[str, Dict[str, Any]]], local_mode: str):
+            try:
+                if shard_results is None:
+                    result = self.analysis_node.analyze_locally(state, mode=local_mode)
+                else:
+                    # The group's first profile to finish is billed for the shard run
+                    result = self.analysis_node.recommend_from_candidates(state, shard_results)
+            except Exception as e:
+                logger.error(f" Batch profile {index} failed: {e}")
+                result = {"response": f"Error processing complete profile: {str(e)}", "is_complete": False, "error": str(e)}
+            completed.put((index, state, result))
+        
+        def run_group(key: str, members: List[Tuple[int, State]]):
+            shard_results = None
+            with tracer.span("conversation.batch_shard_run", profiles=len(members)):
+                if self.analysis_node.breaker.state != "open":
+                    try:
+                        # The first member's profile with the normalized shard fields every member shares
+                        group_state = self.analysis_node.shard_state(members[0][1].user_profile, members[0][1].parsed_profile)
+                        shard_results = self.analysis_node.select_candidates(group_state)
+                    except Exception as e:
+                        logger.error(f" Batch shard run failed, ranking its {len(members)} profiles locally: {e}")
+            for index, state in members:
+                final_pool.submit(tracer.wrap(finish, batch_span), index, state, shard_results, "degraded")
+        
+        try:
+            for key, members in groups.items():
+                if key is None:
+                    for index, state in members:
+                        final_pool.submit(tracer.wrap(finish, batch_span), index, state, None, "fast")
+                else:
+                    shard_pool.submit(tracer.wrap(run_group, batch_span), key, members)
+            
+            for _ in range(len(profiles)):
+                yield completed.get()
+        finally:
+            # Also reached when the consumer stops early, e.g. a client that disconnected
+            shard_pool.shutdown(wait=False, cancel_futures=True)
+            final_pool.shutdown(wait=False, cancel_futures=True)
+            batch_span.set_attribute("shard_runs", shard_runs)
+            tracer.end_span(batch_span)
+            if stats is not None:
+                stats.update({
+                    "profiles": len(profiles),
+                    "shard_runs": shard_runs,
+                    "elapsed_seconds": round(time.monotonic() - started, 3)
+                })
+    
+    def needs_analysis(self, state) -> bool:
+        """Whether process_message's next message runs the analysis rather than asking a question"""
+        if not state.conversation_history:
+            return False
+        return state.questions_completed or not self.edge.should_continue(state)
+    
+    @tracer.traced("conversation.process_message")
+    def process_message(self, state, user_message: str = None, session_id: Optional[str] = None) -> Dict[str, Any]:
         
         
         # If this is the first message, start with questions
@@ -105,17 +213,20 @@ class ConversationManager:
         
         # If questions are completed, go to analysis
         if state.questions_completed:
-            return self.analysis_node.analyze_and_recommend(state)
+            return self.analysis_node.analyze_and_recommend(state, session_id=session_id)
         
         # Check if we should continue asking questions
         if self.edge.should_continue(state):
-            # Continue asking questions
-            return self.question_node.ask_question(state, user_message)
+            # Continue asking questions, starting whatever analysis the answers so far allow
+            result = self.question_node.ask_question(state, user_message)
+            self.analysis_node.speculate(state, session_id)
+            return result
         else:
             # All questions answered, move to analysis
             state.questions_completed = True
-            return self.analysis_node.analyze_and_recommend(state)
+            return self.analysis_node.analyze_and_recommend(state, session_id=session_id)
     
+    @tracer.traced("conversation.get_conversation_summary")
     def get_conversation_summary(self, state) -> Dict[str, Any]:
 
         
@@ -124,15 +235,18 @@ class ConversationManager:
         
         return {
             "questions_completed": completed_questions,
+            "questions_skipped": sum(1 for value in state.user_profile.values() if value == SKIPPED_ANSWER),
             "total_questions": total_questions,
             "progress_percentage": (completed_questions / total_questions) * 100,
             "current_question": state.current_question.get('field') if state.current_question else None,
             "is_complete": state.questions_completed
         }
     
+    @tracer.traced("conversation.reset_conversation")
     def reset_conversation(self, state):
         
         state.user_profile = {field: None for field in state.user_profile.keys()}
+        state.parsed_profile = {field: None for field in state.user_profile.keys()}
         state.conversation_history = []
         state.current_question = None
         state.analysis_result = None
@@ -0,0 +1,194 @@
+from typing import Dict, Any, Optional, Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import uuid
+
+from agent.resilience import LatencyTracker
+from agent.metrics import JOB_QUEUE_WAIT_SECONDS
+from agent.memory import approx_size
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Work run by a job: called with an on_event callback, returns the job's result
+JobWork = Callable[[Callable[[str, Dict[str, Any]], None]], Any]
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its limit"""
+
+class JobManager:
+    # Runs long recommendation work in the background on a bounded worker pool. Submitting
+    # returns a job id straight away; the job's status, progress (from the pipeline's events)
+    # and result are read with get(). Finished jobs are kept for result_ttl_seconds.
+    #
+    # Jobs run in the worker process that accepted them. With a shared_store (a SQLite or Redis
+    # session store), each job's record is also written there when it is queued, starts, moves
+    # to another stage and finishes, so get() on any worker finds it.
+
+    def __init__(self, max_workers: int = 4, max_queued: int = 1000, result_ttl_seconds: float = 3600.0, max_jobs: int = 10000,
+                 shared_store: Optional[Any] = None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_jobs = max_jobs
+        self.shared_store = shared_store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        # job id -> job record, oldest first
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        # Jobs submitted and started so far; the pool starts them in submission order, so a
+        # queued job's position is its sequence number less the jobs already started
+        self._submitted_total = 0
+        self._started_total = 0
+        # Time jobs spend queued before a worker picks them up, and time they take to run
+        self.wait_times = LatencyTracker()
+        self.run_times = LatencyTracker()
+        self.counters = {"submitted": 0, "succeeded": 0, "failed": 0, "rejected": 0}
+
+    def submit(self, work: JobWork, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Queue work and return a snapshot of the new job"""
+        with self._lock:
+            self._expire(time.monotonic())
+            if self._queued >= self.max_queued:
+                self.counters["rejected"] += 1
+                raise JobQueueFullError(f"Job queue is full ({self._queued} jobs waiting)")
+            job = {
+                "job_id": str(uuid.uuid4()),
+                "status": "queued",
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": {"stage": "queued", "shards_complete": 0, "cards_selected": 0, "tokens": 0},
+                "result": None,
+                "error": None,
+                **(metadata or {}),
+                "_submitted": time.monotonic(),
+                "_finished": None,
+                "_sequence": self._submitted_total + 1
+            }
+            self._jobs[job["job_id"]] = job
+            self._queued += 1
+            self._submitted_total += 1
+            self.counters["submitted"] += 1
+            snapshot = self._snapshot(job)
+        self._publish(snapshot)
+        self._executor.submit(self._run, job, work)
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Snapshot of a job, from this worker or, failing that, the shared store"""
+        with self._lock:
+            self._expire(time.monotonic())
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._snapshot(job)
+        if self.shared_store is None:
+            return None
+        try:
+            return self.shared_store.get_job(job_id)
+        except Exception as e:
+            logger.warning(f" Could not read job {job_id} from the shared store: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, running jobs, wait and run time percentiles, and lifetime counters"""
+        with self._lock:
+            self._expire(time.monotonic())
+            queued, running, jobs, counters = self._queued, self._running, len(self._jobs), dict(self.counters)
+        return {
+            "queued": queued,
+            "running": running,
+            "max_workers": self.max_workers,
+            "max_queued": self.max_queued,
+            "jobs_retained": jobs,
+            "wait_seconds_p50": self.wait_times.percentile(50),
+            "wait_seconds_p95": self.wait_times.percentile(95),
+            "run_seconds_p50": self.run_times.percentile(50),
+            "run_seconds_p95": self.run_times.percentile(95),
+            **counters
+        }
+
+    def approx_bytes(self) -> int:
+        """Approximate bytes held by the retained job records and their results"""
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values()]
+        return sum(approx_size(job) for job in jobs)
+
+    def _run(self, job: Dict[str, Any], work: JobWork):
+        started = time.monotonic()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._started_total += 1
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            job["progress"]["stage"] = "started"
+            snapshot = self._snapshot(job)
+        self.wait_times.record(started - job["_submitted"])
+        JOB_QUEUE_WAIT_SECONDS.observe(started - job["_submitted"])
+        self._publish(snapshot)
+
+        def on_event(event: str, data: Dict[str, Any]):
+            with self._lock:
+                progress = job["progress"]
+                if event == "stage":
+                    progress["stage"] = data.get("stage")
+                elif event == "shard_complete":
+                    progress["shards_complete"] += 1
+                elif event == "card_selected":
+                    progress["cards_selected"] += 1
+                elif event == "token":
+                    progress["tokens"] += 1
+                # Other workers see progress stage by stage, not token by token
+                snapshot = self._snapshot(job) if event == "stage" else None
+            if snapshot is not None:
+                self._publish(snapshot)
+
+        try:
+            result = work(on_event)
+            status, error = "succeeded", None
+        except Exception as e:
+            logger.error(f" Job {job['job_id']} failed: {e}")
+            result, status, error = None, "failed", str(e)
+
+        self.run_times.record(time.monotonic() - started)
+        with self._lock:
+            self._running -= 1
+            job.update(status=status, result=result, error=error, finished_at=time.time(), _finished=time.monotonic())
+            job["progress"]["stage"] = status
+            self.counters[status] += 1
+            # Finished jobs move to the end so expiry only needs to look at the front
+            self._jobs.move_to_end(job["job_id"])
+            snapshot = self._snapshot(job)
+        self._publish(snapshot)
+
+    def _snapshot(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        snapshot = {key: value for key, value in job.items() if not key.startswith("_")}
+        snapshot["progress"] = dict(job["progress"])
+        if job["status"] == "queued":
+            snapshot["queue_position"] = job["_sequence"] - self._started_total
+        return snapshot
+
+    def _publish(self, snapshot: Dict[str, Any]):
+        # A job whose record can't be shared still runs, and this worker still serves it
+        if self.shared_store is None:
+            return
+        try:
+            self.shared_store.put_job(snapshot["job_id"], snapshot, self.result_ttl_seconds)
+        except Exception as e:
+            logger.warning(f" Could not share job {snapshot['job_id']}: {e}")
+
+    def _expire(self, now: float):
+        # Drop finished jobs past their TTL, and the oldest finished jobs beyond max_jobs
+        while self._jobs:
+            job_id, job = next(iter(self._jobs.items()))
+            if job["_finished"] is None:
+                break
+            if now - job["_finished"] < self.result_ttl_seconds and len(self._jobs) <= self.max_jobs:
+                break
+            del self._jobs[job_id]
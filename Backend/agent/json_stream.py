@@ -0,0 +1,73 @@
+from typing import Dict, Any, List
+import json
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class IncrementalJSONArrayParser:
+    # Parses a JSON array of objects as it streams in, returning each object as soon as it is closed.
+    # Text before the opening '[' (e.g. a ```json fence) is ignored.
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        self.items_parsed = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Add a chunk of streamed text and return the objects completed by it"""
+        self._buffer += text
+        completed = []
+
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self._depth > 0
+            elif char in "[{":
+                if self._depth == 1 and char == "{":
+                    self._object_start = self._pos
+                self._depth += 1
+            elif char in "]}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 1 and char == "}" and self._object_start is not None:
+                    item = self._decode(self._buffer[self._object_start:self._pos + 1])
+                    if item is not None:
+                        completed.append(item)
+                    self._object_start = None
+
+            self._pos += 1
+
+        self._compact()
+        return completed
+
+    def _decode(self, text: str):
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            logger.warning(f" Skipping malformed array item: {text[:80]}")
+            return None
+        if not isinstance(item, dict):
+            return None
+        self.items_parsed += 1
+        return item
+
+    def _compact(self):
+        # Drop text that can no longer be part of an unfinished object
+        keep_from = self._object_start if self._object_start is not None else self._pos
+        if keep_from > 0:
+            self._buffer = self._buffer[keep_from:]
+            self._pos -= keep_from
+            if self._object_start is not None:
+                self._object_start -= keep_from
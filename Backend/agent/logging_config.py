@@ -0,0 +1,100 @@
+from typing import Dict, Any, Optional
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+
+# Attributes every LogRecord has; anything else on a record came from extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "payload"}
+
+class JSONFormatter(logging.Formatter):
+    # One JSON object per line: time, level, logger and message, plus any fields passed in extra=
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class PayloadSampler(logging.Filter):
+    # Lets through only a sample of the records logged with extra={"payload": True}: LLM
+    # responses, full recommendation text and other bodies too large to log for every request
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(record, "payload", False) or random.random() < self.rate
+
+class DroppingQueueHandler(QueueHandler):
+    # Hands records to the listener thread that writes them. When the queue is full the record
+    # is dropped and counted, so a slow disk never blocks a request.
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_queue_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+def configure_logging():
+    """Send all logging through a bounded queue to a console handler and a size-rotated file,
+    written by a background thread. Reads LOG_* settings from the environment; later calls do nothing."""
+    global _queue_handler, _listener
+    if _listener is not None:
+        return
+
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler()]
+    log_file = os.getenv("LOG_FILE", "credit_card_analysis.log")
+    if log_file:
+        handlers.append(RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+            backupCount=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+            encoding="utf-8",
+            delay=True
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(PayloadSampler(float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01))))
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO))
+    root.addHandler(_queue_handler)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued on shutdown
+    atexit.register(_listener.stop)
+
+def logging_stats() -> Dict[str, Any]:
+    if _queue_handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "level": logging.getLevelName(logging.getLogger().level),
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped
+    }
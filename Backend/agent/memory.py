@@ -0,0 +1,177 @@
+from typing import Dict, Any, List, Optional, Callable
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def approx_size(obj: Any, _seen: Optional[set] = None) -> int:
+    """Rough deep size in bytes of plain containers, strings, numbers, numpy arrays and the
+    attributes of plain objects"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(key, seen) + approx_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, seen) for item in obj)
+    elif hasattr(obj, "nbytes") and hasattr(obj, "dtype"):
+        # numpy arrays; getsizeof doesn't count the data of views
+        size = max(size, obj.nbytes)
+    elif hasattr(obj, "__slots__"):
+        size += sum(approx_size(getattr(obj, slot, None), seen) for slot in obj.__slots__)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += approx_size(vars(obj), seen)
+    return size
+
+def process_memory() -> Dict[str, Optional[int]]:
+    """Resident set size of this process now and at its peak, in bytes (None where unknown)"""
+    rss = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    peak = None
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        peak = peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    return {"rss_bytes": rss, "peak_rss_bytes": peak}
+
+def size_distribution(sizes: List[int]) -> Dict[str, Any]:
+    """Count, total, mean and percentiles of a list of sizes in bytes"""
+    if not sizes:
+        return {"count": 0, "total_bytes": 0}
+    ordered = sorted(sizes)
+
+    def percentile(p: float) -> int:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "total_bytes": sum(ordered),
+        "mean_bytes": round(sum(ordered) / len(ordered)),
+        "min_bytes": ordered[0],
+        "p50_bytes": percentile(50),
+        "p90_bytes": percentile(90),
+        "p99_bytes": percentile(99),
+        "max_bytes": ordered[-1]
+    }
+
+class MemoryAccountant:
+    # Approximate bytes retained by each subsystem of the API process (sessions, the catalog,
+    # the caches), measured on demand. Subsystems register a callable returning their size,
+    # or None when it can't be measured from this process (e.g. sessions kept in Redis).
+    # Measuring walks every object, so callers polling it (metrics scrapes) pass max_age
+    # to reuse a recent measurement.
+
+    def __init__(self):
+        # name -> measure
+        self._subsystems = {}
+        self._lock = threading.Lock()
+        # (measured at, sizes) of the last measurement
+        self._last = None
+
+    def register(self, name: str, measure: Callable[[], Optional[int]]):
+        with self._lock:
+            self._subsystems[name] = measure
+
+    def measure(self, max_age: Optional[float] = None) -> Dict[str, Optional[int]]:
+        """Approximate bytes per subsystem, measured now or at most max_age seconds ago"""
+        with self._lock:
+            subsystems = dict(self._subsystems)
+            last = self._last
+        if max_age is not None and last is not None and time.monotonic() - last[0] < max_age:
+            return dict(last[1])
+        sizes = {}
+        for name, measure in subsystems.items():
+            try:
+                sizes[name] = measure()
+            except Exception as e:
+                logger.warning(f" Could not measure memory of {name}: {e}")
+                sizes[name] = None
+        with self._lock:
+            self._last = (time.monotonic(), sizes)
+        return dict(sizes)
+
+    def report(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        sizes = self.measure()
+        return {
+            "process": process_memory(),
+            "subsystems_bytes": sizes,
+            "accounted_bytes": sum(size for size in sizes.values() if size),
+            "measure_seconds": round(time.perf_counter() - started, 3)
+        }
+
+class TracemallocTracker:
+    # tracemalloc snapshots diffed over time to catch leaks: each snapshot() is compared with
+    # the one before, listing the source lines whose allocations grew most in between.
+    # Tracing slows allocation down noticeably, so it only runs once started.
+
+    def __init__(self, frames: int = 1, top: int = 25):
+        self.frames = frames
+        self.top = top
+        self._previous = None
+        self._previous_at = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            logger.info(f" tracemalloc started ({self.frames} frames)")
+
+    def stop(self):
+        with self._lock:
+            self._previous = None
+            self._previous_at = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info(" tracemalloc stopped")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Take a snapshot and diff it with the previous one; the first only sets the baseline"""
+        self.start()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        now = time.monotonic()
+        with self._lock:
+            previous, previous_at = self._previous, self._previous_at
+            self._previous, self._previous_at = snapshot, now
+        result = {"traced_bytes": current, "peak_traced_bytes": peak}
+        if previous is None:
+            result["baseline"] = True
+            result["top_allocations"] = [self._entry(stat) for stat in snapshot.statistics("lineno")[:self.top]]
+            return result
+        result["baseline"] = False
+        result["seconds_since_previous"] = round(now - previous_at, 3)
+        result["top_growth"] = [self._entry(stat) for stat in snapshot.compare_to(previous, "lineno")[:self.top]]
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": True, "traced_bytes": current, "peak_traced_bytes": peak, "has_baseline": self._previous is not None}
+
+    def _entry(self, stat) -> Dict[str, Any]:
+        frame = stat.traceback[0]
+        entry = {"location": f"{frame.filename}:{frame.lineno}", "size_bytes": stat.size, "count": stat.count}
+        if hasattr(stat, "size_diff"):
+            entry["size_diff_bytes"] = stat.size_diff
+            entry["count_diff"] = stat.count_diff
+        return entry
@@ -0,0 +1,238 @@
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from contextlib import contextmanager
+from uuid import UUID
+import bisect
+import logging
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from agent.tracing import tracer
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format served at /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; LLM calls take seconds, the local stages milliseconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# (name, labels, value) samples a collector returns for one metric family
+Sample = Tuple[str, Dict[str, str], float]
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    # Monotonic counter per label combination
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    # Cumulative-bucket histogram per label combination
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    # The metrics served at /metrics. Besides its own counters and histograms it renders
+    # collectors: callables run at scrape time that turn counters kept elsewhere (e.g. the
+    # caches' stats()) into samples, so those aren't counted twice.
+
+    def __init__(self):
+        self._metrics = []
+        # (name, type, documentation, collect)
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, name: str, metric_type: str, documentation: str, collect: Callable[[], List[Sample]]):
+        with self._lock:
+            self._collectors.append((name, metric_type, documentation, collect))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, metric_type, documentation, collect in collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.warning(f" Metrics collector {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+registry = MetricsRegistry()
+
+# Wall time of the analysis stages: catalog_fetch, prompt_build, sub_agent_llm, final_llm
+# and extract_structured_cards. LLM stages are observed once per LLM call, so hedged and
+# retried attempts each count.
+STAGE_SECONDS = registry.histogram(
+    "card_analysis_stage_seconds", "Time spent in each stage of the card analysis pipeline", ("stage",)
+)
+LLM_TOKENS = registry.counter(
+    "card_analysis_llm_tokens_total", "Tokens reported by the LLM provider, by stage, model and kind (prompt or completion)",
+    ("stage", "model", "kind")
+)
+LLM_CALLS = registry.counter(
+    "card_analysis_llm_calls_total", "LLM calls by stage, model and outcome (ok or error)", ("stage", "model", "outcome")
+)
+FALLBACKS = registry.counter(
+    "card_analysis_fallbacks_total", "Times a stage fell back to the local ranker, by stage and reason", ("stage", "reason")
+)
+# Background jobs wait behind whole analyses, so the buckets run to minutes
+JOB_QUEUE_WAIT_SECONDS = registry.histogram(
+    "card_analysis_job_queue_wait_seconds", "Time background jobs spent queued before a worker started them",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+)
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    # Callback handler recording each LLM call's latency, outcome and token usage under the
+    # stage given in its config metadata (see llm_config). Streamed calls only report usage
+    # when the model is created with stream_usage=True; calls closed early report none.
+
+    def __init__(self):
+        # run id -> (stage, model, started)
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        metadata = metadata or {}
+        with self._lock:
+            self._runs[run_id] = (metadata.get("stage", "unknown"), metadata.get("ls_model_name", "unknown"), time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        run = self._finish(run_id, "ok")
+        if run is None:
+            return
+        stage, model = run
+        usage = self.usage_of(response)
+        if usage:
+            LLM_TOKENS.inc(usage["prompt_tokens"], stage=stage, model=model, kind="prompt")
+            LLM_TOKENS.inc(usage["completion_tokens"], stage=stage, model=model, kind="completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._finish(run_id, "error")
+
+    @staticmethod
+    def usage_of(response) -> Optional[Dict[str, int]]:
+        """Prompt and completion tokens of an LLMResult, None if the provider reported none"""
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    return {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0)}
+        token_usage = (response.llm_output or {}).get("token_usage")
+        if token_usage:
+            return {"prompt_tokens": token_usage.get("prompt_tokens", 0), "completion_tokens": token_usage.get("completion_tokens", 0)}
+        return None
+
+    def _finish(self, run_id: UUID, outcome: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        stage, model, started = run
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=f"{stage}_llm")
+        LLM_CALLS.inc(stage=stage, model=model, outcome=outcome)
+        return stage, model
+
+llm_metrics_handler = LLMMetricsHandler()
+
+def llm_config(stage: str, callbacks: Optional[List[BaseCallbackHandler]] = None) -> Dict[str, Any]:
+    """Runnable config for an LLM call in the given stage, recording its metrics (and span, when
+    tracing) along with any other callbacks"""
+    handlers = [llm_metrics_handler] + list(callbacks or [])
+    if tracer.enabled:
+        handlers.append(tracer.callback_handler)
+    return {"callbacks": handlers, "metadata": {"stage": stage}}
@@ -1,17 +1,55 @@
-from typing import Dict, Any, List
-from langchain_openai import ChatOpenAI
+from typing import Dict, Any, List, Optional, Callable
 from langchain.schema import HumanMessage, SystemMessage
 import os
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import closing
 import re # Added for structured card extraction
+from agent.json_stream import IncrementalJSONArrayParser
+from agent.ranker import LocalRanker, to_structured_card, narrow_candidates
+from agent.profile_parser import parse_answer, parse_profile, CREDIT_TIERS, CREDIT_TIER_RANGES, SKIPPED_ANSWER
+from agent.resilience import CircuitBreaker, ResilientCaller, CircuitOpenError, Attempt, CancelToken, RequestCancelledError, watch_cancellation
+from agent.speculation import SpeculativeCache
+from agent.retrieval import CardRetriever
+from agent.metrics import STAGE_SECONDS, FALLBACKS, llm_config
+from agent.usage import UsageLedger, add_totals, empty_totals, claim_calls
+from agent.tracing import tracer
+from agent.chat_models import create_chat_model
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Callback used to report pipeline progress, called as on_event(event_name, data)
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+# Goal keywords and the label shard prompts see for them, first match wins
+SHARD_GOALS = [
+    ("travel", "Travel rewards"),
+    ("cash", "Cash back"),
+    ("build", "Building credit"),
+    ("balance", "Balance transfer / low interest"),
+    ("interest", "Balance transfer / low interest"),
+    ("apr", "Balance transfer / low interest")
+]
+
+# Monthly spending band edges in dollars, used to group profiles for shared shard work
+SPENDING_BANDS = [0, 500, 1000, 2000, 3500, 5000, 10000]
+
+# Profile fields the shard prompts read; credit_situation can be guessed from the credit score
+SHARD_FIELDS = ["primary_goal", "credit_score", "monthly_spending", "credit_situation"]
+
 class State:
     # initiating the state for the conversation and initializing the required fields/parameters
+    # Slots keep each of the many long-lived session states small
+    __slots__ = ('user_profile', 'parsed_profile', 'conversation_history', 'current_question',
+                 'analysis_result', 'questions_completed', 'usage')
+
+    # History entry standing in for the recommendation, which is stored once in analysis_result
+    RECOMMENDATION_ENTRY = {'role': 'assistant', 'ref': 'recommendation'}
+
     def __init__(self):
         self.user_profile = {
             'primary_goal': None,
@@ -24,22 +62,75 @@ class State:
             'credit_score': None,
             'credit_situation': None
         }
+        # Typed form of each answer (numeric ranges, category keys), parsed once when it arrives
+        self.parsed_profile = {field: None for field in self.user_profile}
         self.conversation_history = []
         self.current_question = None
         self.analysis_result = None
         self.questions_completed = False
+        # Running LLM usage totals of every recommendation made in this session
+        self.usage = None
+
+    def history_for_display(self) -> List[Dict[str, Any]]:
+        """Conversation history with the recommendation entry resolved to its content"""
+        recommendation = (self.analysis_result or {}).get("recommendation")
+        return [
+            {'role': 'assistant', 'content': recommendation} if entry.get('ref') == 'recommendation' else entry
+            for entry in self.conversation_history
+        ]
+
+class ShardProgress:
+    # Cards a sub-agent has selected so far, shared between its worker thread and the coordinator
+    # so a straggling shard can be cut off without losing what it already streamed
+    def __init__(self, agent_id: str):
+        self.agent_id = agent_id
+        self.selected_cards = []
+        self.cards = []
+        self.cut_off = threading.Event()
+        self._lock = threading.Lock()
+        self._names = set()
+        # LLM calls of every attempt, kept across reset() since they were made either way
+        self.usage = UsageLedger()
+    
+    def reset(self):
+        # Forget the selection of a failed attempt so a retry can start over
+        with self._lock:
+            self.selected_cards = []
+            self._names = set()
+    
+    def add(self, card: Dict[str, Any]) -> bool:
+        # Returns False if the card was already selected
+        with self._lock:
+            if card.get("name") in self._names:
+                return False
+            self._names.add(card.get("name"))
+            self.selected_cards.append(card)
+            return True
+    
+    def partial_result(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "agent_id": self.agent_id,
+                "selected_cards": list(self.selected_cards),
+                "total_analyzed": len(self.cards),
+                "llm_response": "Cut off before completion",
+                "cut_off": True,
+                "usage": self.usage.calls()
+            }
 
 class QuestionAskerNode:
     
     
-    def __init__(self):
-        # LLM Configuration
-        self.llm = ChatOpenAI(
+    def __init__(self, planner=None):
+        # LLM Configuration (LLM_PROVIDER=fake for an offline stand-in)
+        self.llm = create_chat_model(
             model="gpt-3.5-turbo",  # Changed from gpt-4 to reduce token usage
-            temperature=0.7,  # ⚠️ EDIT HERE for creativity
-            api_key=os.getenv("OPENAI_API_KEY")
+            temperature=0.7  # ⚠️ EDIT HERE for creativity
         )
         
+        # Optional QuestionPlanner choosing the question order and when to stop; without one
+        # every question is asked in the order below
+        self.planner = planner
        
         self.questions = [
             {
@@ -97,6 +188,7 @@ class QuestionAskerNode:
         if user_response and state.current_question:
             field = state.current_question['field']
             state.user_profile[field] = user_response
+            state.parsed_profile[field] = parse_answer(field, user_response)
             state.conversation_history.append({
                 'role': 'user',
                 'content': user_response
@@ -121,7 +213,11 @@ class QuestionAskerNode:
                 "current_question": next_question['field']
             }
         else:
-            # All questions completed
+            # All questions completed; the planner may have found the rest can't change the result
+            if self.planner is not None:
+                for field, value in state.user_profile.items():
+                    if value is None:
+                        state.user_profile[field] = SKIPPED_ANSWER
             state.questions_completed = True
             return {
                 "response": "Perfect! I have all the information I need. Let me analyze your profile and find the best credit cards for you.",
@@ -154,6 +250,7 @@ class QuestionAskerNode:
             
             # Update the state with complete profile
             state.user_profile.update(complete_profile)
+            state.parsed_profile.update(parse_profile(complete_profile))
             state.questions_completed = True
             
             # Add to conversation history
@@ -177,6 +274,9 @@ class QuestionAskerNode:
     
     def get_next_question(self, state: State) -> Dict[str, Any]:
         # Get the next unanswered question
+        if self.planner is not None:
+            field = self.planner.next_field(state.user_profile, state.parsed_profile)
+            return next((question_data for question_data in self.questions if question_data['field'] == field), None)
         for question_data in self.questions:
             if state.user_profile[question_data['field']] is None:
                 return question_data
@@ -192,137 +292,514 @@ class FinalAnalysisNode:
     # Node responsible for final analysis and recommendations
     
     def __init__(self, tools: Dict[str, Any]):
-        # LLM Configuration
-        self.llm = ChatOpenAI(
+        # LLM Configuration (LLM_PROVIDER=fake for an offline stand-in)
+        self.llm = create_chat_model(
             model="gpt-3.5-turbo",  # Changed from gpt-4 to reduce token usage
             temperature=0.3,  
-            api_key=os.getenv("OPENAI_API_KEY")
+            timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "30")),
+            max_retries=0,  # Retries are handled by the resilient callers below
+            stream_usage=True  # Streamed responses report their token usage too
         )
         self.tools = tools
+        self.ranker = LocalRanker()
+        
+        # Resilience: one circuit breaker for the provider, shared by every stage. While it is open
+        # sub-agents and the final stage use the deterministic local ranker instead of the LLM.
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+        )
+        caller_config = {
+            "max_attempts": int(os.getenv("LLM_MAX_ATTEMPTS", "3")),
+            "backoff_base": float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5")),
+            "hedge_percentile": float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+            "default_hedge_delay": float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "8"))
+        }
+        self.shard_caller = ResilientCaller("sub_agent", self.breaker, **caller_config)
+        self.final_caller = ResilientCaller("final_agent", self.breaker, **caller_config)
+        self.final_deadline_seconds = float(os.getenv("FINAL_DEADLINE_SECONDS", "45"))
+        
+        # Shard pipelining: the final stage starts once SHARD_QUORUM sub-agents have finished and the
+        # stragglers have had SHARD_STRAGGLER_GRACE_SECONDS more, or when SHARD_DEADLINE_SECONDS pass.
+        # Stragglers are cut off and contribute the cards they have streamed so far.
+        self.shard_quorum = int(os.getenv("SHARD_QUORUM", "2"))
+        self.shard_straggler_grace_seconds = float(os.getenv("SHARD_STRAGGLER_GRACE_SECONDS", "3"))
+        self.shard_deadline_seconds = float(os.getenv("SHARD_DEADLINE_SECONDS", "30"))
+        
+        # Speculation during the /chat questionnaire: shard selections start as soon as the fields
+        # their prompt needs are known, guessing the credit situation from the credit score until
+        # it is answered, and the final selection starts as soon as the last answer arrives.
+        self.speculation_enabled = os.getenv("SPECULATION_ENABLED", "true").lower() == "true"
+        speculation_workers = int(os.getenv("SPECULATION_WORKERS", "4"))
+        speculation_ttl = float(os.getenv("SPECULATION_TTL_SECONDS", "300"))
+        self.speculative_shards = SpeculativeCache("shards", speculation_workers, ttl_seconds=speculation_ttl)
+        # A final recommendation is billed to, and used by, the one request that takes it
+        self.speculative_finals = SpeculativeCache("final", speculation_workers, ttl_seconds=speculation_ttl, take_once=True)
+        
+        # Candidate recall: at most RETRIEVAL_TOP_K narrowed cards closest to the profile reach the
+        # sub-agents, so their prompts stay the same size as the catalog grows (0 disables it)
+        self.retriever = CardRetriever(
+            top_k=int(os.getenv("RETRIEVAL_TOP_K", "36")) or None,
+            dimensions=int(os.getenv("RETRIEVAL_DIMENSIONS", "1024"))
+        )
+        if self.retriever.top_k and "final_agent" in tools:
+            try:
+                self.retriever.index_for(tools["final_agent"].get_all_cards())
+            except Exception as e:
+                # Built on first use instead
+                logger.warning(f" Could not build the card retrieval index: {e}")
     
    
-    def analyze_and_recommend(self, state: State) -> Dict[str, Any]:
-        """Perform final analysis using parallel sub-agents and final decision maker"""
+    @tracer.traced("analysis")
+    def analyze_and_recommend(self, state: State, on_event: Optional[EventCallback] = None, cancel: Optional[CancelToken] = None,
+                              session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Perform final analysis using parallel sub-agents and final decision maker
+
+        If on_event is given it receives progress events as the pipeline runs:
+        "stage", "card_selected", "shard_complete", "shard_cut_off" and one "token" event per
+        streamed chunk of the final answer. Cancelling cancel stops the pending LLM calls and
+        raises RequestCancelledError, leaving state without a recommendation. With session_id,
+        a final recommendation speculated for this session and these answers is used if there is one.
+        """
         
         try:
             logger.info("Starting Analysis...")
-            print("Starting Analysis")
-            
-            # Get sub-agents
-            sub_agent_0 = self.tools.get("sub_agent_0")
-            sub_agent_1 = self.tools.get("sub_agent_1")
-            sub_agent_2 = self.tools.get("sub_agent_2")
-            final_agent = self.tools.get("final_agent")
-            
-            logger.info("🔧 Retrieved tools from toolset")
-            
-            if not all([sub_agent_0, sub_agent_1, sub_agent_2, final_agent]):
-                logger.error(" Required tools not available")
-                raise Exception("Required tools not available")
-            
-            # Run sub-agents in parallel with LLM analysis
-            logger.info("🔄 Running sub-agents in parallel with LLM analysis...")
-            print(f"Running sub-agents in parallel with LLM analysis...")
-            
-            # Use ThreadPoolExecutor for parallel execution & Using Logging to see on our Backend Server when Hosted
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                logger.info(" Submitting sub-agents to thread pool...")
-                # Submit all three sub-agents to run in parallel
-                future_0 = executor.submit(self._run_sub_agent_llm, sub_agent_0, state.user_profile)
-                future_1 = executor.submit(self._run_sub_agent_llm, sub_agent_1, state.user_profile)
-                future_2 = executor.submit(self._run_sub_agent_llm, sub_agent_2, state.user_profile)
-                
-                logger.info("⏳ Waiting for sub-agent results...")
-                # Get results from all three sub-agents
-                result_0 = future_0.result()
-                result_1 = future_1.result()
-                result_2 = future_2.result()
-            
-            logger.info(f" Sub-agent 0 selected {len(result_0.get('selected_cards', []))} cards")
-            logger.info(f"Sub-agent 1 selected {len(result_1.get('selected_cards', []))} cards")
-            logger.info(f" Sub-agent 2 selected {len(result_2.get('selected_cards', []))} cards")
-           
             
-            # Combine selected cards from all three sub-agents
-            combined_cards = []
-            combined_cards.extend(result_0.get("selected_cards", []))
-            combined_cards.extend(result_1.get("selected_cards", []))
-            combined_cards.extend(result_2.get("selected_cards", []))
+            # Degraded mode: don't queue up LLM calls the circuit breaker would reject anyway
+            if self.breaker.state == "open":
+                logger.warning(" LLM provider circuit is open, using local ranking")
+                FALLBACKS.inc(stage="analysis", reason="circuit_open")
+                return self.analyze_locally(state, on_event=on_event, mode="degraded")
             
-            logger.info(f" Combining selected cards from all three sub-agents")
-           
+            if self.speculation_enabled:
+                speculative = self._take_speculative_recommendation(state, session_id, on_event, cancel) if session_id else None
+                if speculative is not None:
+                    return speculative
+                shard_results = self._take_speculative_shard_results(state, cancel)
+            else:
+                shard_results = None
+            if shard_results is None:
+                shard_results = self.select_candidates(state, on_event, cancel)
+            return self.recommend_from_candidates(state, shard_results, on_event, cancel)
             
-            # Use final agent to select best 3 cards from the combined selection
-            logger.info(" Starting final agent analysis")
+        except Exception as e:
+            logger.error(f" Error in analyze_and_recommend: {e}")
+            error_response = f"I apologize, but I encountered an error while analyzing your profile: {str(e)}. Please try again."
+            state.conversation_history.append({
+                'role': 'assistant',
+                'content': error_response
+            })
             
-            # Use the combined cards from sub-agents instead of loading all cards again
-            final_cards = combined_cards
-            user_profile = state.user_profile
-            selection_instructions = "Select the BEST 3 cards from the pre-filtered selection."
+            return {
+                "response": error_response,
+                "is_complete": True,
+                "analysis_result": None
+            }
+    
+    def shard_profile(self, user_profile: Dict[str, Any], parsed_profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Normalized copy of the profile fields the shard prompts read (goal, credit score, spending
+        and credit situation). Profiles with equal shard profiles get the same shard selections."""
+        parsed = parsed_profile if parsed_profile is not None else parse_profile(user_profile)
+        
+        goal = parsed.get("primary_goal") or ""
+        for keyword, label in SHARD_GOALS:
+            if keyword in goal:
+                goal = label
+                break
+        
+        credit_score = parsed.get("credit_score")
+        if credit_score:
+            tier = CREDIT_TIERS[credit_score["tier"]]
+            low, high = CREDIT_TIER_RANGES[tier]
+            credit_score = f"{tier.capitalize()} ({low}-{high})"
+        else:
+            credit_score = str(user_profile.get("credit_score") or "").strip()
+        
+        spending = parsed.get("monthly_spending")
+        if spending:
+            low = max([band for band in SPENDING_BANDS if band <= spending["value"]], default=0)
+            higher = [band for band in SPENDING_BANDS if band > spending["value"]]
+            spending = f"${low:,}-${higher[0]:,}" if higher else f"${low:,}+"
+        else:
+            spending = str(user_profile.get("monthly_spending") or "").strip()
+        
+        situation = parsed.get("credit_situation") or {}
+        if situation.get("is_student"):
+            situation = "Student with little history"
+        elif situation.get("is_building"):
+            situation = "Building/rebuilding credit"
+        else:
+            situation = "Established credit"
+        
+        return {
+            "primary_goal": goal,
+            "credit_score": credit_score,
+            "monthly_spending": spending,
+            "credit_situation": situation
+        }
+    
+    def shard_state(self, user_profile: Dict[str, Any], parsed_profile: Dict[str, Any]) -> State:
+        """State for a shared shard run: the profile with the normalized shard fields every
+        profile with the same shard_profile() has"""
+        shard_state = State()
+        shard_state.user_profile.update(user_profile)
+        shard_state.user_profile.update(self.shard_profile(user_profile, parsed_profile))
+        shard_state.parsed_profile.update(parsed_profile)
+        return shard_state
+    
+    def speculate(self, state: State, session_id: Optional[str] = None):
+        """Start shard and final selection work for a questionnaire still in progress, so the
+        recommendation is ready, or nearly, when the last answer arrives. Shard selections are
+        shared by every session with the same shard profile; the final selection is only started
+        with a session_id, and only that session's analysis takes it."""
+        if not self.speculation_enabled or self.breaker.state == "open":
+            return
+        # Answered or skipped by the question planner
+        if any(state.user_profile[field] is None for field in SHARD_FIELDS if field != "credit_situation"):
+            return
+        parsed = state.parsed_profile
+        try:
+            if state.user_profile["credit_situation"] is None:
+                # Guess the answer still to come: low scores usually mean building credit
+                credit_score = parsed.get("credit_score")
+                parsed = dict(parsed, credit_situation={"is_student": False, "is_building": bool(credit_score) and credit_score["tier"] <= 1})
+            shard_key = json.dumps(self.shard_profile(state.user_profile, parsed), sort_keys=True)
+            shard_future = self.speculative_shards.start(shard_key, self.select_candidates, self.shard_state(state.user_profile, parsed))
             
-            logger.info(" Final agent analyzing pre-filtered cards from sub-agents")
+            if session_id and all(value is not None for value in state.user_profile.values()):
+                self.speculative_finals.start(
+                    self._final_key(session_id, state.user_profile),
+                    self._speculative_recommendation, dict(state.user_profile), dict(state.parsed_profile), shard_future
+                )
+        except Exception as e:
+            # Speculation only saves time; the questionnaire goes on without it
+            logger.warning(f" Could not start speculative analysis: {e}")
+    
+    @tracer.traced("analysis.select_candidates")
+    def select_candidates(self, state: State, on_event: Optional[EventCallback] = None, cancel: Optional[CancelToken] = None) -> Dict[str, Dict[str, Any]]:
+        """Run the three shard sub-agents for the profile in state, returning each one's result by agent id"""
+        # Get sub-agents
+        sub_agent_0 = self.tools.get("sub_agent_0")
+        sub_agent_1 = self.tools.get("sub_agent_1")
+        sub_agent_2 = self.tools.get("sub_agent_2")
+        final_agent = self.tools.get("final_agent")
+        
+        logger.info("🔧 Retrieved tools from toolset")
+        
+        if not all([sub_agent_0, sub_agent_1, sub_agent_2, final_agent]):
+            logger.error(" Required tools not available")
+            raise Exception("Required tools not available")
+        
+        # Drop the cards the answers rule out before the sub-agents split the catalog
+        with STAGE_SECONDS.time(stage="catalog_fetch"):
+            catalog = final_agent.get_all_cards()
+        candidates = narrow_candidates(catalog, state.parsed_profile)
+        if self.retriever.top_k:
+            candidates = self.retriever.retrieve(catalog, candidates, self.shard_profile(state.user_profile, state.parsed_profile))
+        logger.info(f" Narrowed the catalog to {len(candidates)} candidate cards")
+        tracer.annotate(catalog_cards=len(catalog), candidate_cards=len(candidates))
+        
+        # Run sub-agents in parallel with LLM analysis
+        logger.info("🔄 Running sub-agents in parallel with LLM analysis...")
+        self._emit(on_event, "stage", {"stage": "sub_agents", "total_shards": 3, "candidate_cards": len(candidates)})
+        
+        # Use ThreadPoolExecutor for parallel execution & Using Logging to see on our Backend Server when Hosted
+        # The pool is not used as a context manager: cut-off stragglers must not hold up the final stage
+        executor = ThreadPoolExecutor(max_workers=3)
+        try:
+            logger.info(" Submitting sub-agents to thread pool...")
+            progress = {agent_id: ShardProgress(agent_id) for agent_id in ("agent_0", "agent_1", "agent_2")}
+            # Submit all three sub-agents to run in parallel
+            futures = {
+                executor.submit(tracer.wrap(self._run_sub_agent_llm), sub_agent_0, state.user_profile, progress["agent_0"], on_event, cancel, candidates): "agent_0",
+                executor.submit(tracer.wrap(self._run_sub_agent_llm), sub_agent_1, state.user_profile, progress["agent_1"], on_event, cancel, candidates): "agent_1",
+                executor.submit(tracer.wrap(self._run_sub_agent_llm), sub_agent_2, state.user_profile, progress["agent_2"], on_event, cancel, candidates): "agent_2"
+            }
+            
+            logger.info("⏳ Waiting for sub-agent results...")
+            results = self._collect_shard_results(futures, progress, state, on_event, cancel)
+        finally:
+            executor.shutdown(wait=False)
+        return results
+    
+    @tracer.traced("analysis.final_selection")
+    def recommend_from_candidates(self, state: State, shard_results: Dict[str, Dict[str, Any]], on_event: Optional[EventCallback] = None, cancel: Optional[CancelToken] = None, claim_shards: bool = True) -> Dict[str, Any]:
+        """Pick the final recommendation for the profile in state from the sub-agents' selections
+
+        The shard results may come from another profile with the same shard_profile(), so one
+        shard run can serve many profiles. Its calls are billed to the first recommendation that
+        claims them and listed as shared by the others; claim_shards=False lists them as shared
+        and leaves the claim to whoever takes the recommendation (see _take_speculative_recommendation).
+        """
+        result_0 = shard_results["agent_0"]
+        result_1 = shard_results["agent_1"]
+        result_2 = shard_results["agent_2"]
+        
+        logger.info(f" Sub-agent 0 selected {len(result_0.get('selected_cards', []))} cards")
+        logger.info(f"Sub-agent 1 selected {len(result_1.get('selected_cards', []))} cards")
+        logger.info(f" Sub-agent 2 selected {len(result_2.get('selected_cards', []))} cards")
+       
+        
+        # Combine selected cards from all three sub-agents
+        combined_cards = []
+        combined_cards.extend(result_0.get("selected_cards", []))
+        combined_cards.extend(result_1.get("selected_cards", []))
+        combined_cards.extend(result_2.get("selected_cards", []))
+        
+        logger.info(f" Combining selected cards from all three sub-agents")
+       
+        
+        # Use final agent to select best 3 cards from the combined selection
+        logger.info(" Starting final agent analysis")
+        
+        # Use the combined cards from sub-agents instead of loading all cards again
+        final_cards = combined_cards
+        user_profile = state.user_profile
+        selection_instructions = "Select the BEST 3 cards from the pre-filtered selection."
+        
+        logger.info(" Final agent analyzing pre-filtered cards from sub-agents")
+        
+        # Generate final recommendation using LLM analysis
+        logger.info("Starting final recommendation generation")
+        self._emit(on_event, "stage", {"stage": "final_selection", "candidate_cards": len(final_cards)})
+        tracer.annotate(candidate_cards=len(final_cards))
+        on_token = (lambda text: on_event("token", {"text": text})) if on_event else None
+        # Calls this recommendation used: its shards' and its own final call
+        usage = UsageLedger()
+        self._add_shard_usage(usage, shard_results, claim=claim_shards)
+        recommendation = self._generate_llm_recommendation(
+            user_profile, 
+            final_cards,
+            selection_instructions,
+            on_token=on_token,
+            cancel=cancel,
+            usage=usage
+        )
+        self._annotate_annual_values(recommendation.get("structured_cards", []), user_profile, state.parsed_profile)
+        
+        state.analysis_result = {
+            "recommendation": recommendation,
+            "mode": "llm",
+            "all_cards_analyzed": len(final_cards),
+            "user_profile": user_profile,
+            "sub_agent_results": {
+                "agent_0": result_0.get("cards_analyzed", 0),
+                "agent_1": result_1.get("cards_analyzed", 0),
+                "agent_2": result_2.get("cards_analyzed", 0)
+            },
+            "usage": usage.summary()
+        }
+        state.usage = add_totals(state.usage, state.analysis_result["usage"]["totals"])
+        
+        logger.info(" Analysis completed successfully")
+        
+        state.conversation_history.append(dict(State.RECOMMENDATION_ENTRY))
+        
+        return {
+            "response": recommendation,
+            "is_complete": True,
+            "analysis_result": state.analysis_result
+        }
+    
+    @tracer.traced("analysis.local_ranking")
+    def analyze_locally(self, state: State, on_event: Optional[EventCallback] = None, mode: str = "fast") -> Dict[str, Any]:
+        """Recommend cards with the deterministic local ranker over the whole catalog, without any LLM calls"""
+        try:
+            logger.info(f"Starting local ranking ({mode} mode)...")
+            self._emit(on_event, "stage", {"stage": "local_ranking", "mode": mode})
             
-            # Generate final recommendation using LLM analysis
-            logger.info("Starting final recommendation generation")
-            recommendation = self._generate_llm_recommendation(
-                user_profile, 
-                final_cards,
-                selection_instructions
-            )
+            with STAGE_SECONDS.time(stage="catalog_fetch"):
+                all_cards = self.tools["final_agent"].get_all_cards()
+            recommendation = self.ranker.recommend(all_cards, state.user_profile, parsed_profile=state.parsed_profile)
+            tracer.annotate(mode=mode, cards=len(all_cards))
             
             state.analysis_result = {
                 "recommendation": recommendation,
-                "all_cards_analyzed": len(final_cards),
-                "user_profile": user_profile,
-                "sub_agent_results": {
-                    "agent_0": result_0.get("cards_analyzed", 0),
-                    "agent_1": result_1.get("cards_analyzed", 0),
-                    "agent_2": result_2.get("cards_analyzed", 0)
-                }
+                "mode": mode,
+                "all_cards_analyzed": len(all_cards),
+                "user_profile": state.user_profile,
+                "usage": {"totals": empty_totals(), "shared_totals": empty_totals(), "calls": []}
             }
-            
-            logger.info(" Analysis completed successfully")
-            
-            state.conversation_history.append({
-                'role': 'assistant',
-                'content': recommendation
-            })
+            state.conversation_history.append(dict(State.RECOMMENDATION_ENTRY))
             
             return {
                 "response": recommendation,
                 "is_complete": True,
                 "analysis_result": state.analysis_result
             }
-            
         except Exception as e:
-            logger.error(f" Error in analyze_and_recommend: {e}")
+            logger.error(f" Error in analyze_locally: {e}")
             error_response = f"I apologize, but I encountered an error while analyzing your profile: {str(e)}. Please try again."
             state.conversation_history.append({
                 'role': 'assistant',
                 'content': error_response
             })
-            
             return {
                 "response": error_response,
                 "is_complete": True,
                 "analysis_result": None
             }
     
-    def _run_sub_agent_llm(self, sub_agent, user_profile: Dict[str, Any]) -> Dict[str, Any]:
-        """Run LLM analysis for a sub-agent to reduce card selection by 50%"""
+    def _speculative_recommendation(self, user_profile: Dict[str, Any], parsed_profile: Dict[str, Any], shard_future) -> Dict[str, Any]:
+        # Final selection on a scratch state, applied to the real one when a request takes it
+        scratch = State()
+        scratch.user_profile.update(user_profile)
+        scratch.parsed_profile.update(parsed_profile)
+        shard_results = shard_future.result()
+        # No request has used it yet, so the shard calls are claimed when one takes it
+        return dict(self.recommend_from_candidates(scratch, shard_results, claim_shards=False), shard_results=shard_results)
+    
+    def _add_shard_usage(self, usage: UsageLedger, shard_results: Dict[str, Dict[str, Any]], claim: bool = True):
+        """Add each shard's calls to usage, as shared unless this is the first claim on them"""
+        for agent_id in ("agent_0", "agent_1", "agent_2"):
+            result = shard_results[agent_id]
+            usage.extend(result.get("usage", []), shared=not (claim and claim_calls(result)))
+    
+    def _await_speculation(self, future, cancel: Optional[CancelToken]) -> Optional[Any]:
+        """Result of speculative work, or None if it failed"""
+        with watch_cancellation(cancel) as cancelled:
+            wait([future, cancelled], return_when=FIRST_COMPLETED)
+            if cancelled.done():
+                raise RequestCancelledError("Request was cancelled while waiting for speculative work")
+        try:
+            return future.result()
+        except Exception as e:
+            logger.warning(f" Speculative work failed, running it again: {e}")
+            return None
+    
+    def _final_key(self, session_id: str, user_profile: Dict[str, Any]) -> str:
+        # Scoped to the session, so a speculative final never answers another session's request
+        return json.dumps([session_id, user_profile], sort_keys=True)
+    
+    def _take_speculative_recommendation(self, state: State, session_id: str, on_event: Optional[EventCallback], cancel: Optional[CancelToken]) -> Optional[Dict[str, Any]]:
+        future = self.speculative_finals.take(self._final_key(session_id, state.user_profile))
+        if future is None:
+            return None
+        self._emit(on_event, "stage", {"stage": "speculative_final", "ready": future.done()})
+        result = self._await_speculation(future, cancel)
+        if result is None:
+            return None
+        logger.info(" Using the speculative recommendation")
+        # Bill the shard calls to this request unless another already used the same shard run
+        usage = UsageLedger()
+        self._add_shard_usage(usage, result["shard_results"])
+        usage.extend([call for call in result["analysis_result"]["usage"]["calls"] if not call.get("shared")])
+        state.analysis_result = dict(result["analysis_result"], user_profile=state.user_profile, usage=usage.summary())
+        state.usage = add_totals(state.usage, state.analysis_result["usage"]["totals"])
+        state.conversation_history.append(dict(State.RECOMMENDATION_ENTRY))
+        return {
+            "response": state.analysis_result["recommendation"],
+            "is_complete": True,
+            "analysis_result": state.analysis_result
+        }
+    
+    def _take_speculative_shard_results(self, state: State, cancel: Optional[CancelToken]) -> Optional[Dict[str, Dict[str, Any]]]:
+        future = self.speculative_shards.take(json.dumps(self.shard_profile(state.user_profile, state.parsed_profile), sort_keys=True))
+        if future is None:
+            return None
+        logger.info(" Using speculative shard selections")
+        return self._await_speculation(future, cancel)
+    
+    def _annotate_annual_values(self, structured_cards: List[Dict[str, Any]], user_profile: Dict[str, Any], parsed_profile: Optional[Dict[str, Any]] = None):
+        """Add the estimated net annual value in dollars to each recommended card"""
+        try:
+            catalog = self.tools["final_agent"].get_all_cards()
+            values = dict(zip((card.get("name") for card in catalog), self.ranker.annual_values(catalog, user_profile, parsed_profile)))
+            for card in structured_cards:
+                if card.get("name") in values:
+                    card["estimated_annual_value"] = round(values[card["name"]], 2)
+        except Exception as e:
+            logger.warning(f" Could not estimate annual card values: {e}")
+    
+    def _emit(self, on_event: Optional[EventCallback], event: str, data: Dict[str, Any]):
+        """Send a progress event to the caller, never letting a broken listener stop the analysis"""
+        if on_event is None:
+            return
+        try:
+            on_event(event, data)
+        except Exception as e:
+            logger.warning(f" Progress listener failed on '{event}' event: {e}")
+    
+    def _collect_shard_results(self, futures: Dict[Any, str], progress: Dict[str, ShardProgress], state: State, on_event: Optional[EventCallback] = None, cancel: Optional[CancelToken] = None) -> Dict[str, Dict[str, Any]]:
+        """Wait for sub-agents until the quorum plus grace period or the deadline, then cut off the stragglers"""
+        results = {}
+        pending = set(futures)
+        deadline = time.monotonic() + self.shard_deadline_seconds
+        quorum_reached_at = None
+        
+        with watch_cancellation(cancel) as cancelled:
+            while pending:
+                cutoff = deadline
+                if quorum_reached_at is not None:
+                    cutoff = min(deadline, quorum_reached_at + self.shard_straggler_grace_seconds)
+                remaining = cutoff - time.monotonic()
+                if remaining <= 0:
+                    break
+                
+                # Collect results as each sub-agent finishes so progress can be reported early
+                done, pending = wait(pending | {cancelled}, timeout=remaining, return_when=FIRST_COMPLETED)
+                pending.discard(cancelled)
+                if cancelled.done():
+                    # The sub-agents' own calls see the cancellation too; stop them streaming now
+                    for shard in progress.values():
+                        shard.cut_off.set()
+                    raise RequestCancelledError("Request was cancelled while the sub-agents ran")
+                for future in done:
+                    agent_id = futures[future]
+                    results[agent_id] = future.result()
+                    self._emit(on_event, "shard_complete", {
+                        "agent_id": agent_id,
+                        "selected_cards": len(results[agent_id].get("selected_cards", [])),
+                        "completed_shards": len(results),
+                        "total_shards": len(futures)
+                    })
+                
+                if quorum_reached_at is None and len(results) >= self.shard_quorum:
+                    quorum_reached_at = time.monotonic()
+        
+        # Cut off stragglers and keep the cards they have streamed so far
+        for future in pending:
+            agent_id = futures[future]
+            progress[agent_id].cut_off.set()
+            results[agent_id] = progress[agent_id].partial_result()
+            if not results[agent_id]["selected_cards"]:
+                # Nothing streamed before the cut-off, so rank the shard locally instead of dropping it
+                shard_cards = progress[agent_id].cards
+                results[agent_id]["selected_cards"] = self.ranker.rank(shard_cards, state.user_profile, state.parsed_profile)[:len(shard_cards)//2]
+                results[agent_id]["fallback"] = True
+                FALLBACKS.inc(stage="sub_agent", reason="cut_off")
+            logger.warning(f" {agent_id.upper()} cut off with {len(results[agent_id]['selected_cards'])} cards selected so far")
+            self._emit(on_event, "shard_cut_off", {
+                "agent_id": agent_id,
+                "selected_cards": len(results[agent_id]["selected_cards"])
+            })
+        
+        return results
+    
+    @tracer.traced("sub_agent")
+    def _run_sub_agent_llm(self, sub_agent, user_profile: Dict[str, Any], progress: Optional[ShardProgress] = None, on_event: Optional[EventCallback] = None,
+                           cancel: Optional[CancelToken] = None, candidates: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Run LLM analysis for a sub-agent to reduce card selection by 50%
+
+        The response is streamed and parsed incrementally, so each selected card is recorded on
+        progress as soon as its JSON object is complete. Streaming stops early if progress is cut off.
+        """
+        if progress is None:
+            progress = ShardProgress("unknown")
         try:
             logger.info(f" Starting sub-agent LLM analysis")
           
+            prompt_started = time.perf_counter()
             # Get sub-agent data
-            sub_agent_data = sub_agent._run(user_profile)
+            sub_agent_data = sub_agent._run(user_profile, cards=candidates)
             cards_to_analyze = sub_agent_data.get("cards", [])
             analysis_prompt = sub_agent_data.get("analysis_prompt", "")
             agent_id = sub_agent_data.get("agent_id", "unknown")
+            tracer.annotate(agent_id=agent_id, cards=len(cards_to_analyze))
             
          
            
-            for i, card in enumerate(cards_to_analyze[:3]):
-                print(f"  {i+1}. {card.get('name', 'Unknown')}")
+            logger.debug("%s first cards: %s", agent_id.upper(), [card.get('name', 'Unknown') for card in cards_to_analyze[:3]])
             
             
             # Check if user is a student
@@ -361,82 +838,103 @@ Example format:
                 SystemMessage(content=f"You are a specialized credit card analyst ({agent_id.upper()}). Your job is to analyze cards and select the top 50% most relevant ones."),
                 HumanMessage(content=prompt)
             ]
+            STAGE_SECONDS.observe(time.perf_counter() - prompt_started, stage="prompt_build")
             
          
-            response = self.llm.invoke(messages)
-            logger.info(f" response received ({len(response.content)} characters)")
-            print(f"  LLM response received ({len(response.content)} characters)")
-            print(f" response preview: {response.content[:200]}...")
+            progress.cards = cards_to_analyze
+            cards_by_name = {card.get("name"): card for card in cards_to_analyze}
             
-            # Parse the response to extract selected cards
-            try:
-                import json
-                selected_cards_data = json.loads(response.content)
-                selected_cards = []
-                
-                logger.info(f"🔍 {agent_id.upper()} parsing LLM response...")
-                print(f" DEBUG: {agent_id.upper()} - Parsing LLM response...")
-                print(f" DEBUG: {agent_id.upper()} - LLM returned {len(selected_cards_data)} card selections")
-                
-                for i, card_data in enumerate(selected_cards_data):
-                    card_name = card_data.get("name", "")
-                    print(f" DEBUG: {agent_id.upper()} - LLM selected card {i+1}: '{card_name}'")
-                    
-                    # Find the full card data by name
-                    found_card = None
-                    for card in cards_to_analyze:
-                        if card.get("name") == card_name:
-                            found_card = card
-                            print(f" DEBUG: {agent_id.upper()} - Found matching card: '{card_name}'")
-                            break
+            def resolve(card_data: Dict[str, Any]):
+                # Find the full card data by name
+                card_name = card_data.get("name", "")
+                found_card = cards_by_name.get(card_name)
+                if found_card is None:
+                    logger.debug("%s - No match found for LLM card: '%s'", agent_id.upper(), card_name)
+                elif progress.add(found_card):
+                    self._emit(on_event, "card_selected", {"agent_id": agent_id, "name": card_name})
+            
+            def stream_attempt(attempt: Attempt) -> str:
+                # Stream the response and resolve selected cards as their JSON objects complete
+                parser = IncrementalJSONArrayParser()
+                chunks = []
+                try:
+                    # Closing the stream when we stop early also closes its HTTP response
+                    with closing(self.llm.stream(messages, config=llm_config("sub_agent", [progress.usage]))) as stream:
+                        for chunk in stream:
+                            if attempt.cancelled.is_set():
+                                raise RuntimeError(f"attempt {attempt.number} cancelled")
+                            chunks.append(chunk.content)
+                            for card_data in parser.feed(chunk.content):
+                                if not attempt.claim():
+                                    raise RuntimeError(f"attempt {attempt.number} lost to a faster attempt")
+                                resolve(card_data)
+                            if progress.cut_off.is_set():
+                                logger.info(f" {agent_id.upper()} stopped streaming after being cut off")
+                                break
+                    response_content = "".join(chunks)
                     
-                    if found_card:
-                        selected_cards.append(found_card)
-                    else:
-                        print(f" DEBUG: {agent_id.upper()} - No match found for LLM card: '{card_name}'")
-                
-  
-                for i, card in enumerate(selected_cards):
-                    print(f"  {i+1}. {card.get('name', 'Unknown')}")
-                
-                return {
-                    "agent_id": agent_id,
-                    "selected_cards": selected_cards,
-                    "total_analyzed": len(cards_to_analyze),
-                    "llm_response": response.content
-                }
-                
-            except json.JSONDecodeError:
+                    if parser.items_parsed == 0 and not progress.cut_off.is_set():
+                        # Nothing came through incrementally, so the response must be a complete JSON array
+                        selected_cards_data = json.loads(response_content)
+                        if not attempt.claim():
+                            raise RuntimeError(f"attempt {attempt.number} lost to a faster attempt")
+                        for card_data in selected_cards_data:
+                            resolve(card_data)
+                    return response_content
+                except Exception:
+                    if attempt.release():
+                        progress.reset()
+                    raise
             
-                # Fallback: return first 50% of cards
-                fallback_cards = cards_to_analyze[:len(cards_to_analyze)//2]
-                return {
-                    "agent_id": agent_id,
-                    "selected_cards": fallback_cards,
-                    "total_analyzed": len(cards_to_analyze),
-                    "llm_response": "Fallback selection"
-                }
+            # Deadline, hedging and retries are handled by the resilient caller
+            response_content = self.shard_caller.call(stream_attempt, self.shard_deadline_seconds, cancel=cancel)
+            logger.info(f" response received ({len(response_content)} characters)")
+            logger.debug("%s response: %s", agent_id.upper(), response_content, extra={"payload": True})
+            
+            logger.info(f"🔍 {agent_id.upper()} selected {len(progress.selected_cards)} cards")
+            tracer.annotate(selected_cards=len(progress.selected_cards), cut_off=progress.cut_off.is_set())
+            
+            return {
+                "agent_id": agent_id,
+                "selected_cards": list(progress.selected_cards),
+                "total_analyzed": len(cards_to_analyze),
+                "llm_response": response_content,
+                "usage": progress.usage.calls()
+            }
                 
         except Exception as e:
-            logger.error(f"❌ {agent_id.upper()} LLM analysis failed: {e}")
-            print(f" {agent_id.upper()} LLM analysis failed: {e}")
-            # Fallback: return first 50% of cards
-            fallback_cards = cards_to_analyze[:len(cards_to_analyze)//2] if 'cards_to_analyze' in locals() else []
+            FALLBACKS.inc(stage="sub_agent", reason="circuit_open" if isinstance(e, CircuitOpenError) else "error")
+            if isinstance(e, CircuitOpenError):
+                logger.warning(f" {progress.agent_id.upper()} skipping LLM, provider circuit is open")
+            else:
+                logger.error(f"❌ {progress.agent_id.upper()} LLM analysis failed: {e}")
+            # Fallback: deterministically rank the shard and keep the best 50% of cards
+            cards_to_analyze = cards_to_analyze if 'cards_to_analyze' in locals() else []
+            fallback_cards = self.ranker.rank(cards_to_analyze, user_profile)[:len(cards_to_analyze)//2]
+            tracer.annotate(agent_id=progress.agent_id, cards=len(cards_to_analyze), selected_cards=len(fallback_cards), fallback=True)
             return {
-                "agent_id": agent_id,
+                "agent_id": progress.agent_id,
                 "selected_cards": fallback_cards,
-                "total_analyzed": len(cards_to_analyze) if 'cards_to_analyze' in locals() else 0,
-                "llm_response": f"Error: {str(e)}"
+                "total_analyzed": len(cards_to_analyze),
+                "llm_response": f"Fallback selection: {str(e)}",
+                "fallback": True,
+                "usage": progress.usage.calls()
             }
     
     # ⚠️ EDIT HERE: LLM-based recommendation generation
-    def _generate_llm_recommendation(self, user_profile: Dict[str, Any], all_cards: List[Dict[str, Any]], selection_instructions: str) -> Dict[str, Any]:
-        """Generate a comprehensive recommendation using LLM analysis of all available cards"""
+    def _generate_llm_recommendation(self, user_profile: Dict[str, Any], all_cards: List[Dict[str, Any]], selection_instructions: str, on_token: Optional[Callable[[str], None]] = None, cancel: Optional[CancelToken] = None,
+                                     usage: Optional[UsageLedger] = None) -> Dict[str, Any]:
+        """Generate a comprehensive recommendation using LLM analysis of all available cards
+
+        When on_token is given the final answer is streamed and each chunk is passed to it as it arrives.
+        When cancel is given the answer is streamed too, so a cancellation can stop it part way.
+        The LLM calls made are recorded in usage if given.
+        """
         
         logger.info("🤖 Starting final LLM recommendation generation...")
-        print(f" DEBUG: Starting final LLM recommendation generation...")
-        print(f" DEBUG: Received {len(all_cards)} cards for final analysis")
+        logger.debug("Received %d cards for final analysis", len(all_cards))
         
+        prompt_started = time.perf_counter()
         # Create hybrid profile summary
         hybrid_profile = self._create_hybrid_profile(user_profile)
         logger.info(" Created hybrid profile summary")
@@ -445,7 +943,7 @@ Example format:
         # Prepare comprehensive card data for LLM analysis
         card_data_summary = []
       
-        for i, card in enumerate(all_cards):
+        for card in all_cards:
             # FIX: Use the correct field names that match the database
             card_summary = {
                 'name': card.get('name', card.get('Card name', 'Unknown')),  # Try both field names
@@ -461,15 +959,13 @@ Example format:
                 'target_audience': card.get('target_audience', card.get('Target audience', ''))
             }
             card_data_summary.append(card_summary)
-            if i < 3:  # Show first 3 cards
-                print(f" DEBUG: Card {i+1}: {card_summary['name']} by {card_summary['issuer']}")
         
         logger.info(f"📋 Prepared {len(card_data_summary)} cards for final analysis")
-        print(f" DEBUG: Prepared {len(card_data_summary)} cards for final LLM analysis")
+        logger.debug("First cards: %s", [(card['name'], card['issuer']) for card in card_data_summary[:3]])
         
         # Check if user is a student
         is_student = user_profile.get('credit_situation', '').lower().find('student') != -1
-        print(f" DEBUG: User is student: {is_student}")
+        logger.debug("User is student: %s", is_student)
         
         # Create student-specific instructions
         student_instruction = ""
@@ -526,113 +1022,104 @@ Return the response in this exact format:
 
         try:
             logger.info(f"🤖 Attempting LLM analysis with {len(all_cards)} cards...")
-            print(f" Attempting LLM analysis with {len(all_cards)} cards...")
             messages = [
                 SystemMessage(content="You are an expert credit card advisor with deep knowledge of all available cards. Your job is to analyze the complete card database and select the best 3 cards for each user based on their specific profile. Always return the exact card details from the database."),
                 HumanMessage(content=prompt)
             ]
+            STAGE_SECONDS.observe(time.perf_counter() - prompt_started, stage="prompt_build")
             
            
-            response = self.llm.invoke(messages)
+            def final_attempt(attempt: Attempt) -> str:
+                if on_token or cancel is not None:
+                    # Stream the answer so the client sees tokens before the full response is ready
+                    chunks = []
+                    with closing(self.llm.stream(messages, config=llm_config("final", [usage] if usage else None))) as stream:
+                        for chunk in stream:
+                            if attempt.cancelled.is_set():
+                                raise RuntimeError(f"attempt {attempt.number} cancelled")
+                            if chunk.content:
+                                # Tokens can't be taken back once sent, so only one attempt may stream them
+                                if not attempt.claim():
+                                    raise RuntimeError(f"attempt {attempt.number} lost to a faster attempt")
+                                chunks.append(chunk.content)
+                                if on_token:
+                                    on_token(chunk.content)
+                    return "".join(chunks)
+                content = self.llm.invoke(messages, config=llm_config("final", [usage] if usage else None)).content
+                if attempt.cancelled.is_set() or not attempt.claim():
+                    raise RuntimeError(f"attempt {attempt.number} lost to a faster attempt")
+                return content
+            
+            # Deadline, hedging and retries are handled by the resilient caller
+            response_text = self.final_caller.call(final_attempt, self.final_deadline_seconds, cancel=cancel)
           
             
             # Return structured response
-            structured_cards = self._extract_structured_cards(response.content, all_cards)
+            with STAGE_SECONDS.time(stage="extract_structured_cards"), tracer.span("analysis.extract_structured_cards") as span:
+                structured_cards = self._extract_structured_cards(response_text, all_cards)
+                span.set_attribute("cards", len(structured_cards))
        
             
             return {
-                "text_response": response.content,
+                "text_response": response_text,
                 "structured_cards": structured_cards
             }
         except Exception as e:
-    
-            # Fallback recommendation
-            fallback_text = self._generate_fallback_recommendation(user_profile, all_cards[:3] if all_cards else [])
-            return {
-                "text_response": fallback_text,
-                "structured_cards": self._extract_structured_cards(fallback_text, all_cards[:3] if all_cards else [])
-            }
+            logger.error(f" Final LLM recommendation failed, using local ranking: {e}")
+            FALLBACKS.inc(stage="final", reason="circuit_open" if isinstance(e, CircuitOpenError) else "error")
+            # Fallback recommendation from the deterministic local ranking
+            return self.ranker.recommend(all_cards, user_profile)
 
     def _extract_structured_cards(self, response_text: str, all_cards: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Extract structured card data from LLM response"""
         structured_cards = []
         
-    
-        # Debug: Log all available card names
-        available_card_names = []
-        for card in all_cards:
-            # Try both field name formats
-            card_name = card.get('name', card.get('Card name', 'Unknown'))
-            available_card_names.append(card_name)
-        
-        print(f" DEBUG: Available card names in database:")
-        for i, name in enumerate(available_card_names[:10]):  
-            print(f"  {i+1}. {name}")
-        
         # Split by numbered items
         card_blocks = re.split(r'(?=\d+\.\s+\*\*)\s*', response_text)
         card_blocks = [block.strip() for block in card_blocks if block.strip()]
         
-        print(f" DEBUG: Found {len(card_blocks)} card blocks in LLM response")
+        logger.debug("Found %d card blocks in LLM response", len(card_blocks))
+        logger.debug("Final LLM response: %s", response_text, extra={"payload": True})
         
         for i, block in enumerate(card_blocks):
-            print(f" DEBUG: Processing card block {i+1}...")
-            
             # Extract card name
             name_match = re.search(r'\*\*([^*]+)\*\*', block)
             if not name_match:
-                print(f" DEBUG: No card name found in block {i+1}")
+                logger.debug("No card name found in block %d", i + 1)
                 continue
                 
             card_name = name_match.group(1).strip()
-            print(f" DEBUG: LLM returned card name: '{card_name}'")
-            
+
             # Find the actual card data from database
-            card_data = None
-            for card in all_cards:
-                # Try both field name formats
-                db_card_name = card.get('name', card.get('Card name', ''))
-                if db_card_name.lower() == card_name.lower():
-                    card_data = card
-                    print(f" DEBUG:  Found exact match: '{db_card_name}'")
-                    break
-        
-            if not card_data:
-                print(f" DEBUG:  No exact match found for: '{card_name}'")
-                # Try fuzzy matching
-                for card in all_cards:
-                    db_card_name = card.get('name', card.get('Card name', ''))
-                    if any(word in db_card_name.lower() for word in card_name.lower().split()):
-                        card_data = card
-                        print(f" DEBUG:  Fuzzy match found: '{db_card_name}' for '{card_name}'")
-                        break
-            
+            card_data = self._resolve_card_name(card_name, all_cards)
+
             if card_data:
-                structured_card = {
-                    'name': card_data.get('name', card_data.get('Card name', card_name)),
-                    'issuer': card_data.get('issuer', card_data.get('Issuer', 'Unknown')),
-                    'category': card_data.get('category', card_data.get('Category', '')),
-                    'annual_fee': card_data.get('annual_fee', card_data.get('Annual fee', 'N/A')),
-                    'intro_apr': card_data.get('intro_apr', card_data.get('Intro APR', 'N/A')),
-                    'regular_apr': card_data.get('regular_apr', card_data.get('Regular APR', 'Variable')),
-                    'credit_score': card_data.get('credit_score_required', card_data.get('Credit score', 'Good')),
-                    'rewards': card_data.get('rewards', card_data.get('Rewards', '')),
-                    'signup_bonus': card_data.get('signup_bonus', card_data.get('Sign-up bonus', '')),
-                    'foreign_fee': card_data.get('foreign_fee', card_data.get('Foreign fee', '')),
-                    'target_audience': card_data.get('target_audience', card_data.get('Target audience', '')),
-                    'reasoning': self._extract_reasoning(block)
-                }
+                structured_card = to_structured_card(card_data, self._extract_reasoning(block))
                 structured_cards.append(structured_card)
-                print(f" DEBUG:  Added structured card: {structured_card['name']}")
             else:
-                print(f"�� DEBUG:  Could not find card data for: '{card_name}'")
+                logger.warning(f" Could not find card data for: '{card_name}'")
         
-        print(f" DEBUG: Final structured cards count: {len(structured_cards)}")
-        for i, card in enumerate(structured_cards):
-            print(f" DEBUG: Structured card {i+1}: {card['name']} by {card['issuer']}")
+        logger.debug("Structured cards: %s", [card['name'] for card in structured_cards])
         
         return structured_cards
 
+    def _resolve_card_name(self, card_name: str, all_cards: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The card an LLM-reported name refers to: the first with the same name ignoring case,
+        else the first whose name contains any of its words"""
+        for card in all_cards:
+            # Try both field name formats
+            db_card_name = card.get('name', card.get('Card name', ''))
+            if db_card_name.lower() == card_name.lower():
+                return card
+
+        # Try fuzzy matching
+        for card in all_cards:
+            db_card_name = card.get('name', card.get('Card name', ''))
+            if any(word in db_card_name.lower() for word in card_name.lower().split()):
+                logger.debug("Fuzzy match found: '%s' for '%s'", db_card_name, card_name)
+                return card
+        return None
+
     def _extract_reasoning(self, card_block: str) -> str:
         """Extract reasoning from card block"""
         reasoning_match = re.search(r'\*\*Reasoning:\*\*\s*(.+?)(?=\n\n|\n\d+\.|$)', card_block, re.DOTALL)
@@ -681,23 +1168,3 @@ Return the response in this exact format:
             parts.append(f"Credit situation: {user_profile['credit_situation']}")
         
         return " | ".join(parts)
-    
-
-    
-    # Fallback recommendation
-    def _generate_fallback_recommendation(self, user_profile: Dict[str, Any], top_cards: List[Dict[str, Any]]) -> str:
-        """Generate a fallback recommendation if LLM fails"""
-        if not top_cards:
-            return "I apologize, but I couldn't find any credit cards that match your profile. Please try adjusting your criteria or contact a financial advisor for personalized advice."
-        
-        recommendation = f"Based on your profile, here are my top recommendations:\n\n"
-        
-        for i, card in enumerate(top_cards[:2], 1):
-            recommendation += f"{i}. {card.get('name', 'Unknown Card')} by {card.get('issuer', 'Unknown')}\n"
-            recommendation += f"   - Annual Fee: ${card.get('annual_fee', 0)}\n"
-            recommendation += f"   - Category: {card.get('category', 'General')}\n"
-            recommendation += f"   - Target: {card.get('target_audience', 'General users')}\n\n"
-        
-        recommendation += "These cards are selected based on your credit profile, spending habits, and goals. Please review the terms and conditions before applying."
-        
-        return recommendation 
@@ -0,0 +1,185 @@
+from typing import Dict, Any, Optional, List
+import re
+import logging
+
+from agent.reward_value import SPEND_CATEGORIES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Credit tiers in increasing order, matching credit_score_required in the database
+CREDIT_TIERS = ["poor", "fair", "good", "excellent"]
+
+# FICO range of each credit tier
+CREDIT_TIER_RANGES = {
+    "poor": (300, 579),
+    "fair": (580, 669),
+    "good": (670, 739),
+    "excellent": (740, 850)
+}
+
+# Brands asked about in the questionnaire
+BRANDS = ["amazon", "apple", "costco", "walmart", "target", "airline", "hotel"]
+
+MONEY_PATTERN = re.compile(r'(\d[\d,]*(?:\.\d+)?)\s*(k|m)?\b', re.IGNORECASE)
+
+# Answers giving only an upper or a lower bound, in words or symbols ("Under $500", "< $25K",
+# "> 10 times", "740+"). The symbols stay outside \b: a word boundary can't match before them.
+UPPER_BOUND_PATTERN = re.compile(r'(?:\b(?:under|less than|below|up to|at most)\b|<)')
+LOWER_BOUND_PATTERN = re.compile(r'(?:\b(?:over|more than|above|at least)\b|\+|>)')
+
+def _number_range(low: Optional[float], high: Optional[float]) -> Optional[Dict[str, Any]]:
+    # Typed numeric range; "value" is the single number to use when one is needed
+    if low is None and high is None:
+        return None
+    if low is None:
+        value = high
+    elif high is None:
+        value = low
+    else:
+        value = (low + high) / 2
+    return {"min": low, "max": high, "value": value}
+
+def parse_money(text: Any, period: str = "month") -> Optional[Dict[str, Any]]:
+    """Parse an amount such as "$85k", "around 2,500/mo" or "$50k-$70k a year" into a range per period
+
+    period is "month" or "year"; amounts stated per year, month, week or hour are converted to it.
+    """
+    text = str(text or "").lower()
+    amounts = []
+    for match in MONEY_PATTERN.finditer(text):
+        amount = float(match.group(1).replace(",", ""))
+        if match.group(2) == "k":
+            amount *= 1000
+        elif match.group(2) == "m":
+            amount *= 1000000
+        amounts.append(amount)
+    if not amounts:
+        return None
+
+    # "50-70k": a bare lower bound shares the suffix of the upper bound
+    if len(amounts) >= 2 and amounts[0] < 1000 <= amounts[1] and amounts[1] / max(amounts[0], 1) >= 100:
+        amounts[0] *= 1000
+
+    # Convert from the period the answer was given in to the one requested
+    per_year = 1.0
+    if re.search(r'/\s*(yr|year)|\b(a|per) year\b|\byearly\b|\bannual', text):
+        per_year = 1.0
+    elif re.search(r'/\s*(mo|month)|\b(a|per) month\b|\bmonthly\b', text):
+        per_year = 12.0
+    elif re.search(r'/\s*(wk|week)|\b(a|per) week\b|\bweekly\b', text):
+        per_year = 52.0
+    elif re.search(r'/\s*(hr|hour)|\b(an|per) hour\b|\bhourly\b', text):
+        per_year = 2080.0
+    else:
+        per_year = 1.0 if period == "year" else 12.0
+    scale = per_year if period == "year" else per_year / 12.0
+
+    amounts = [amount * scale for amount in amounts]
+    if UPPER_BOUND_PATTERN.search(text):
+        return _number_range(0.0, amounts[0])
+    if LOWER_BOUND_PATTERN.search(text):
+        return _number_range(amounts[0], None)
+    if len(amounts) >= 2:
+        return _number_range(min(amounts[:2]), max(amounts[:2]))
+    return _number_range(amounts[0], amounts[0])
+
+def parse_credit_score(text: Any) -> Optional[Dict[str, Any]]:
+    """Parse "720", "700-750" or "Good" into a FICO range with its tier index into CREDIT_TIERS"""
+    text = str(text or "").lower()
+    scores = [int(score) for score in re.findall(r'\b(\d{3})\b', text) if 300 <= int(score) <= 850]
+    if scores:
+        low, high = min(scores[:2]), max(scores[:2])
+        if LOWER_BOUND_PATTERN.search(text):
+            high = 850
+        elif UPPER_BOUND_PATTERN.search(text):
+            # "< 580" excludes 580 itself
+            low, high = 300, low - 1 if "<" in text else low
+        result = _number_range(low, high)
+    else:
+        tier = next((tier for tier in reversed(CREDIT_TIERS) if tier in text), None)
+        if tier is None and ("bad" in text or "limited" in text or "no credit" in text or "none" in text):
+            tier = "poor"
+        if tier is None:
+            return None
+        result = _number_range(*CREDIT_TIER_RANGES[tier])
+
+    # The tier follows the low end of the range, so "700+" reads as good rather than excellent
+    low = result["min"]
+    result["tier"] = next(i for i, tier in enumerate(CREDIT_TIERS) if low <= CREDIT_TIER_RANGES[tier][1])
+    return result
+
+def parse_travel_frequency(text: Any) -> Optional[Dict[str, Any]]:
+    """Parse a travel frequency answer into a range of flights per year"""
+    text = str(text or "").lower()
+    if not text.strip():
+        return None
+    if "week" in text:
+        return _number_range(40.0, 52.0)
+    if "month" in text:
+        return _number_range(10.0, 12.0)
+    numbers = [float(n) for n in re.findall(r'\d+(?:\.\d+)?', text)]
+    if numbers:
+        if UPPER_BOUND_PATTERN.search(text):
+            return _number_range(0.0, numbers[0])
+        if LOWER_BOUND_PATTERN.search(text):
+            return _number_range(numbers[0], None)
+        return _number_range(min(numbers[:2]), max(numbers[:2]))
+    if "never" in text or "don't" in text or "do not" in text:
+        return _number_range(0.0, 0.0)
+    if "rare" in text or "seldom" in text:
+        return _number_range(0.0, 1.0)
+    if "frequent" in text or "often" in text or "a lot" in text:
+        return _number_range(6.0, 10.0)
+    if "occasional" in text or "sometimes" in text or "few" in text:
+        return _number_range(1.0, 3.0)
+    return _number_range(1.0, 1.0)
+
+def parse_spend_category(text: Any) -> str:
+    """Map a free-text spend category answer to a key of SPEND_CATEGORIES, or "other\""""
+    text = str(text or "").lower()
+    for category, words in SPEND_CATEGORIES.items():
+        if any(word in text for word in words):
+            return category
+    return "other"
+
+def parse_brands(text: Any) -> List[str]:
+    text = str(text or "").lower()
+    brands = [brand for brand in BRANDS if brand in text]
+    if "airlines" in text or "flights" in text:
+        brands.append("airline")
+    return sorted(set(brands))
+
+# Answer recorded for a question the adaptive planner decided not to ask
+SKIPPED_ANSWER = "Not asked"
+
+# Parsers by profile field; fields not listed keep only their raw text
+FIELD_PARSERS = {
+    'monthly_spending': lambda text: parse_money(text, period="month"),
+    'income': lambda text: parse_money(text, period="year"),
+    'credit_score': parse_credit_score,
+    'travel_frequency': parse_travel_frequency,
+    'top_spend_category': parse_spend_category,
+    'brand_preferences': parse_brands,
+    'payment_behavior': lambda text: {"carries_balance": "carry" in str(text or "").lower() or "revolv" in str(text or "").lower()},
+    'credit_situation': lambda text: {
+        "is_student": "student" in str(text or "").lower(),
+        "is_building": any(word in str(text or "").lower() for word in ("student", "build", "rebuild", "new to credit"))
+    },
+    'primary_goal': lambda text: str(text or "").lower().strip()
+}
+
+def parse_answer(field: str, text: Any) -> Any:
+    """Parse one questionnaire answer into its typed form, None if it can't be read"""
+    parser = FIELD_PARSERS.get(field)
+    if parser is None or text is None or text == SKIPPED_ANSWER:
+        return None
+    try:
+        return parser(text)
+    except Exception as e:
+        logger.warning(f" Could not parse {field} answer '{text}': {e}")
+        return None
+
+def parse_profile(user_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Parse every answer of a profile, keyed by the same fields as the raw profile"""
+    return {field: parse_answer(field, value) for field, value in user_profile.items()}
@@ -0,0 +1,129 @@
+from typing import Dict, Any, Optional, Callable
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Request header asking for a request to be profiled: "1", or the PROFILING_TOKEN when one is set
+PROFILE_HEADER = "X-Profile"
+
+# Request ids end up in file names
+_UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9_.-]")
+
+class RequestProfiler:
+    # Opt-in profiling of single requests in place. Only when enabled, and then only requests
+    # sent with the X-Profile header, are run under a profiler: pyinstrument's sampling profiler
+    # when it is installed (and kind allows it), cProfile otherwise. The profile is written to
+    # directory as <endpoint>-<request id>.prof (cProfile, for pstats or snakeviz) or .html
+    # (pyinstrument), with a .txt summary next to it.
+    #
+    # Both profilers follow the thread running the request: question handling, prompt building,
+    # the final LLM call and card extraction. Sub-agent and LLM attempt threads aren't included.
+
+    def __init__(self, enabled: bool = False, directory: str = "profiles", token: Optional[str] = None, kind: str = "auto"):
+        self.enabled = enabled
+        self.directory = directory
+        self.token = token
+        self.kind = "pyinstrument" if kind == "auto" and SamplingProfiler is not None else ("cprofile" if kind == "auto" else kind)
+        self.counters = {"profiled": 0, "failed": 0, "skipped": 0}
+        self._lock = threading.Lock()
+
+    def wanted(self, header_value: Optional[str]) -> bool:
+        """Whether a request sent with this X-Profile header value is to be profiled"""
+        if not self.enabled or not header_value:
+            return False
+        if self.token:
+            return header_value == self.token
+        return header_value.lower() in ("1", "true", "yes")
+
+    def wrap(self, endpoint: str, request_id: str, work: Callable[[], Any]) -> Callable[[], Any]:
+        """work run under a profiler, writing the profile when it finishes (also when it raises)"""
+        def profiled():
+            profiler = self._start()
+            if profiler is None:
+                return work()
+            started = time.perf_counter()
+            try:
+                return work()
+            finally:
+                self._finish(profiler, endpoint, request_id, time.perf_counter() - started)
+        return profiled
+
+    def path_for(self, endpoint: str, request_id: str) -> str:
+        """Path of the profile of a request, without its extension"""
+        return os.path.join(self.directory, f"{_UNSAFE_CHARACTERS.sub('_', endpoint)}-{_UNSAFE_CHARACTERS.sub('_', request_id)}")
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        with self._lock:
+            return {"enabled": True, "profiler": self.kind, "directory": self.directory, **self.counters}
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _start(self):
+        try:
+            if self.kind == "pyinstrument":
+                profiler = SamplingProfiler(async_mode="disabled")
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            return profiler
+        except Exception as e:
+            # e.g. another profiler already running in this thread
+            logger.warning(f" Not profiling request: {e}")
+            self._count("skipped")
+            return None
+
+    def _finish(self, profiler, endpoint: str, request_id: str, elapsed: float):
+        path = self.path_for(endpoint, request_id)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.kind == "pyinstrument":
+                profiler.stop()
+                profile_path = f"{path}.html"
+                with open(profile_path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+                summary = profiler.output_text(unicode=True, color=False)
+            else:
+                profiler.disable()
+                profile_path = f"{path}.prof"
+                profiler.dump_stats(profile_path)
+                summary_stream = io.StringIO()
+                pstats.Stats(profiler, stream=summary_stream).sort_stats("cumulative").print_stats(40)
+                summary = summary_stream.getvalue()
+            with open(f"{path}.txt", "w", encoding="utf-8") as f:
+                f.write(f"{endpoint} request {request_id}: {elapsed:.3f}s\n\n{summary}")
+            self._count("profiled")
+            logger.info(f" Wrote profile of {endpoint} request {request_id} to {profile_path} ({elapsed:.3f}s)")
+        except Exception as e:
+            self._count("failed")
+            logger.warning(f" Could not write profile of {endpoint} request {request_id}: {e}")
+
+def create_request_profiler() -> RequestProfiler:
+    """Request profiler configured from PROFILING_ENABLED, PROFILE_DIR, PROFILING_TOKEN and PROFILER"""
+    kind = os.getenv("PROFILER", "auto").lower()
+    if kind == "pyinstrument" and SamplingProfiler is None:
+        logger.warning(" PROFILER=pyinstrument but pyinstrument isn't installed, using cProfile")
+        kind = "cprofile"
+    return RequestProfiler(
+        enabled=os.getenv("PROFILING_ENABLED", "false").lower() == "true",
+        directory=os.getenv("PROFILE_DIR", "profiles"),
+        token=os.getenv("PROFILING_TOKEN") or None,
+        kind=kind
+    )
@@ -0,0 +1,106 @@
+from typing import Dict, Any, List, Optional, Callable
+from itertools import combinations, product
+import logging
+import os
+
+from agent.profile_parser import parse_answer
+from agent.ranker import LocalRanker, narrow_candidates
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# A few representative answers per question, spanning the answers that rank cards differently
+HYPOTHETICAL_ANSWERS = {
+    'primary_goal': ["Travel rewards", "Cash back", "Building credit", "Balance transfer"],
+    'top_spend_category': ["Dining", "Groceries", "Gas", "Travel", "Shopping"],
+    'brand_preferences': ["None", "Amazon", "Costco", "Airlines and hotels"],
+    'travel_frequency': ["Never", "2 trips a year", "6 trips a year", "12 trips a year"],
+    'monthly_spending': ["$500", "$1,500", "$3,000", "$6,000"],
+    'payment_behavior': ["Pay in full", "Carry a balance"],
+    'income': ["$30k", "$60k", "$120k", "$250k"],
+    'credit_score': ["580", "650", "700", "780"],
+    'credit_situation': ["Student with little history", "Building/rebuilding credit", "Established credit"]
+}
+
+class QuestionPlanner:
+    # Adaptive questionnaire: picks the next question by how much its answer is expected to
+    # narrow the candidate cards, and stops asking once no remaining answer could change the
+    # top cards. Each unanswered question is tried with its representative answers against
+    # the local ranker; a question whose answers all leave the top cards the same isn't worth
+    # a round-trip. Questions are tried one at a time, holding the other unknowns at the
+    # ranker's defaults, and before stopping every pair of them is tried together, since two
+    # answers can move the top cards where neither does alone.
+
+    def __init__(self, get_cards: Callable[[], List[Dict[str, Any]]], ranker: Optional[LocalRanker] = None, top_n: int = 3):
+        self.get_cards = get_cards
+        self.ranker = ranker or LocalRanker()
+        self.top_n = top_n
+        # The representative answers only need parsing once
+        self._hypotheses = {
+            field: [parse_answer(field, answer) for answer in answers]
+            for field, answers in HYPOTHETICAL_ANSWERS.items()
+        }
+
+    def next_field(self, user_profile: Dict[str, Any], parsed_profile: Dict[str, Any]) -> Optional[str]:
+        """Field to ask about next, or None when no unanswered question can change the top cards"""
+        cards = self.get_cards()
+        best = None
+        for field, value in user_profile.items():
+            if value is not None or field not in self._hypotheses:
+                continue
+            outcomes = []
+            for parsed_answer in self._hypotheses[field]:
+                parsed = dict(parsed_profile, **{field: parsed_answer})
+                pool = narrow_candidates(cards, parsed)
+                outcomes.append((len(pool), self._top_cards(cards, pool, user_profile, parsed)))
+            distinct_tops = len({top for _, top in outcomes})
+            if distinct_tops <= 1:
+                continue
+            # Smallest expected candidate pool first, then the most ways to change the top cards;
+            # ties keep the questionnaire's own order
+            expected_pool = sum(size for size, _ in outcomes) / len(outcomes)
+            key = (expected_pool, -distinct_tops)
+            if best is None or key < best[0]:
+                best = (key, field)
+        if best is not None:
+            return best[1]
+        return self._joint_field(cards, user_profile, parsed_profile)
+
+    def _joint_field(self, cards: List[Dict[str, Any]], user_profile: Dict[str, Any], parsed_profile: Dict[str, Any]) -> Optional[str]:
+        """First field of the pair of unanswered fields whose answers together change the top
+        cards the most ways, or None if no pair changes them"""
+        unanswered = [field for field, value in user_profile.items() if value is None and field in self._hypotheses]
+        best = None
+        for first, second in combinations(unanswered, 2):
+            tops = set()
+            for first_answer, second_answer in product(self._hypotheses[first], self._hypotheses[second]):
+                parsed = dict(parsed_profile, **{first: first_answer, second: second_answer})
+                tops.add(self._top_cards(cards, narrow_candidates(cards, parsed), user_profile, parsed))
+            if len(tops) > 1 and (best is None or len(tops) > best[0]):
+                best = (len(tops), first)
+        return best[1] if best else None
+
+    def _top_cards(self, cards: List[Dict[str, Any]], pool: List[Dict[str, Any]],
+                   user_profile: Dict[str, Any], parsed_profile: Dict[str, Any]) -> frozenset:
+        # Scores don't depend on the rest of the pool, so rank the whole catalog (whose reward
+        # values are cached) and keep the best cards that are still candidates
+        names = {card.get("name") for card in pool}
+        ranked = (card.get("name") for card in self.ranker.rank(cards, user_profile, parsed_profile))
+        top = []
+        for name in ranked:
+            if name in names:
+                top.append(name)
+                if len(top) == self.top_n:
+                    break
+        return frozenset(top)
+
+def create_question_planner(tools: Dict[str, Any]) -> Optional[QuestionPlanner]:
+    """Planner for the questionnaire selected by QUESTION_PLANNER: "fixed" (default, every
+    question in order, None is returned) or "adaptive\""""
+    planner = os.getenv("QUESTION_PLANNER", "fixed").lower()
+    if planner == "fixed":
+        return None
+    if planner != "adaptive":
+        raise ValueError(f"Unknown QUESTION_PLANNER '{planner}', expected fixed or adaptive")
+    logger.info(" Using the adaptive question planner")
+    return QuestionPlanner(tools["final_agent"].get_all_cards)
@@ -0,0 +1,279 @@
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+from agent.reward_value import RewardValueCalculator, parse_reward_rates, first_number
+from agent.profile_parser import CREDIT_TIERS, parse_profile
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Category keywords of cards that can't serve a primary goal, by goal keyword; first match wins
+# (the same keywords, in the same order, that group profiles for shared shard work)
+GOAL_EXCLUDED_CATEGORIES = [
+    ("travel", ["cash back", "store", "balance transfer", "secured"]),
+    ("cash", ["airline", "hotel", "premium", "luxury"]),
+    ("build", ["airline", "hotel", "premium", "luxury"]),
+    ("balance", ["airline", "hotel", "premium", "luxury", "store"]),
+    ("interest", ["airline", "hotel", "premium", "luxury", "store"]),
+    ("apr", ["airline", "hotel", "premium", "luxury", "store"])
+]
+
+# A cut that would leave fewer candidates than this is skipped
+MIN_CANDIDATES = 12
+
+def narrow_candidates(cards: List[Dict[str, Any]], parsed_profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Drop the cards the answers known so far rule out, keeping catalog order
+
+    The credit score drops cards needing a better credit tier, the credit situation drops
+    student or secured cards that don't fit it, and the primary goal drops card categories
+    that can't serve it. Each cut applies only once its answer is known.
+    """
+    def cut(pool: List[Dict[str, Any]], keep) -> List[Dict[str, Any]]:
+        narrowed = [card for card in pool if keep(card)]
+        return narrowed if len(narrowed) >= MIN_CANDIDATES else pool
+
+    def category(card: Dict[str, Any]) -> str:
+        return f"{card.get('category', '')} {card.get('target_audience', '')}".lower()
+
+    pool = cards
+    credit_score = parsed_profile.get("credit_score")
+    if credit_score:
+        tier = credit_score["tier"]
+        pool = cut(pool, lambda card: card.get("credit_score_required") not in CREDIT_TIERS
+                   or CREDIT_TIERS.index(card["credit_score_required"]) <= tier)
+
+    situation = parsed_profile.get("credit_situation")
+    if situation:
+        if situation.get("is_student"):
+            excluded = ["secured"]
+        elif situation.get("is_building"):
+            excluded = ["student"]
+        else:
+            excluded = ["secured", "student", "subprime"]
+        pool = cut(pool, lambda card: not any(word in category(card) for word in excluded))
+
+    goal = parsed_profile.get("primary_goal")
+    if goal:
+        for keyword, excluded in GOAL_EXCLUDED_CATEGORIES:
+            if keyword in goal:
+                pool = cut(pool, lambda card: not any(word in category(card) for word in excluded))
+                break
+
+    return pool
+
+def to_structured_card(card: Dict[str, Any], reasoning: str = "") -> Dict[str, Any]:
+    """Convert a database card to the structured card shape returned to the client"""
+    return {
+        'name': card.get('name', card.get('Card name', 'Unknown')),
+        'issuer': card.get('issuer', card.get('Issuer', 'Unknown')),
+        'category': card.get('category', card.get('Category', '')),
+        'annual_fee': card.get('annual_fee', card.get('Annual fee', 'N/A')),
+        'intro_apr': card.get('intro_apr', card.get('Intro APR', 'N/A')),
+        'regular_apr': card.get('regular_apr', card.get('Regular APR', 'Variable')),
+        'credit_score': card.get('credit_score_required', card.get('Credit score', 'Good')),
+        'rewards': card.get('rewards', card.get('Rewards', '')),
+        'signup_bonus': card.get('signup_bonus', card.get('Sign-up bonus', '')),
+        'foreign_fee': card.get('foreign_fee', card.get('Foreign fee', '')),
+        'target_audience': card.get('target_audience', card.get('Target audience', '')),
+        'reasoning': reasoning
+    }
+
+class LocalRanker:
+    # Deterministic ranking of cards against a user profile, with no LLM calls. Used for the
+    # "fast" recommendation mode and whenever the LLM provider is degraded.
+
+    def __init__(self):
+        # Reward value calculators keyed by the card names of the catalog they were built for
+        self._calculators = {}
+
+    def calculator_for(self, cards: List[Dict[str, Any]]) -> RewardValueCalculator:
+        """Reward value calculator for this list of cards, parsed once and reused"""
+        key = tuple(card.get("name", "") for card in cards)
+        calculator = self._calculators.get(key)
+        if calculator is None:
+            if len(self._calculators) >= 16:
+                self._calculators.clear()
+            calculator = RewardValueCalculator(cards)
+            self._calculators[key] = calculator
+        return calculator
+
+    def annual_values(self, cards: List[Dict[str, Any]], user_profile: Dict[str, Any],
+                      parsed_profile: Optional[Dict[str, Any]] = None) -> List[float]:
+        """Estimated net annual value in dollars of each card for this profile"""
+        context = self.profile_context(user_profile, parsed_profile)
+        values = self.calculator_for(cards).net_annual_value(context["monthly_spend"], context["top_category"], context["carries_balance"])
+        return values.tolist()
+
+    def profile_context(self, user_profile: Dict[str, Any], parsed_profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Interpret the profile once so every card can be scored against it cheaply.
+
+        parsed_profile is the typed form of the answers kept on State; it is parsed here when not given.
+        """
+        parsed = parsed_profile if parsed_profile is not None else parse_profile(user_profile)
+        goal = parsed.get("primary_goal") or ""
+        situation = parsed.get("credit_situation") or {}
+        is_student = situation.get("is_student", False)
+        is_building = situation.get("is_building", False) or "build" in goal
+        monthly_spending = parsed.get("monthly_spending")
+        income = parsed.get("income")
+        credit_score = parsed.get("credit_score")
+        trips = parsed.get("travel_frequency")
+
+        # Annual fee the user will pay without a second thought; beyond it the fee must earn its keep
+        if is_building or "no fee" in goal or "no annual fee" in goal:
+            fee_tolerance = 0.0
+        elif "travel" in goal or "premium" in goal:
+            fee_tolerance = 250.0
+        else:
+            fee_tolerance = 95.0
+
+        return {
+            "goal": goal,
+            "is_student": is_student,
+            "is_building": is_building,
+            # Unknown credit scores are treated as good, the most common requirement
+            "user_tier": credit_score["tier"] if credit_score else 2,
+            "top_category": parsed.get("top_spend_category") or "other",
+            "trips_per_year": trips["value"] if trips else 1.0,
+            "monthly_spend": monthly_spending["value"] if monthly_spending else 0.0,
+            "annual_income": income["value"] if income else None,
+            "fee_tolerance": fee_tolerance,
+            "carries_balance": (parsed.get("payment_behavior") or {}).get("carries_balance", False)
+        }
+
+    def evaluate(self, card: Dict[str, Any], context: Dict[str, Any], net_value: float = 0.0) -> Tuple[float, List[str]]:
+        """Score one card against a profile context and its estimated net annual value,
+        returning the score and the reasons behind it"""
+        score = 0.0
+        reasons = []
+        category = f"{card.get('category', '')} {card.get('target_audience', '')}".lower()
+        goal = context["goal"]
+
+        # Eligibility: cards that need a better credit tier than the user has are heavily penalized
+        required = card.get("credit_score_required", "good")
+        required_tier = CREDIT_TIERS.index(required) if required in CREDIT_TIERS else 2
+        if required_tier > context["user_tier"]:
+            score -= 10.0 * (required_tier - context["user_tier"])
+        else:
+            reasons.append(f"Your credit profile meets its {required} credit requirement")
+
+        # Students and people building credit are better served by student and secured cards
+        if "student" in category:
+            score += 4.0 if context["is_student"] else -2.0
+            if context["is_student"]:
+                reasons.append("Designed for students with little credit history")
+        if "secured" in category:
+            score += 3.0 if context["is_building"] and not context["is_student"] else -3.0
+            if context["is_building"] and not context["is_student"]:
+                reasons.append("Secured card that helps build or rebuild credit")
+
+        # Primary goal match
+        is_travel_card = "travel" in category or "airline" in category or "hotel" in category
+        if "travel" in goal and is_travel_card:
+            score += 4.0
+            reasons.append("Matches your travel rewards goal")
+        if "cash" in goal and "cash" in category:
+            score += 4.0
+            reasons.append("Matches your cash back goal")
+        if "build" in goal and ("secured" in category or "student" in category or "credit build" in category):
+            score += 4.0
+
+        # Travel frequency: travel cards only pay off for people who fly
+        trips = context["trips_per_year"]
+        if is_travel_card:
+            score += min(trips, 10.0) * 0.4 - (2.0 if trips < 2 else 0.0)
+        foreign_fee = str(card.get("foreign_fee", "")).lower()
+        if trips >= 4 and ("none" in foreign_fee or foreign_fee.startswith("0") or "no foreign" in foreign_fee):
+            score += 1.0
+            reasons.append("No foreign transaction fee for frequent travel")
+
+        # Top spend category match and estimated annual reward value
+        rates = dict(parse_reward_rates(card.get("rewards", "")))
+        top_category = context["top_category"]
+        if top_category in rates and rates[top_category] > rates["other"]:
+            score += 2.0
+            reasons.append(f"Earns {rates[top_category]:g}% back on {top_category}, your top spend category")
+
+        annual_fee = self._annual_fee(card)
+        score += net_value / 100.0
+        if context["monthly_spend"] > 0 and net_value > 0:
+            reasons.append(f"Estimated net value of about ${net_value:,.0f}/year on your spending")
+
+        # Fee tolerance, weighted more heavily for people building credit
+        excess_fee = max(0.0, annual_fee - context["fee_tolerance"])
+        score -= excess_fee / (50.0 if context["is_building"] else 150.0)
+
+        # Premium fees are out of reach on a low income, whatever the rewards
+        income = context["annual_income"]
+        if income is not None and annual_fee > 0 and annual_fee > income * 0.005:
+            score -= 3.0
+        if annual_fee == 0:
+            reasons.append("No annual fee")
+
+        # People who carry a balance benefit more from a 0% intro APR than from rewards
+        if context["carries_balance"] and str(card.get("intro_apr", "")).strip().startswith("0%"):
+            score += 2.0
+            reasons.append("0% intro APR helps while you carry a balance")
+
+        return score, reasons
+
+    def score_card(self, card: Dict[str, Any], user_profile: Dict[str, Any],
+                   parsed_profile: Optional[Dict[str, Any]] = None) -> float:
+        """Score how well one card fits the profile, higher is better"""
+        return self._ranked([card], user_profile, parsed_profile)[0][1]
+
+    def rank(self, cards: List[Dict[str, Any]], user_profile: Dict[str, Any],
+             parsed_profile: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Return cards sorted from best to worst fit, ties broken by name so the order is deterministic"""
+        return [card for card, _, _, _ in self._ranked(cards, user_profile, parsed_profile)]
+
+    def recommend(self, cards: List[Dict[str, Any]], user_profile: Dict[str, Any], top_n: int = 3,
+                  parsed_profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Build a recommendation in the same shape as the LLM path: text_response and structured_cards"""
+        if not cards:
+            return {
+                "text_response": "I apologize, but I couldn't find any credit cards that match your profile. Please try adjusting your criteria or contact a financial advisor for personalized advice.",
+                "structured_cards": []
+            }
+
+        structured_cards = []
+        lines = []
+        for i, (card, _, reasons, net_value) in enumerate(self._ranked(cards, user_profile, parsed_profile)[:top_n], 1):
+            reasoning = ". ".join(reasons[:4]) + "." if reasons else "Best overall fit for your profile."
+            structured_card = to_structured_card(card, reasoning)
+            structured_card["estimated_annual_value"] = round(net_value, 2)
+            structured_cards.append(structured_card)
+            lines.append(
+                f"{i}. **{structured_card['name']}**\n"
+                f"   - **Issuer:** {structured_card['issuer']}\n"
+                f"   - **Annual Fee:** {structured_card['annual_fee']}\n"
+                f"   - **Credit Score:** {structured_card['credit_score']}\n"
+                f"   - **Regular APR:** {structured_card['regular_apr']}\n"
+                f"   - **Rewards:** {structured_card['rewards']}\n"
+                f"   - **Sign-up Bonus:** {structured_card['signup_bonus']}\n"
+                f"   - **Target Audience:** {structured_card['target_audience']}\n\n"
+                f"   **Reasoning:** {reasoning}"
+            )
+
+        return {
+            "text_response": "\n\n".join(lines),
+            "structured_cards": structured_cards
+        }
+
+    def _ranked(self, cards: List[Dict[str, Any]], user_profile: Dict[str, Any],
+                parsed_profile: Optional[Dict[str, Any]] = None) -> List[Tuple[Dict[str, Any], float, List[str], float]]:
+        context = self.profile_context(user_profile, parsed_profile)
+        # Net annual value of every card in one vectorized pass
+        net_values = self.calculator_for(cards).net_annual_value(context["monthly_spend"], context["top_category"], context["carries_balance"])
+        scored = []
+        for card, net_value in zip(cards, net_values.tolist()):
+            score, reasons = self.evaluate(card, context, net_value)
+            scored.append((card, score, reasons, net_value))
+        scored.sort(key=lambda item: (-item[1], str(item[0].get("name", ""))))
+        return scored
+
+    def _annual_fee(self, card: Dict[str, Any]) -> float:
+        fee = card.get("annual_fee", 0)
+        if isinstance(fee, (int, float)):
+            return float(fee)
+        return first_number(fee)
@@ -0,0 +1,340 @@
+from typing import Any, Callable, Dict, Iterator, Optional
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import logging
+import random
+import threading
+import time
+
+from agent.tracing import tracer
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is open and calls are routed to the fallback"""
+
+class DeadlineExceededError(Exception):
+    """Raised when no attempt succeeded before the call deadline"""
+
+class RequestCancelledError(BaseException):
+    """Raised in the pipeline once its request has been cancelled, e.g. because the client
+    disconnected. A BaseException, like asyncio.CancelledError, so the stages' fallbacks,
+    which catch Exception, don't turn it into a recommendation nobody will read."""
+
+class CancelToken:
+    # Cancellation signal for one request's analysis, shared by every stage and LLM call it
+    # starts. cancel() may be called from any thread; callbacks registered with on_cancel()
+    # run once, on the cancelling thread.
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> bool:
+        """Cancel the request, returning False if it was already cancelled"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f" Cancellation callback failed: {e}")
+        return True
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback on cancellation (straight away if already cancelled); returns an unregister function"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelledError("Request was cancelled")
+
+    @contextmanager
+    def watch(self) -> Iterator[Future]:
+        """Future resolved on cancellation, to wait on alongside other futures"""
+        future = Future()
+        unregister = self.on_cancel(lambda: future.set_result(None))
+        try:
+            yield future
+        finally:
+            unregister()
+
+    def _unregister(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+@contextmanager
+def watch_cancellation(cancel: Optional[CancelToken]) -> Iterator[Future]:
+    """CancelToken.watch(), or a future that never resolves when there is no token"""
+    if cancel is None:
+        yield Future()
+    else:
+        with cancel.watch() as future:
+            yield future
+
+class LatencyTracker:
+    # Rolling window of latencies used to pick the hedging delay
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures, then lets a single trial call
+    # through once reset_timeout has passed (half-open) to check whether the provider recovered
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f" Circuit breaker opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def record_cancelled(self):
+        # A cancelled call says nothing about the provider, it only frees the half-open trial
+        with self._lock:
+            self._trial_in_flight = False
+
+class Attempt:
+    # Handle passed to each attempt of a resilient call. Attempts check `cancelled` between
+    # chunks and call claim() before producing output that cannot be taken back (e.g. streamed
+    # tokens); only one attempt can hold the claim, so a hedged duplicate never mixes its output in.
+
+    def __init__(self, number: int, ownership: "_Ownership"):
+        self.number = number
+        self.cancelled = threading.Event()
+        self._ownership = ownership
+
+    def claim(self) -> bool:
+        return self._ownership.claim(self)
+
+    def release(self) -> bool:
+        # Give up the claim after a failure so a retry can produce the output instead.
+        # Returns True if this attempt held the claim.
+        return self._ownership.release(self)
+
+class _Ownership:
+    def __init__(self, on_claim: Callable[[], None]):
+        self.owner = None
+        self._on_claim = on_claim
+        self._lock = threading.Lock()
+
+    def claim(self, attempt: Attempt) -> bool:
+        with self._lock:
+            if self.owner is None:
+                self.owner = attempt
+                self._on_claim()
+            return self.owner is attempt
+
+    def release(self, attempt: Attempt) -> bool:
+        with self._lock:
+            if self.owner is attempt:
+                self.owner = None
+                return True
+            return False
+
+class ResilientCaller:
+    # Runs a call with a deadline, a hedged duplicate attempt when no attempt has produced output
+    # within the recent latency percentile, retries with exponential backoff and full jitter,
+    # and a circuit breaker shared by all calls to the same provider. A call given a CancelToken
+    # stops as soon as it is cancelled: running attempts are told to stop and no more are sent.
+
+    # Attempts run on a shared pool; an abandoned attempt keeps its thread until its HTTP timeout
+    _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-attempt")
+
+    def __init__(self, name: str, breaker: CircuitBreaker, max_attempts: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge_percentile: float = 95.0, hedge_min_samples: int = 20,
+                 default_hedge_delay: Optional[float] = None):
+        self.name = name
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.default_hedge_delay = default_hedge_delay
+        # Time until an attempt first produces output, the latency hedging protects
+        self.latency = LatencyTracker()
+        # Work given up because its request was cancelled: calls never started, calls
+        # stopped part way and the attempts those were running
+        self.cancellations = {"calls_skipped": 0, "calls_cancelled": 0, "attempts_cancelled": 0}
+        self._cancellations_lock = threading.Lock()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait for output before sending a hedged duplicate, None to disable hedging"""
+        if len(self.latency) >= self.hedge_min_samples:
+            return self.latency.percentile(self.hedge_percentile)
+        return self.default_hedge_delay
+
+    def cancellation_stats(self) -> Dict[str, int]:
+        with self._cancellations_lock:
+            return dict(self.cancellations)
+
+    def call(self, attempt_fn: Callable[[Attempt], Any], deadline_seconds: float, cancel: Optional[CancelToken] = None) -> Any:
+        """Run attempt_fn(attempt) until one attempt succeeds, raising if the deadline passes first
+        or RequestCancelledError if cancel is cancelled first"""
+        if cancel is not None and cancel.cancelled:
+            self._count_cancellation("calls_skipped")
+            raise RequestCancelledError(f"{self.name}: request was cancelled")
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"{self.name}: circuit breaker is open")
+        try:
+            with watch_cancellation(cancel) as cancelled:
+                return self._call(attempt_fn, deadline_seconds, cancelled)
+        except RequestCancelledError:
+            self.breaker.record_cancelled()
+            raise
+
+    def _count_cancellation(self, counter: str, amount: int = 1):
+        with self._cancellations_lock:
+            self.cancellations[counter] += amount
+
+    def _call(self, attempt_fn: Callable[[Attempt], Any], deadline_seconds: float, cancelled: Future) -> Any:
+        started = time.monotonic()
+        deadline = started + deadline_seconds
+        ownership = _Ownership(lambda: self.latency.record(time.monotonic() - started))
+        attempts_started = 0
+        last_error = None
+
+        for retry in range(self.max_attempts):
+            if time.monotonic() >= deadline:
+                break
+            if retry > 0:
+                # Exponential backoff with full jitter, never sleeping past the deadline
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (retry - 1))))
+                wait([cancelled], timeout=max(0.0, min(backoff, deadline - time.monotonic())))
+                if cancelled.done():
+                    self._count_cancellation("calls_cancelled")
+                    raise RequestCancelledError(f"{self.name}: request was cancelled")
+                if time.monotonic() >= deadline:
+                    break
+
+            running = {}
+            attempts_started += 1
+            primary = Attempt(attempts_started, ownership)
+            running[self._executor.submit(tracer.wrap(attempt_fn), primary)] = primary
+            hedge_at = None
+            hedge_delay = self.hedge_delay()
+            if hedge_delay is not None:
+                hedge_at = time.monotonic() + hedge_delay
+
+            while running:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wake_at = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, _ = wait(list(running) + [cancelled], timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+                if cancelled.done():
+                    # Running attempts stop at their next streamed chunk; nobody waits for them
+                    for attempt in running.values():
+                        attempt.cancelled.set()
+                    self._count_cancellation("calls_cancelled")
+                    self._count_cancellation("attempts_cancelled", len(running))
+                    raise RequestCancelledError(f"{self.name}: request was cancelled")
+
+                for future in done:
+                    if future is cancelled:
+                        continue
+                    attempt = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        logger.warning(f" {self.name} attempt {attempt.number} failed: {e}")
+                        continue
+                    if ownership.owner not in (None, attempt):
+                        continue
+                    for other in running.values():
+                        other.cancelled.set()
+                    self.breaker.record_success()
+                    return result
+
+                # Hedge once per round, only while no attempt has started producing output
+                if hedge_at is not None and time.monotonic() >= hedge_at and running:
+                    hedge_at = None
+                    if ownership.owner is None:
+                        attempts_started += 1
+                        hedge = Attempt(attempts_started, ownership)
+                        logger.info(f" {self.name} sending hedged attempt {hedge.number} after {hedge_delay:.2f}s")
+                        running[self._executor.submit(tracer.wrap(attempt_fn), hedge)] = hedge
+
+            for attempt in running.values():
+                attempt.cancelled.set()
+            if running:
+                last_error = DeadlineExceededError(f"{self.name}: no response within {deadline_seconds:.1f}s")
+                break
+            if ownership.owner is not None:
+                # The failed attempt already produced output that cannot be replaced by a retry
+                break
+
+        self.breaker.record_failure()
+        if isinstance(last_error, DeadlineExceededError) or last_error is None:
+            raise DeadlineExceededError(f"{self.name}: no response within {deadline_seconds:.1f}s")
+        raise last_error
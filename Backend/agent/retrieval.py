@@ -0,0 +1,136 @@
+from typing import Dict, Any, List, Optional
+import logging
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words added to a query for each goal keyword, first match wins, so the query reaches
+# cards that describe the goal in their own terms
+GOAL_QUERY_TERMS = [
+    ("travel", "travel miles points airline hotel lounge flights"),
+    ("cash", "cash back rewards everyday"),
+    ("build", "secured building credit student starter"),
+    ("balance", "balance transfer intro apr 0% debt payoff"),
+    ("interest", "balance transfer intro apr 0% low interest"),
+    ("apr", "balance transfer intro apr 0% low interest")
+]
+
+# Words added to a query for the credit situation
+SITUATION_QUERY_TERMS = {
+    "Student with little history": "student students college",
+    "Building/rebuilding credit": "secured building rebuilding credit",
+    "Established credit": ""
+}
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens plus adjacent-word bigrams, so phrases like "cash back" count as one"""
+    words = TOKEN_PATTERN.findall(str(text or "").lower())
+    return words + [f"{first}_{second}" for first, second in zip(words, words[1:])]
+
+def card_text(card: Dict[str, Any]) -> str:
+    """Text a card is indexed by; category and audience are repeated to weigh them more"""
+    fee = card.get("annual_fee", 0)
+    parts = [
+        card.get("name", ""), card.get("issuer", ""),
+        card.get("category", ""), card.get("category", ""),
+        card.get("target_audience", ""), card.get("target_audience", ""),
+        card.get("rewards", ""), card.get("signup_bonus", ""),
+        f"{card.get('credit_score_required', '')} credit",
+        "no annual fee" if fee in (0, 0.0, "0", "$0") else "",
+        "intro apr" if str(card.get("intro_apr", "")).strip().startswith("0%") else ""
+    ]
+    return " ".join(str(part) for part in parts if part)
+
+def profile_query(shard_profile: Dict[str, Any]) -> str:
+    """Query text for a normalized shard profile (see FinalAnalysisNode.shard_profile)"""
+    goal = shard_profile.get("primary_goal") or ""
+    terms = [goal, shard_profile.get("credit_score") or "", SITUATION_QUERY_TERMS.get(shard_profile.get("credit_situation"), "")]
+    for keyword, expansion in GOAL_QUERY_TERMS:
+        if keyword in goal.lower():
+            terms.append(expansion)
+            break
+    return " ".join(term for term in terms if term)
+
+class CardIndex:
+    # Vector index over card text for candidate recall, built offline. Text is embedded as
+    # hashed TF-IDF: tokens are hashed into a fixed number of dimensions, so memory stays
+    # bounded as the catalog grows and no vocabulary is kept, weighted by inverse document
+    # frequency and L2-normalized so a dot product is the cosine similarity.
+
+    def __init__(self, cards: List[Dict[str, Any]], dimensions: int = 1024):
+        self.dimensions = dimensions
+        self.names = [card.get("name") for card in cards]
+        self._rows = {name: row for row, name in enumerate(self.names)}
+        counts = np.zeros((len(cards), dimensions), dtype=np.float32)
+        for row, card in enumerate(cards):
+            for token in tokenize(card_text(card)):
+                counts[row, self._bucket(token)] += 1.0
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = (np.log((1.0 + len(cards)) / (1.0 + document_frequency)) + 1.0).astype(np.float32)
+        self.vectors = self._normalize(self._weigh(counts))
+
+    def embed(self, text: str) -> np.ndarray:
+        counts = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            counts[self._bucket(token)] += 1.0
+        return self._normalize(self._weigh(counts))
+
+    def search(self, query: str, k: int, names: Optional[List[str]] = None) -> List[str]:
+        """Names of the k cards most similar to query, best first, among names if given"""
+        rows = np.arange(len(self.names)) if names is None else np.array([self._rows[name] for name in names if name in self._rows], dtype=int)
+        if len(rows) == 0:
+            return []
+        scores = self.vectors[rows] @ self.embed(query)
+        # Stable sort so equal scores keep catalog order
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [self.names[rows[position]] for position in order]
+
+    def _bucket(self, token: str) -> int:
+        # crc32 rather than hash() so vectors are the same in every process
+        return zlib.crc32(token.encode("utf-8")) % self.dimensions
+
+    def _weigh(self, counts: np.ndarray) -> np.ndarray:
+        # Sublinear term frequency, so a word repeated in a long rewards text doesn't dominate
+        weights = np.zeros_like(counts)
+        present = counts > 0
+        weights[present] = 1.0 + np.log(counts[present])
+        return weights * self.idf
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+class CardRetriever:
+    # Recalls a fixed number of candidate cards per profile before the shard stage, so the
+    # sub-agent prompts stay the same size however large the catalog grows. The index of a
+    # catalog is built once and reused until the catalog's cards change.
+
+    def __init__(self, top_k: int = 36, dimensions: int = 1024):
+        self.top_k = top_k
+        self.dimensions = dimensions
+        self._index = None
+        self._index_key = None
+        self._lock = threading.Lock()
+
+    def index_for(self, catalog: List[Dict[str, Any]]) -> CardIndex:
+        key = tuple(card.get("name", "") for card in catalog)
+        with self._lock:
+            if self._index_key != key:
+                self._index = CardIndex(catalog, self.dimensions)
+                self._index_key = key
+                logger.info(f" Built card retrieval index over {len(catalog)} cards")
+            return self._index
+
+    def retrieve(self, catalog: List[Dict[str, Any]], pool: List[Dict[str, Any]], shard_profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The top_k cards of pool closest to the profile, in catalog order; pool itself if it is no larger"""
+        if len(pool) <= self.top_k:
+            return pool
+        names = set(self.index_for(catalog).search(profile_query(shard_profile), self.top_k, [card.get("name") for card in pool]))
+        return [card for card in pool if card.get("name") in names]
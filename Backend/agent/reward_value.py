@@ -0,0 +1,231 @@
+from typing import Dict, Any, List, Sequence, Tuple, Union
+from functools import lru_cache
+import re
+import logging
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Spend categories and the words that identify them in answers and reward descriptions
+SPEND_CATEGORIES = {
+    "dining": ["dining", "restaurant", "food delivery", "takeout"],
+    "groceries": ["grocer", "supermarket"],
+    "gas": ["gas", "fuel", "ev charging"],
+    "travel": ["travel", "flight", "airline", "airfare", "hotel", "rental car", "transit"],
+    "shopping": ["shopping", "online", "retail", "amazon", "walmart", "target", "costco", "apple", "department store"],
+    "entertainment": ["entertainment", "streaming"],
+}
+
+# Words that mark a reward rate as the rate on everything else
+BASE_RATE_WORDS = ["other", "all purchases", "every purchase", "everything", "everywhere", "elsewhere", "on purchases", "all eligible"]
+
+# Assumed value of one point or mile, in percent of a dollar
+POINT_VALUE_PERCENT = 1.0
+
+# Share of monthly spending assumed to go to the user's top spend category
+TOP_CATEGORY_SHARE = 0.4
+
+RATE_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(%|x\b|miles?\b|points?\b|pts\b)(\s+off\b)?', re.IGNORECASE)
+
+# Reward descriptions list their rates as clauses, e.g. "3% on dining, 2% on gas; 1% on others"
+CLAUSE_PATTERN = re.compile(r'[;,]\s+|\s+then\s+', re.IGNORECASE)
+
+# Column order of the reward rate table: every spend category, then the base rate
+CATEGORY_KEYS = list(SPEND_CATEGORIES) + ["other"]
+
+# A sign-up bonus is earned once, so its value is spread over this many years
+BONUS_AMORTIZATION_YEARS = 2.0
+
+# Average balance carried by someone who doesn't pay in full, in months of spending
+REVOLVING_BALANCE_MONTHS = 1.0
+
+# APR assumed when a card's regular APR can't be read
+DEFAULT_APR_PERCENT = 24.0
+
+@lru_cache(maxsize=4096)
+def parse_reward_rates(rewards_text: str) -> Tuple[Tuple[str, float], ...]:
+    """Parse a rewards description into (category, percent back) pairs, including an "other" base rate
+
+    A rate applies to the categories named in its clause and in the clauses that follow it
+    without a rate of their own. Points and miles multipliers are valued at POINT_VALUE_PERCENT
+    each. Store discounts ("5% off") and spending caps are ignored.
+    """
+    text = str(rewards_text or "")
+
+    # Group each rate with the clauses that continue it, e.g. "3% cash back in one category (e.g." + "gas" + "online shopping)"
+    groups = []
+    for clause in CLAUSE_PATTERN.split(text):
+        matches = list(RATE_PATTERN.finditer(clause))
+        if not matches:
+            if groups:
+                groups[-1]["text"] += " " + clause.lower()
+            continue
+        # A clause can hold several rates, e.g. "2% at grocery and 1% others"
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(clause)
+            piece = clause[match.start():end].lower()
+            value = float(match.group(1))
+            if match.group(2) != "%":
+                value *= POINT_VALUE_PERCENT
+            groups.append({"value": value, "discount": match.group(3) is not None, "text": piece, "is_base": any(word in piece for word in BASE_RATE_WORDS)})
+
+    rates = {}
+    base_rates = []
+    unlabeled_rates = []
+    for group in groups:
+        value = group["value"]
+        # Sanity bound: anything above this is a bonus amount or a typo, not an earn rate
+        if group["discount"] or value <= 0 or value > 10:
+            continue
+        categories = [category for category, words in SPEND_CATEGORIES.items() if any(word in group["text"] for word in words)]
+        for category in categories:
+            rates[category] = max(rates.get(category, 0.0), value)
+        if group["is_base"]:
+            base_rates.append(value)
+        elif not categories:
+            # e.g. "5% in rotating categories" or "5% back on J.Crew purchases": a bonus we can't place
+            unlabeled_rates.append(value)
+
+    if base_rates:
+        base = min(base_rates)
+    elif unlabeled_rates and not rates and len(unlabeled_rates) == 1:
+        base = unlabeled_rates[0]
+    elif rates or unlabeled_rates:
+        base = min(min(list(rates.values()) + unlabeled_rates), 1.0)
+    else:
+        base = 1.0 if "cash back" in text.lower() and not groups else 0.0
+    rates["other"] = base
+    return tuple(sorted(rates.items()))
+
+def _clean(text: Any) -> str:
+    # Drop the citation markers left in the scraped card data
+    return re.sub(r':contentReference\[[^\]]*\]\{[^}]*\}', '', str(text or ""))
+
+def _amount(text: str) -> float:
+    return float(text.replace(",", ""))
+
+def parse_signup_bonus(signup_text: Any) -> Dict[str, Any]:
+    """Read a sign-up bonus as its dollar value, the spend it requires and the months allowed to reach it"""
+    text = _clean(signup_text)
+    lowered = text.lower()
+    offer, _, requirement = lowered.partition("after")
+
+    value = sum(_amount(m) for m in re.findall(r'\$(\d[\d,]*)', offer))
+    for points in re.findall(r'(\d[\d,]*)\s*(?:[a-z®™ ]{0,30}?)(?:points|miles|avios)', offer):
+        value += _amount(points) * POINT_VALUE_PERCENT / 100.0
+
+    required_spend = 0.0
+    months = 12.0
+    spend_match = re.search(r'\$(\d[\d,]*)', requirement)
+    if spend_match:
+        required_spend = _amount(spend_match.group(1))
+    period_match = re.search(r'(\d+)\s*(months?|days?)', requirement)
+    if period_match:
+        months = float(period_match.group(1))
+        if period_match.group(2).startswith("day"):
+            months /= 30.0
+
+    return {
+        "value": value,
+        "required_spend": required_spend,
+        "months": months,
+        # "Cashback Match" doubles the first year's rewards
+        "matches_first_year": "match" in lowered
+    }
+
+def parse_regular_apr(apr_text: Any) -> float:
+    """Midpoint of a regular APR range such as "18.24%–29.99% variable\""""
+    rates = [float(r) for r in re.findall(r'(\d+(?:\.\d+)?)\s*%', _clean(apr_text))]
+    if not rates:
+        return DEFAULT_APR_PERCENT
+    return sum(rates[:2]) / len(rates[:2])
+
+def parse_intro_months(intro_text: Any) -> float:
+    """Months of 0% intro APR on purchases, 0 if there is none"""
+    text = _clean(intro_text).lower()
+    if not text.startswith("0%"):
+        return 0.0
+    months_match = re.search(r'(\d+)\s*(months?|billing cycles?)', text)
+    return float(months_match.group(1)) if months_match else 0.0
+
+class RewardValueCalculator:
+    # Net annual value of every card in a catalog for one or many spending profiles at once.
+    # Card terms are parsed once into arrays; scoring a profile is a few vectorized operations.
+    #
+    # net value = rewards - annual fee + sign-up bonus / BONUS_AMORTIZATION_YEARS
+    #             - interest on the carried balance (only when the user carries a balance)
+
+    def __init__(self, cards: List[Dict[str, Any]]):
+        self.card_names = [card.get("name", "Unknown") for card in cards]
+        count = len(cards)
+
+        # Reward rates in percent, one row per card and one column per CATEGORY_KEYS entry
+        self.rates = np.zeros((count, len(CATEGORY_KEYS)))
+        self.annual_fees = np.zeros(count)
+        self.bonus_values = np.zeros(count)
+        self.bonus_required_spend = np.zeros(count)
+        self.bonus_months = np.ones(count)
+        self.bonus_matches_first_year = np.zeros(count, dtype=bool)
+        self.regular_aprs = np.zeros(count)
+        self.intro_months = np.zeros(count)
+
+        for i, card in enumerate(cards):
+            rates = dict(parse_reward_rates(card.get("rewards", "")))
+            self.rates[i] = [rates.get(key, rates["other"]) for key in CATEGORY_KEYS]
+            fee = card.get("annual_fee", 0)
+            self.annual_fees[i] = fee if isinstance(fee, (int, float)) else first_number(fee)
+            bonus = parse_signup_bonus(card.get("signup_bonus", ""))
+            self.bonus_values[i] = bonus["value"]
+            self.bonus_required_spend[i] = bonus["required_spend"]
+            self.bonus_months[i] = bonus["months"]
+            self.bonus_matches_first_year[i] = bonus["matches_first_year"]
+            self.regular_aprs[i] = parse_regular_apr(card.get("regular_apr", ""))
+            self.intro_months[i] = min(parse_intro_months(card.get("intro_apr", "")), 12.0)
+
+        # Annual interest paid per dollar of carried balance, after any 0% intro period
+        self._interest_per_dollar = self.regular_aprs / 100.0 * (12.0 - self.intro_months) / 12.0
+
+    def category_index(self, category: str) -> int:
+        return CATEGORY_KEYS.index(category) if category in CATEGORY_KEYS else CATEGORY_KEYS.index("other")
+
+    def breakdown(self, monthly_spends: Union[float, Sequence[float]], top_categories: Union[str, Sequence[str]],
+                  carries_balance: Union[bool, Sequence[bool]] = False) -> Dict[str, np.ndarray]:
+        """Components of the net annual value, each shaped (profiles, cards)"""
+        spends = np.atleast_1d(np.asarray(monthly_spends, dtype=float))
+        categories = [top_categories] if isinstance(top_categories, str) else list(top_categories)
+        top_index = np.array([self.category_index(category) for category in categories])
+        carries = np.broadcast_to(np.atleast_1d(np.asarray(carries_balance, dtype=bool)), spends.shape)
+
+        # Monthly spend per category: TOP_CATEGORY_SHARE in the top category, the rest at the base rate
+        spend_by_category = np.zeros((len(spends), len(CATEGORY_KEYS)))
+        spend_by_category[:, CATEGORY_KEYS.index("other")] = spends * (1 - TOP_CATEGORY_SHARE)
+        spend_by_category[np.arange(len(spends)), top_index] += spends * TOP_CATEGORY_SHARE
+
+        rewards = spend_by_category @ self.rates.T * 12.0 / 100.0
+        reachable = self.bonus_required_spend[None, :] <= spends[:, None] * self.bonus_months[None, :]
+        bonus = np.where(reachable, self.bonus_values[None, :], 0.0)
+        bonus = bonus + np.where(self.bonus_matches_first_year[None, :], rewards, 0.0)
+        interest = (carries * spends * REVOLVING_BALANCE_MONTHS)[:, None] * self._interest_per_dollar[None, :]
+
+        return {
+            "rewards": rewards,
+            "annual_fee": np.broadcast_to(self.annual_fees, rewards.shape),
+            "amortized_bonus": bonus / BONUS_AMORTIZATION_YEARS,
+            "interest": interest
+        }
+
+    def batch_net_annual_value(self, monthly_spends: Sequence[float], top_categories: Sequence[str],
+                               carries_balance: Union[bool, Sequence[bool]] = False) -> np.ndarray:
+        """Net annual value in dollars, shaped (profiles, cards)"""
+        parts = self.breakdown(monthly_spends, top_categories, carries_balance)
+        return parts["rewards"] - parts["annual_fee"] + parts["amortized_bonus"] - parts["interest"]
+
+    def net_annual_value(self, monthly_spend: float, top_category: str, carries_balance: bool = False) -> np.ndarray:
+        """Net annual value in dollars of every card for one profile"""
+        return self.batch_net_annual_value([monthly_spend], [top_category], carries_balance)[0]
+
+def first_number(text: Any) -> float:
+    """First number in text, commas allowed (e.g. an annual fee of "$1,000"), 0 if there is none"""
+    match = re.search(r'(\d[\d,]*(?:\.\d+)?)', str(text))
+    return _amount(match.group(1)) if match else 0.0
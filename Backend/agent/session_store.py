@@ -0,0 +1,477 @@
+from typing import Dict, Any, Optional
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from agent.nodes import State
+from agent.profile_parser import parse_profile
+from agent.memory import approx_size
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Serialized states at least this large are zlib-compressed
+COMPRESS_MIN_BYTES = 512
+
+def serialize_state(state: State) -> bytes:
+    """Encode a State as compact JSON, compressed when large.
+
+    Profile answers are stored as a list in field order, parsed_profile is rebuilt on load
+    and analysis_result drops its copy of the profile.
+    """
+    analysis_result = state.analysis_result
+    if analysis_result and "user_profile" in analysis_result:
+        analysis_result = {key: value for key, value in analysis_result.items() if key != "user_profile"}
+    payload = {
+        "v": 1,
+        "p": list(state.user_profile.values()),
+        "h": state.conversation_history,
+        "q": state.current_question,
+        "a": analysis_result,
+        "c": state.questions_completed,
+        "u": state.usage
+    }
+    data = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(data, 6)
+    return b"j" + data
+
+def deserialize_state(data: bytes) -> State:
+    """Decode a State written by serialize_state"""
+    body = zlib.decompress(data[1:]) if data[:1] == b"z" else data[1:]
+    payload = json.loads(body)
+    state = State()
+    state.user_profile = dict(zip(state.user_profile.keys(), payload["p"]))
+    state.parsed_profile = parse_profile(state.user_profile)
+    state.conversation_history = payload["h"]
+    state.current_question = payload["q"]
+    state.analysis_result = payload["a"]
+    if state.analysis_result is not None:
+        state.analysis_result["user_profile"] = state.user_profile
+    state.questions_completed = payload["c"]
+    state.usage = payload.get("u")
+    return state
+
+def encode_record(record: Dict[str, Any]) -> str:
+    """Canonical JSON of a shared record, equal for equal records"""
+    return json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+
+class SessionStore(ABC):
+    # Where conversation states live between requests. Callers get() a state, mutate it,
+    # then put() it back so stores that keep a serialized copy see the change.
+    #
+    # Stores several worker processes share also keep small records that expire on their own
+    # (session locks, idempotency results, job records), by kind and key; shares_records tells
+    # whether a store does. The others keep none, and callers fall back to process memory.
+
+    shares_records = False
+
+    def __init__(self):
+        # Lifetime counters of this process
+        self._counters = {"created": 0, "hits": 0, "misses": 0, "expired": 0, "evicted": 0, "deleted": 0}
+        self._counter_lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._counter_lock:
+            self._counters[name] += amount
+
+    def counters(self) -> Dict[str, int]:
+        """A copy of the lifetime counters, taken without touching the stored sessions"""
+        with self._counter_lock:
+            return dict(self._counters)
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[State]:
+        """The stored state, or None if there is none or it expired"""
+
+    @abstractmethod
+    def put(self, session_id: str, state: State):
+        """Store state under session_id, creating the session if needed"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Remove a session, returning whether it existed"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Cheap figures for /health: entry count, limits and lifetime counters"""
+
+    def session_sizes(self) -> Optional[Dict[str, int]]:
+        """Approximate bytes of each session by id, or None if the store can't tell cheaply"""
+        return None
+
+    def put_record(self, kind: str, key: str, record: Dict[str, Any], ttl_seconds: float, only_if_absent: bool = False) -> bool:
+        """Store a shared record for ttl_seconds, returning whether it was stored; with
+        only_if_absent it isn't when an unexpired record of that kind and key exists"""
+        return False
+
+    def get_record(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        """An unexpired shared record, or None"""
+        return None
+
+    def delete_record(self, kind: str, key: str, expected: Optional[Dict[str, Any]] = None) -> bool:
+        """Delete a shared record, only if it still equals expected when that is given"""
+        return False
+
+    def put_job(self, job_id: str, record: Dict[str, Any], ttl_seconds: float):
+        """Share a background job's record with the other workers for ttl_seconds. Stores only
+        this process can see keep nothing: the job manager's own table serves it."""
+        self.put_record("job", job_id, record, ttl_seconds)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job record shared by put_job() from any worker, or None"""
+        return self.get_record("job", job_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+class InMemorySessionStore(SessionStore):
+    # Sessions in process memory, kept in last-access order. Sessions idle for longer than
+    # idle_ttl_seconds expire, and the least recently used session is evicted once max_entries
+    # is reached, so memory stays bounded however many visitors abandon their session.
+
+    def __init__(self, max_entries: int = 10000, idle_ttl_seconds: float = 1800.0):
+        super().__init__()
+        self.max_entries = max_entries
+        self.idle_ttl_seconds = idle_ttl_seconds
+        # session_id -> (state, last access time), least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[State]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id) if session_id else None
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._sessions[session_id] = (entry[0], now)
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def put(self, session_id: str, state: State):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if session_id not in self._sessions:
+                self._counters["created"] += 1
+                while len(self._sessions) >= self.max_entries:
+                    self._sessions.popitem(last=False)
+                    self._counters["evicted"] += 1
+            self._sessions[session_id] = (state, now)
+            self._sessions.move_to_end(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if self._sessions.pop(session_id, None) is None:
+                return False
+            self._counters["deleted"] += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count and lifetime counters; bytes held are measured by session_sizes()"""
+        with self._lock:
+            self._expire(time.monotonic())
+            entries = len(self._sessions)
+            counters = dict(self._counters)
+        return {
+            "backend": "memory",
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            **counters
+        }
+
+    def counters(self) -> Dict[str, int]:
+        # Counters here change under the session lock, not the counter lock
+        with self._lock:
+            return dict(self._counters)
+
+    def session_sizes(self) -> Optional[Dict[str, int]]:
+        """Approximate bytes each session's State holds in memory"""
+        with self._lock:
+            self._expire(time.monotonic())
+            sessions = [(session_id, state) for session_id, (state, _) in self._sessions.items()]
+        return {session_id: approx_size(state) for session_id, state in sessions}
+
+    def _expire(self, now: float):
+        # Entries are in last-access order, so the expired ones are all at the front
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access < self.idle_ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self._counters["expired"] += 1
+
+class SQLiteSessionStore(SessionStore):
+    # Sessions serialized into a SQLite database in WAL mode, so several worker processes on
+    # one machine can share them: readers never block the writer and each write is one short
+    # transaction. Expired and excess sessions are swept every sweep_interval writes, along with
+    # expired shared records.
+
+    shares_records = True
+
+    def __init__(self, path: str, max_entries: int = 10000, idle_ttl_seconds: float = 1800.0, sweep_interval: int = 100):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, last_access REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS records (kind TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (kind, key))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, session_id: str) -> Optional[State]:
+        if not session_id:
+            self._count("misses")
+            return None
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute("SELECT data, last_access FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or now - row[1] >= self.idle_ttl_seconds:
+            self._count("misses")
+            return None
+        connection.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+        self._count("hits")
+        return deserialize_state(row[0])
+
+    def put(self, session_id: str, state: State):
+        connection = self._connection()
+        data = serialize_state(state)
+        now = time.time()
+        if connection.execute("INSERT OR IGNORE INTO sessions (id, data, last_access) VALUES (?, ?, ?)", (session_id, data, now)).rowcount:
+            self._count("created")
+        else:
+            connection.execute("UPDATE sessions SET data = ?, last_access = ? WHERE id = ?", (data, now, session_id))
+        with self._counter_lock:
+            self._writes += 1
+            sweep = self._writes % self.sweep_interval == 0
+        if sweep:
+            self._sweep(connection)
+
+    def delete(self, session_id: str) -> bool:
+        deleted = self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+        if deleted:
+            self._count("deleted")
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        """Live entry count, database size and lifetime counters, without writing; sweeping is
+        left to put()"""
+        connection = self._connection()
+        entries = connection.execute(
+            "SELECT COUNT(*) FROM sessions WHERE last_access >= ?", (time.time() - self.idle_ttl_seconds,)
+        ).fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        counters = self.counters()
+        return {
+            "backend": "sqlite",
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "approx_bytes": page_count * page_size,
+            **counters
+        }
+
+    def session_sizes(self) -> Optional[Dict[str, int]]:
+        """Serialized (possibly compressed) bytes of each session, as stored on disk"""
+        rows = self._connection().execute(
+            "SELECT id, length(data) FROM sessions WHERE last_access >= ?", (time.time() - self.idle_ttl_seconds,)
+        ).fetchall()
+        return dict(rows)
+
+    def put_record(self, kind: str, key: str, record: Dict[str, Any], ttl_seconds: float, only_if_absent: bool = False) -> bool:
+        now = time.time()
+        values = (kind, key, encode_record(record), now + ttl_seconds)
+        if only_if_absent:
+            # One statement, so two workers can't both find the key free: an expired record is replaced
+            return self._connection().execute(
+                "INSERT INTO records (kind, key, data, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at WHERE records.expires_at <= ?",
+                values + (now,)
+            ).rowcount > 0
+        self._connection().execute("INSERT OR REPLACE INTO records (kind, key, data, expires_at) VALUES (?, ?, ?, ?)", values)
+        return True
+
+    def get_record(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT data FROM records WHERE kind = ? AND key = ? AND expires_at > ?", (kind, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def delete_record(self, kind: str, key: str, expected: Optional[Dict[str, Any]] = None) -> bool:
+        if expected is None:
+            return self._connection().execute("DELETE FROM records WHERE kind = ? AND key = ?", (kind, key)).rowcount > 0
+        return self._connection().execute(
+            "DELETE FROM records WHERE kind = ? AND key = ? AND data = ?", (kind, key, encode_record(expected))
+        ).rowcount > 0
+
+    def _sweep(self, connection: sqlite3.Connection):
+        connection.execute("DELETE FROM records WHERE expires_at <= ?", (time.time(),))
+        expired = connection.execute("DELETE FROM sessions WHERE last_access < ?", (time.time() - self.idle_ttl_seconds,)).rowcount
+        # Least recently used sessions beyond max_entries
+        evicted = connection.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        self._count("expired", expired)
+        self._count("evicted", evicted)
+
+class FakeRedis:
+    # In-process stand-in for a Redis client, implementing the subset of the redis-py
+    # interface RedisSessionStore uses. For local development and single-process runs.
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                del self._data[name]
+                return None
+            return entry[0]
+
+    def set(self, name: str, value: bytes, ex: Optional[float] = None, px: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        ttl = px / 1000 if px else ex
+        with self._lock:
+            if nx and self._live(name):
+                return None
+            self._data[name] = (value, time.monotonic() + ttl if ttl else None)
+        return True
+
+    def eval(self, script: str, numkeys: int, *keys_and_args) -> int:
+        # Only the compare-and-delete script RedisSessionStore deletes records with
+        name, expected = keys_and_args[0], keys_and_args[1]
+        with self._lock:
+            if self._live(name) and self._data[name][0] == expected:
+                del self._data[name]
+                return 1
+        return 0
+
+    def _live(self, name: str) -> bool:
+        entry = self._data.get(name)
+        return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
+
+    def getex(self, name: str, ex: Optional[float] = None) -> Optional[bytes]:
+        value = self.get(name)
+        if value is not None and ex:
+            self.set(name, value, ex=ex)
+        return value
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def dbsize(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+# Deletes KEYS[1] only if it still holds ARGV[1], atomically on the server
+_COMPARE_AND_DELETE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+class RedisSessionStore(SessionStore):
+    # Sessions serialized into Redis (or anything speaking its protocol), shared by every
+    # worker and node. The idle TTL is the key expiry, refreshed on each read; the entry limit
+    # is left to the server's maxmemory policy (allkeys-lru), which evicts on its own. Shared
+    # records are keys "<kind>:<key>" expiring with their TTL.
+
+    shares_records = True
+
+    def __init__(self, client: Any, idle_ttl_seconds: float = 1800.0, key_prefix: str = "session:"):
+        super().__init__()
+        self.client = client
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.key_prefix = key_prefix
+
+    def get(self, session_id: str) -> Optional[State]:
+        data = self.client.getex(self.key_prefix + session_id, ex=int(self.idle_ttl_seconds)) if session_id else None
+        if data is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return deserialize_state(data)
+
+    def put(self, session_id: str, state: State):
+        self.client.set(self.key_prefix + session_id, serialize_state(state), ex=int(self.idle_ttl_seconds))
+
+    def delete(self, session_id: str) -> bool:
+        deleted = self.client.delete(self.key_prefix + session_id) > 0
+        if deleted:
+            self._count("deleted")
+        return deleted
+
+    def put_record(self, kind: str, key: str, record: Dict[str, Any], ttl_seconds: float, only_if_absent: bool = False) -> bool:
+        data = encode_record(record).encode("utf-8")
+        return bool(self.client.set(f"{kind}:{key}", data, px=max(1, int(ttl_seconds * 1000)), nx=only_if_absent))
+
+    def get_record(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        data = self.client.get(f"{kind}:{key}")
+        return json.loads(data) if data is not None else None
+
+    def delete_record(self, kind: str, key: str, expected: Optional[Dict[str, Any]] = None) -> bool:
+        if expected is None:
+            return self.client.delete(f"{kind}:{key}") > 0
+        return self.client.eval(_COMPARE_AND_DELETE, 1, f"{kind}:{key}", encode_record(expected).encode("utf-8")) > 0
+
+    def stats(self) -> Dict[str, Any]:
+        counters = self.counters()
+        # Whether a write created the key isn't known without an extra round trip
+        counters.pop("created")
+        return {
+            "backend": "redis",
+            # Keys in the whole database, which may be shared with other data
+            "entries": self.client.dbsize(),
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            **counters
+        }
+
+def create_session_store() -> SessionStore:
+    """Build the session store selected by SESSION_BACKEND: memory, sqlite, redis or fakeredis"""
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    max_entries = int(os.getenv("SESSION_MAX_ENTRIES", 10000))
+    idle_ttl_seconds = float(os.getenv("SESSION_IDLE_TTL_SECONDS", 1800))
+
+    if backend == "sqlite":
+        path = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+        logger.info(f" Using SQLite session store at {path}")
+        return SQLiteSessionStore(path, max_entries=max_entries, idle_ttl_seconds=idle_ttl_seconds)
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("SESSION_BACKEND=redis requires the redis package: pip install redis")
+        url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        logger.info(f" Using Redis session store at {url}")
+        return RedisSessionStore(redis.Redis.from_url(url), idle_ttl_seconds=idle_ttl_seconds)
+    if backend == "fakeredis":
+        logger.info(" Using in-process fake Redis session store")
+        return RedisSessionStore(FakeRedis(), idle_ttl_seconds=idle_ttl_seconds)
+    return InMemorySessionStore(max_entries=max_entries, idle_ttl_seconds=idle_ttl_seconds)
@@ -0,0 +1,80 @@
+from typing import Dict, Any, Optional, Callable
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import threading
+import time
+
+from agent.tracing import tracer
+from agent.memory import approx_size
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class SpeculativeCache:
+    # Work started before anyone asked for it, keyed by its inputs, so a later request with the
+    # same inputs finds it running or finished. Entries are shared by every request and session
+    # with the same key and kept for ttl_seconds; work that expires without being taken counts
+    # as wasted. Each cache runs on its own pool, so work in one cache can wait on another's.
+    # With take_once, taking an entry removes it, for work that only one request may use.
+
+    def __init__(self, name: str, max_workers: int = 4, max_entries: int = 256, ttl_seconds: float = 300.0, take_once: bool = False):
+        self.name = name
+        self.take_once = take_once
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"speculative-{name}")
+        # key -> [future, started at, taken], oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"started": 0, "hits": 0, "misses": 0, "wasted": 0}
+
+    def start(self, key: str, work: Callable[..., Any], *args) -> Future:
+        """Start work(*args) for key unless it is already cached, returning its future"""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            future = self._executor.submit(tracer.wrap(work), *args)
+            self._entries[key] = [future, time.monotonic(), False]
+            self.counters["started"] += 1
+        logger.info(f" Started speculative {self.name} work")
+        return future
+
+    def take(self, key: str) -> Optional[Future]:
+        """Future of the work cached for key, or None if there is none"""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            entry[2] = True
+            if self.take_once:
+                del self._entries[key]
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {"entries": len(self._entries), **self.counters}
+
+    def approx_bytes(self) -> int:
+        """Approximate bytes held by the keys and the results of finished work"""
+        with self._lock:
+            entries = list(self._entries.items())
+        return sum(
+            approx_size(key) + (approx_size(future.result()) if future.done() and future.exception() is None else 0)
+            for key, (future, _, _) in entries
+        )
+
+    def _expire(self, now: float):
+        while self._entries:
+            key, (future, started_at, taken) = next(iter(self._entries.items()))
+            if now - started_at < self.ttl_seconds and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+            if not taken:
+                self.counters["wasted"] += 1
@@ -8,15 +8,7 @@ from data_pipeline.database import JSONDatabaseManager
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('credit_card_analysis.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging (handlers are set up once by agent.logging_config.configure_logging)
 logger = logging.getLogger(__name__)
 
 class ParallelCardAnalysisInput(BaseModel):
@@ -35,33 +27,26 @@ class SubAgentCardAnalysisTool(BaseTool):
         self._agent_id = agent_id
         logger.info(f"🔧 Initialized {self._agent_id} with database manager")
 
-    def _run(self, user_profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def _run(self, user_profile: Dict[str, Any], cards: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         try:
             
             
-            # Get all cards from database
-            all_cards = self._db_manager.get_all_cards_for_llm()
+            # Get all cards from database, unless the caller already narrowed them down
+            all_cards = cards if cards is not None else self._db_manager.get_all_cards_for_llm()
             logger.info(f"📊 {self._agent_id.upper()} loaded {len(all_cards)} total cards from database")
-            print(f" DEBUG: {self._agent_id.upper()} - Loaded {len(all_cards)} cards from database")
             
             # Split cards based on agent ID (0, 1, or 2) - 33% each
             if self._agent_id == "agent_0":
                 cards_to_analyze = all_cards[:len(all_cards)//3]  # First third
                 logger.info(f"🔪 {self._agent_id.upper()} analyzing first third: {len(cards_to_analyze)} cards")
-                print(f" DEBUG: {self._agent_id.upper()} - Analyzing first third: {len(cards_to_analyze)} cards")
             elif self._agent_id == "agent_1":
                 cards_to_analyze = all_cards[len(all_cards)//3:2*len(all_cards)//3]  # Second third
                 logger.info(f"🔪 {self._agent_id.upper()} analyzing second third: {len(cards_to_analyze)} cards")
-                print(f" DEBUG: {self._agent_id.upper()} - Analyzing second third: {len(cards_to_analyze)} cards")
             else:  # agent_2
                 cards_to_analyze = all_cards[2*len(all_cards)//3:]  # Third third
                 logger.info(f"🔪 {self._agent_id.upper()} analyzing third third: {len(cards_to_analyze)} cards")
-                print(f" DEBUG: {self._agent_id.upper()} - Analyzing third third: {len(cards_to_analyze)} cards")
             
-            print(f" {self._agent_id.upper()} ANALYZING {len(cards_to_analyze)} cards...")
-            print(f" DEBUG: {self._agent_id.upper()} - Card names in this batch:")
-            for i, card in enumerate(cards_to_analyze[:5]):  # Show first 5
-                print(f"  {i+1}. {card.get('Card name', 'Unknown')}")
+            logger.debug("%s card names in this batch: %s", self._agent_id.upper(), [card.get('name', 'Unknown') for card in cards_to_analyze[:5]])
             
             # Create card data for analysis (simplified to reduce token count)
             card_data_for_llm = []
@@ -79,11 +64,10 @@ class SubAgentCardAnalysisTool(BaseTool):
                 card_data_for_llm.append(card_info)
             
             logger.info(f"📋 {self._agent_id.upper()} prepared {len(card_data_for_llm)} cards for analysis")
-            print(f" DEBUG: {self._agent_id.upper()} - Prepared {len(card_data_for_llm)} cards for LLM")
             
             # Check if user is a student
             is_student = user_profile.get('credit_situation', '').lower().find('student') != -1
-            print(f" DEBUG: {self._agent_id.upper()} - User is student: {is_student}")
+            logger.debug("%s user is student: %s", self._agent_id.upper(), is_student)
             
             # Create simplified sub-agent analysis prompt with student handling
             student_instruction = ""
@@ -119,12 +103,10 @@ TASK: Select ~{len(card_data_for_llm)//2} best cards. Return JSON array with "na
             }
             
             logger.info(f" {self._agent_id.upper()} completed data preparation")
-            print(f" DEBUG: {self._agent_id.upper()} - Completed data preparation")
             return result
             
         except Exception as e:
             logger.error(f" Error in {self._agent_id} analysis: {e}")
-            print(f" DEBUG: {self._agent_id.upper()} - ERROR: {e}")
             return {"agent_id": self._agent_id, "cards": [], "user_profile": user_profile}
 
 class FinalCardSelectionTool(BaseTool):
@@ -138,6 +120,14 @@ class FinalCardSelectionTool(BaseTool):
         self._db_manager = db_manager
         logger.info(" Initialized Final Card Selection Tool")
 
+    def get_all_cards(self) -> List[Dict[str, Any]]:
+        """Full card records for local ranking, which needs every field the client is shown"""
+        return self._db_manager.get_all_cards()
+
+    def get_catalog_data(self) -> Dict[str, List[Dict[str, Any]]]:
+        """The raw catalog the database manager keeps in memory, cards by issuer"""
+        return self._db_manager.cards_data
+
     def _run(self, user_profile: Dict[str, Any]) -> Dict[str, Any]:
         try:
             logger.info(" Final agent starting analysis...")
@@ -0,0 +1,318 @@
+from typing import Dict, Any, List, Optional, Callable, Iterator
+from contextlib import contextmanager
+from uuid import UUID
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class Span:
+    # One timed operation in a trace. Attributes hold what is needed to explain its time,
+    # e.g. card and token counts.
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status', 'thread')
+
+    sampled = True
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.thread = threading.current_thread().name
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_exception(self, error: BaseException):
+        self.status = "error"
+        self.attributes["error.type"] = type(error).__name__
+        self.attributes["error.message"] = str(error)[:500]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "thread": self.thread,
+            "attributes": self.attributes
+        }
+
+class _UnsampledSpan:
+    # Stands in for spans of traces that are disabled or not sampled; its children aren't sampled either
+    sampled = False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_exception(self, error: BaseException):
+        pass
+
+UNSAMPLED = _UnsampledSpan()
+
+# Span the code running in this context belongs to
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def to_otlp(spans: List[Span], service_name: str) -> Dict[str, Any]:
+    """Spans as an OTLP/JSON ExportTraceServiceRequest, the format OpenTelemetry file exporters write"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{
+            "scope": {"name": "agent.tracing"},
+            "spans": [{
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()]
+                              + [{"key": "thread.name", "value": {"stringValue": span.thread}}],
+                "status": {"code": 2 if span.status == "error" else 1}
+            } for span in spans]
+        }]
+    }]}
+
+class FileSpanExporter:
+    # Appends finished spans to a file from a background thread, so request threads only
+    # enqueue them. "json" writes one span per line; "otlp" writes one OTLP/JSON export request
+    # per line for each batch of spans. Spans are dropped and counted when the queue is full.
+
+    def __init__(self, path: str, file_format: str = "json", service_name: str = "credit-card-api", max_queued: int = 10000):
+        self.path = path
+        self.file_format = file_format
+        self.service_name = service_name
+        self._queue = queue.Queue(maxsize=max_queued)
+        self.counters = {"exported": 0, "dropped": 0}
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until the spans queued so far have been written"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "format": self.file_format, "queued": self._queue.qsize(), **self.counters}
+
+    def _run(self):
+        while True:
+            spans = [self._queue.get()]
+            while len(spans) < 512:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    if self.file_format == "otlp":
+                        f.write(json.dumps(to_otlp(spans, self.service_name), default=str) + "\n")
+                    else:
+                        f.writelines(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+                self.counters["exported"] += len(spans)
+            except Exception as e:
+                logger.warning(f" Could not write {len(spans)} spans to {self.path}: {e}")
+            finally:
+                for _ in spans:
+                    self._queue.task_done()
+
+class Tracer:
+    # Creates spans and hands finished ones to the exporter. The current span is kept in a
+    # context variable; work handed to another thread keeps its place in the trace when it is
+    # submitted through wrap(). Disabled (the default) every span is a shared no-op.
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.exporter = None
+        self.callback_handler = TracingCallbackHandler(self)
+
+    def configure(self, exporter: FileSpanExporter, sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.enabled = True
+
+    def current_span(self):
+        return _current_span.get()
+
+    def annotate(self, **attributes):
+        """Set attributes on the current span, if it is recorded"""
+        span = _current_span.get()
+        if span is not None:
+            for key, value in attributes.items():
+                span.set_attribute(key, value)
+
+    def start_span(self, name: str, parent=None, **attributes):
+        """Start a span without making it current; the caller must end_span() it"""
+        parent = parent if parent is not None else _current_span.get()
+        if not self.enabled or parent is UNSAMPLED:
+            return UNSAMPLED
+        if parent is None:
+            if random.random() >= self.sample_rate:
+                return UNSAMPLED
+            return Span(name, secrets.token_hex(16), None, attributes)
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    def end_span(self, span):
+        if span.sampled:
+            span.end_ns = time.time_ns()
+            self.exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Any]:
+        """Run the block in a new span, a child of the current one, recording any exception it raises"""
+        if not self.enabled:
+            yield UNSAMPLED
+            return
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+    def traced(self, name: str) -> Callable:
+        """Decorator running each call of a function in a span"""
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def wrap(self, function: Callable, span=None) -> Callable:
+        """function bound to the current context, so it continues the current trace in another
+        thread; as a child of span instead of the current span if given"""
+        if not self.enabled:
+            return function
+        context = contextvars.copy_context()
+        if span is not None:
+            context.run(_current_span.set, span)
+        return functools.partial(context.run, function)
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        return {"enabled": True, "sample_rate": self.sample_rate, **self.exporter.stats()}
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    # A span per LLM call, a child of the span current when the call starts, with its stage,
+    # model and token counts. Passed in every call's config by metrics.llm_config.
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        # run id -> span
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        metadata = metadata or {}
+        span = self.tracer.start_span(
+            f"llm.{metadata.get('stage', 'unknown')}",
+            model=metadata.get("ls_model_name", "unknown"),
+            prompt_characters=sum(len(str(message.content)) for batch in messages for message in batch)
+        )
+        if span.sampled:
+            with self._lock:
+                self._spans[run_id] = span
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        span = self._pop(run_id)
+        if span is None:
+            return
+        from agent.metrics import LLMMetricsHandler
+        usage = LLMMetricsHandler.usage_of(response)
+        if usage:
+            span.set_attribute("prompt_tokens", usage["prompt_tokens"])
+            span.set_attribute("completion_tokens", usage["completion_tokens"])
+        self.tracer.end_span(span)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        span = self._pop(run_id)
+        if span is not None:
+            span.record_exception(error)
+            self.tracer.end_span(span)
+
+    def _pop(self, run_id: UUID) -> Optional[Span]:
+        with self._lock:
+            return self._spans.pop(run_id, None)
+
+tracer = Tracer()
+
+def configure_tracing():
+    """Turn tracing on when TRACING_ENABLED is set, exporting to TRACE_FILE in TRACE_FORMAT"""
+    if tracer.enabled or os.getenv("TRACING_ENABLED", "false").lower() != "true":
+        return
+    exporter = FileSpanExporter(
+        os.getenv("TRACE_FILE", "traces.jsonl"),
+        file_format=os.getenv("TRACE_FORMAT", "json").lower(),
+        service_name=os.getenv("TRACE_SERVICE_NAME", "credit-card-api")
+    )
+    tracer.configure(exporter, sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 1.0)))
+    logger.info(f" Tracing enabled, writing spans to {exporter.path}")
+
+class TraceMiddleware:
+    # ASGI middleware running each HTTP request in a root span named after its method and
+    # route. Pure ASGI rather than BaseHTTPMiddleware so a streamed response stays in its span
+    # until the last chunk is sent.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+            await send(message)
+
+        with tracer.span(f"{scope['method']} {scope['path']}", **{"http.method": scope["method"], "http.target": scope["path"]}) as span:
+            await self.app(scope, receive, traced_send)
+            route = scope.get("route")
+            if span.sampled and route is not None:
+                # Name the span after the route template, e.g. /status/{session_id}
+                span.name = f"{scope['method']} {route.path}"
@@ -0,0 +1,151 @@
+from typing import Dict, Any, List, Optional
+from uuid import UUID
+from functools import lru_cache
+import json
+import logging
+import os
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from agent.metrics import LLMMetricsHandler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# USD per 1,000 prompt and completion tokens, by model name prefix (longest prefix wins).
+# LLM_PRICES overrides or extends it with JSON like {"gpt-3.5-turbo": [0.0005, 0.0015]}.
+DEFAULT_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06)
+}
+
+@lru_cache(maxsize=1)
+def load_prices() -> Dict[str, tuple]:
+    # Read on first use rather than import, so LLM_PRICES from a .env file is seen
+    prices = dict(DEFAULT_PRICES)
+    overrides = os.getenv("LLM_PRICES")
+    if overrides:
+        try:
+            prices.update({model: tuple(price) for model, price in json.loads(overrides).items()})
+        except (ValueError, TypeError) as e:
+            logger.warning(f" Ignoring invalid LLM_PRICES: {e}")
+    return prices
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Estimated USD cost of a call, None for a model without a known price"""
+    prices = load_prices()
+    matches = [prefix for prefix in prices if model.startswith(prefix)]
+    if not matches:
+        return None
+    prompt_price, completion_price = prices[max(matches, key=len)]
+    return round(prompt_tokens / 1000 * prompt_price + completion_tokens / 1000 * completion_price, 6)
+
+# Guards the claim flags claim_calls() sets on shared results
+_claim_lock = threading.Lock()
+
+def claim_calls(record: Dict[str, Any]) -> bool:
+    """True for the first caller only, which is then billed for the calls in record["usage"].
+    record is work every request with the same inputs may use, e.g. one shard's result."""
+    with _claim_lock:
+        if record.get("usage_claimed"):
+            return False
+        record["usage_claimed"] = True
+        return True
+
+def empty_totals() -> Dict[str, Any]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost_usd": 0.0, "latency_seconds": 0.0}
+
+def add_totals(totals: Optional[Dict[str, Any]], other: Dict[str, Any]) -> Dict[str, Any]:
+    """Sum of two totals dicts, e.g. a session's running totals and one request's"""
+    combined = dict(totals or empty_totals())
+    for key, value in other.items():
+        if key in combined:
+            combined[key] = round(combined[key] + value, 6) if isinstance(value, float) else combined[key] + value
+    return combined
+
+class UsageLedger(BaseCallbackHandler):
+    # Record of the LLM calls made for one piece of work (a shard, a recommendation), passed as
+    # a callback in the calls' config (see metrics.llm_config). Each call keeps its stage, model,
+    # prompt and completion tokens, latency, outcome and estimated cost. Calls cut off or
+    # cancelled part way are recorded without tokens, as the provider reports none for them.
+
+    def __init__(self):
+        self._calls = []
+        # run id -> (stage, model, started)
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        metadata = metadata or {}
+        with self._lock:
+            self._runs[run_id] = (metadata.get("stage", "unknown"), metadata.get("ls_model_name", "unknown"), time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._finish(run_id, "ok", LLMMetricsHandler.usage_of(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._finish(run_id, "error", None)
+
+    def extend(self, calls: List[Dict[str, Any]], shared: bool = False):
+        """Add calls recorded by another ledger, e.g. the shards a recommendation was made from.
+        Shared calls are billed to another request (see claim_calls), so they are listed but left
+        out of totals()."""
+        if shared:
+            calls = [dict(call, shared=True) for call in calls]
+        with self._lock:
+            self._calls.extend(calls)
+
+    def calls(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._calls)
+
+    def totals(self) -> Dict[str, Any]:
+        """Totals of the calls made for this piece of work alone"""
+        return self._totals([call for call in self.calls() if not call.get("shared")])
+
+    def shared_totals(self) -> Dict[str, Any]:
+        """Totals of the calls shared with other requests, each billed to the first request that claimed it"""
+        return self._totals([call for call in self.calls() if call.get("shared")])
+
+    def _totals(self, calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+        totals = empty_totals()
+        for call in calls:
+            totals = add_totals(totals, {
+                "calls": 1,
+                "prompt_tokens": call["prompt_tokens"],
+                "completion_tokens": call["completion_tokens"],
+                "total_tokens": call["prompt_tokens"] + call["completion_tokens"],
+                "cost_usd": call["cost_usd"] or 0.0,
+                "latency_seconds": call["latency_seconds"]
+            })
+        return totals
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals, shared totals and each call, as attached to analysis_result["usage"]"""
+        return {"totals": self.totals(), "shared_totals": self.shared_totals(), "calls": self.calls()}
+
+    def _finish(self, run_id: UUID, outcome: str, usage: Optional[Dict[str, int]]):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, model, started = run
+        prompt_tokens = usage["prompt_tokens"] if usage else 0
+        completion_tokens = usage["completion_tokens"] if usage else 0
+        call = {
+            "stage": stage,
+            "model": model,
+            "outcome": outcome,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "usage_reported": usage is not None,
+            "latency_seconds": round(time.perf_counter() - started, 3),
+            "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens)
+        }
+        with self._lock:
+            self._calls.append(call)
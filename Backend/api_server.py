@@ -1,19 +1,44 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Callable
+from contextlib import nullcontext, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 import os
 import json
+import time
+import secrets
+import asyncio
+import logging
 from dotenv import load_dotenv
 
 # Import our agent components
 from agent.nodes import State, QuestionAskerNode, FinalAnalysisNode
 from agent.edges import ConversationManager
 from agent.tools import create_tools
+from agent.session_store import create_session_store, InMemorySessionStore
+from agent.concurrency import KeyedLock, IdempotencyCache, IdempotencyConflictError, request_fingerprint, AdmissionController, OverloadedError
+from agent.jobs import JobManager, JobQueueFullError
+from agent.resilience import CancelToken, RequestCancelledError
+from agent.question_planner import create_question_planner
+from agent.metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from agent.usage import empty_totals, add_totals
+from agent.logging_config import configure_logging, logging_stats
+from agent.tracing import tracer, configure_tracing, TraceMiddleware
+from agent.profiling import create_request_profiler
+from agent.memory import MemoryAccountant, TracemallocTracker, approx_size, size_distribution
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Configure tracing
+configure_tracing()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Credit Card Recommendation API",
@@ -30,14 +55,118 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Run each request in a trace span (when TRACING_ENABLED)
+app.add_middleware(TraceMiddleware)
+
 # Initialize the agent components
 tools = create_tools()
-question_asker = QuestionAskerNode()
+question_asker = QuestionAskerNode(planner=create_question_planner(tools))
 final_analyzer = FinalAnalysisNode(tools)
 conversation_manager = ConversationManager(question_asker, final_analyzer, tools)
 
-# Store conversation states (in production, use a proper database)
-conversation_states = {}
+# Store conversation states, bounded by an idle TTL and an LRU entry limit.
+# SESSION_BACKEND=sqlite or redis shares them between worker processes.
+session_store = create_session_store()
+
+# Requests for the same session take its lock so they don't mutate one State at once.
+# A shared session store also holds the lock across worker processes.
+session_locks = KeyedLock(shared_store=session_store, lease_seconds=float(os.getenv("SESSION_LOCK_LEASE_SECONDS", 600)))
+
+# Results of requests sent with an Idempotency-Key header, replayed to retries.
+# A shared session store also replays them to retries landing on another worker process.
+idempotency_cache = IdempotencyCache(ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 600)), shared_store=session_store)
+
+# Admission control for the analysis path: a concurrency limit, a bounded wait queue and
+# fast rejection beyond it. Admitted analyses run on their own pool, one thread per slot.
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("ANALYSIS_MAX_CONCURRENT", 8)),
+    max_queued=int(os.getenv("ANALYSIS_MAX_QUEUED", 32)),
+    queue_timeout=float(os.getenv("ANALYSIS_QUEUE_TIMEOUT_SECONDS", 30))
+)
+analysis_executor = ThreadPoolExecutor(max_workers=admission.max_concurrent, thread_name_prefix="analysis")
+
+# Analyses cancelled because their client disconnected
+cancellation_counters = {"requests_cancelled": 0}
+
+# Background recommendation jobs, so long analyses don't hold a connection open. Their records
+# go to the session store too, so with SESSION_BACKEND=sqlite or redis any worker can serve them.
+job_manager = JobManager(
+    max_workers=int(os.getenv("JOB_WORKERS", 4)),
+    max_queued=int(os.getenv("JOB_MAX_QUEUED", 1000)),
+    result_ttl_seconds=float(os.getenv("JOB_RESULT_TTL_SECONDS", 3600)),
+    shared_store=session_store
+)
+
+# Opt-in profiling of single /chat and /submit-profile requests sent with an X-Profile header
+request_profiler = create_request_profiler()
+
+# Admin endpoints (/admin/...) are disabled unless ADMIN_TOKEN is set, and then require it in
+# the X-Admin-Token header
+admin_token = os.getenv("ADMIN_TOKEN") or None
+
+def _session_bytes():
+    # Sessions in SQLite or Redis aren't held by this process
+    if not isinstance(session_store, InMemorySessionStore):
+        return None
+    return sum(session_store.session_sizes().values())
+
+# Approximate memory retained per subsystem, served at /admin/memory and /metrics
+memory_accountant = MemoryAccountant()
+memory_accountant.register("sessions", _session_bytes)
+memory_accountant.register("catalog", lambda: approx_size(tools["final_agent"].get_catalog_data()))
+memory_accountant.register("retrieval_index", lambda: approx_size(final_analyzer.retriever))
+memory_accountant.register("ranker_cache", lambda: approx_size(final_analyzer.ranker))
+memory_accountant.register("idempotency_cache", idempotency_cache.approx_bytes)
+memory_accountant.register("speculative_shards", final_analyzer.speculative_shards.approx_bytes)
+memory_accountant.register("speculative_final", final_analyzer.speculative_finals.approx_bytes)
+memory_accountant.register("jobs", job_manager.approx_bytes)
+
+# tracemalloc snapshots diffed over time; MEMORY_TRACEMALLOC=true starts tracing at startup
+# so the first snapshot's baseline includes the allocations made since
+tracemalloc_tracker = TracemallocTracker(frames=int(os.getenv("TRACEMALLOC_FRAMES", 1)))
+if os.getenv("MEMORY_TRACEMALLOC", "false").lower() == "true":
+    tracemalloc_tracker.start()
+
+def _cache_lookups():
+    # Hits and misses of the caches in front of the analysis, from their own counters
+    speculation = {"speculative_shards": final_analyzer.speculative_shards.stats(), "speculative_final": final_analyzer.speculative_finals.stats()}
+    samples = []
+    for cache, stats in speculation.items():
+        samples.append(("card_analysis_cache_lookups_total", {"cache": cache, "result": "hit"}, stats["hits"]))
+        samples.append(("card_analysis_cache_lookups_total", {"cache": cache, "result": "miss"}, stats["misses"]))
+    # Counters only: stats() would count (or walk) the stored sessions on every scrape
+    sessions = session_store.counters()
+    samples.append(("card_analysis_cache_lookups_total", {"cache": "sessions", "result": "hit"}, sessions["hits"]))
+    samples.append(("card_analysis_cache_lookups_total", {"cache": "sessions", "result": "miss"}, sessions["misses"]))
+    idempotency = idempotency_cache.stats()
+    samples.append(("card_analysis_cache_lookups_total", {"cache": "idempotency", "result": "hit"}, idempotency["replayed"] + idempotency["joined_in_flight"]))
+    samples.append(("card_analysis_cache_lookups_total", {"cache": "idempotency", "result": "miss"}, idempotency["executed"]))
+    return samples
+
+metrics_registry.register_collector("card_analysis_cache_lookups_total", "counter", "Cache lookups in front of the analysis, by cache and result (hit or miss)", _cache_lookups)
+
+def _speculative_wasted():
+    # Speculative work that expired without any request taking it, LLM calls included
+    return [
+        ("card_analysis_speculative_wasted_total", {"cache": cache.name}, cache.stats()["wasted"])
+        for cache in (final_analyzer.speculative_shards, final_analyzer.speculative_finals)
+    ]
+
+metrics_registry.register_collector("card_analysis_speculative_wasted_total", "counter", "Speculative analyses that expired without being taken, by cache", _speculative_wasted)
+
+def _memory_bytes():
+    # Measuring walks every session, so scrapes reuse a measurement up to a minute old
+    sizes = memory_accountant.measure(max_age=float(os.getenv("MEMORY_METRICS_MAX_AGE_SECONDS", 60)))
+    return [("card_analysis_memory_bytes", {"subsystem": name}, size) for name, size in sizes.items() if size is not None]
+
+metrics_registry.register_collector("card_analysis_memory_bytes", "gauge", "Approximate bytes retained by each subsystem of the API process", _memory_bytes)
+
+def _jobs_by_status():
+    # This worker's background jobs; each worker runs only the jobs it accepted
+    stats = job_manager.stats()
+    return [("card_analysis_jobs", {"status": status}, stats[status]) for status in ("queued", "running")]
+
+metrics_registry.register_collector("card_analysis_jobs", "gauge", "Background jobs queued or running in this worker, by status", _jobs_by_status)
 
 # Pydantic models for API requests/responses
 class ChatRequest(BaseModel):
@@ -55,6 +184,13 @@ class CompleteProfileRequest(BaseModel):
     income: str
     credit_score: str
     credit_situation: str
+    mode: Optional[str] = None  # "fast" for local ranking without LLM calls
+    include_usage: bool = False  # Return the LLM token and cost accounting of the recommendation
+
+class BatchProfilesRequest(BaseModel):
+    # Each profile has the CompleteProfileRequest fields, plus an optional "id" echoed in its result
+    profiles: List[Dict[str, Any]]
+    mode: Optional[str] = None  # "fast" for local ranking without LLM calls
 
 class ChatResponse(BaseModel):
     response: str
@@ -62,11 +198,158 @@ class ChatResponse(BaseModel):
     is_complete: bool
     conversation_summary: Optional[Dict[str, Any]] = None
     structured_cards: Optional[List[Dict[str, Any]]] = None  # Add this field
+    current_question: Optional[str] = None  # Profile field the response asks about
+    usage: Optional[Dict[str, Any]] = None  # LLM tokens and estimated cost, when requested
 
 class StartConversationResponse(BaseModel):
     session_id: str
     initial_question: str
     message: str
+    current_question: Optional[str] = None  # Profile field the question asks about
+
+def _get_or_create_session(session_id: Optional[str]) -> Tuple[State, str]:
+    """Return the state for session_id, creating a new session if it doesn't exist"""
+    state = session_store.get(session_id) if session_id else None
+    if state is not None:
+        logger.debug("Using existing session %s", session_id)
+        return state, session_id
+    
+    # Create new session if none exists
+    state = State()
+    import uuid
+    session_id = str(uuid.uuid4())
+    session_store.put(session_id, state)
+    logger.info(f" Created new session: {session_id}")
+    return state, session_id
+
+def _profile_from_request(request: CompleteProfileRequest) -> Dict[str, Any]:
+    """Convert a profile request to the profile dictionary used by the agent"""
+    return {
+        'primary_goal': request.primary_goal,
+        'top_spend_category': request.top_spend_category,
+        'brand_preferences': request.brand_preferences,
+        'travel_frequency': request.travel_frequency,
+        'monthly_spending': request.monthly_spending,
+        'payment_behavior': request.payment_behavior,
+        'income': request.income,
+        'credit_score': request.credit_score,
+        'credit_situation': request.credit_situation
+    }
+
+def _split_recommendation(result: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Split an analysis result into its text response and structured cards"""
+    # Check if result contains structured data
+    if isinstance(result["response"], dict):
+        return result["response"].get("text_response", str(result["response"])), result["response"].get("structured_cards", [])
+    return result["response"], []
+
+async def _run_idempotent(scope: str, idempotency_key: Optional[str], request: BaseModel, work: Callable[[], Any],
+                          admission: Optional[AdmissionController] = None) -> Any:
+    """Run blocking request work in a worker thread, at most once per idempotency key
+
+    With admission, the work first waits for an analysis slot and is turned away with a 429
+    and Retry-After when the server is saturated. Retries joining earlier work take no slot.
+    """
+    loop = asyncio.get_running_loop()
+    key = f"{scope}:{idempotency_key}" if idempotency_key else None
+    if key:
+        try:
+            # Off the event loop, as a shared session store makes the claim a store round trip
+            future, is_owner = await loop.run_in_executor(None, idempotency_cache.claim, key, request_fingerprint(request.model_dump()))
+        except IdempotencyConflictError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if not is_owner:
+            logger.info(f"Returning result of earlier request with idempotency key {idempotency_key}")
+            # Shielded so a caller that goes away doesn't cancel the future other retries wait on
+            return await _shielded(future)
+    else:
+        future = Future()
+    
+    executor = None
+    if admission is not None:
+        try:
+            await admission.acquire()
+        except OverloadedError as e:
+            error = HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+            if key:
+                idempotency_cache.fail(key, error)
+            raise error
+        executor = analysis_executor
+    
+    def run_and_record():
+        # Recorded from the worker thread, so a client that disconnects doesn't lose the result for its retry
+        try:
+            result = work()
+        except BaseException as e:
+            if key:
+                idempotency_cache.fail(key, e)
+            else:
+                future.set_exception(e)
+        else:
+            if key:
+                idempotency_cache.complete(key, result)
+            else:
+                future.set_result(result)
+        finally:
+            if admission is not None:
+                loop.call_soon_threadsafe(admission.release)
+    # run_in_executor doesn't carry the context over, so the worker's spans join the request's trace through wrap()
+    loop.run_in_executor(executor, tracer.wrap(run_and_record))
+    return await _shielded(future)
+
+def _profiled(endpoint: str, x_profile: Optional[str], response: Response, work: Callable[[], Any]) -> Callable[[], Any]:
+    """work, run under the request profiler if the request asked for it; the profile's request id
+    (the trace id when the request is traced) is returned in the X-Profile-Id header"""
+    if not request_profiler.wanted(x_profile):
+        return work
+    span = tracer.current_span()
+    if span is not None and span.sampled:
+        request_id = span.trace_id
+    else:
+        import uuid
+        request_id = uuid.uuid4().hex
+    response.headers["X-Profile-Id"] = request_id
+    return request_profiler.wrap(endpoint, request_id, work)
+
+def _shielded(future: Future) -> asyncio.Future:
+    """Await a worker's future without cancelling it when the caller goes away; its outcome is
+    still retrieved then, so e.g. the RequestCancelledError of a disconnected client isn't logged"""
+    wrapped = asyncio.wrap_future(future)
+    wrapped.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return asyncio.shield(wrapped)
+
+async def _wait_for_disconnect(http_request: Request):
+    # The body has already been read, so the next message is the disconnect
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+def _cancel_request(cancel: CancelToken):
+    if cancel.cancel():
+        cancellation_counters["requests_cancelled"] += 1
+        logger.info("Client disconnected, cancelling its analysis")
+
+async def _run_cancellable(http_request: Request, cancel: CancelToken, awaitable) -> Any:
+    """Await awaitable, cancelling it and the analysis behind cancel if the client disconnects first"""
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(http_request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            # The client is gone (or this handler was cancelled), so stop the work
+            _cancel_request(cancel)
+            task.cancel()
+    if not task.done():
+        # 499 Client Closed Request; nobody is left to read it
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    return task.result()
+
+def _format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.get("/")
 async def root():
@@ -78,7 +361,14 @@ async def root():
             "/start": "Start a new conversation (sequential questions)",
             "/chat": "Send a message to the agent (sequential questions)",
             "/submit-profile": "Submit complete profile and get recommendations in one call",
-            "/status/{session_id}": "Get conversation status"
+            "/submit-profile/stream": "Submit complete profile and stream progress and recommendations (SSE)",
+            "/submit-profiles": "Submit many profiles and stream one recommendation per line as each completes (NDJSON)",
+            "/jobs": "Queue a complete profile for background analysis and get a job id",
+            "/jobs/{job_id}": "Get background job progress and result",
+            "/status/{session_id}": "Get conversation status",
+            "/metrics": "Prometheus metrics for the analysis pipeline",
+            "/admin/memory": "Approximate memory per subsystem and session sizes (requires X-Admin-Token)",
+            "/admin/memory/snapshot": "Take a tracemalloc snapshot diffed with the previous one (requires X-Admin-Token)"
         }
     }
 
@@ -86,8 +376,6 @@ async def root():
 async def start_conversation():
     """Start a new conversation"""
     try:
-        print("\nSTART CONVERSATION ENDPOINT CALLED")
-        
         # Create new conversation state
         from agent.nodes import State
         state = State()
@@ -95,168 +383,327 @@ async def start_conversation():
         # Generate session ID
         import uuid
         session_id = str(uuid.uuid4())
-        conversation_states[session_id] = state
         
-        print(f" Created new conversation session: {session_id}")
+        logger.info(f" Created new conversation session: {session_id}")
         
         # Get initial question
-        print("Getting initial question...")
         result = conversation_manager.process_message(state, None)
-        
-        print(f" START RESPONSE:")
-        print(f"Session ID: {session_id}")
-        print(f"Initial Question: '{result['response'][:100]}...' (truncated)")
+        session_store.put(session_id, state)
         
         return StartConversationResponse(
             session_id=session_id,
             initial_question=result["response"],
-            message=result["response"]
+            message=result["response"],
+            current_question=result.get("current_question")
         )
     
     except Exception as e:
-        print(f"ERROR in start_conversation: {str(e)}")
+        logger.error(f"ERROR in start_conversation: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error starting conversation: {str(e)}")
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """Send a message to the agent"""
+@contextmanager
+def _admission_slot(loop: asyncio.AbstractEventLoop, wait: bool = False):
+    """Hold an analysis slot for the block, taken from a worker thread through the event loop
+
+    Raises a 429 HTTPException with Retry-After when the server is saturated, or with wait
+    keeps retrying after the suggested delay until a slot is free.
+    """
+    while True:
+        try:
+            asyncio.run_coroutine_threadsafe(admission.acquire(), loop).result()
+            break
+        except OverloadedError as e:
+            if not wait:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+            time.sleep(e.retry_after)
     try:
-        print(f"Received message: '{request.message}'")
-        print(f" Session ID: {request.session_id}")
-        
-        if request.session_id not in conversation_states:
-            print(f"Session {request.session_id} not found")
+        yield
+    finally:
+        loop.call_soon_threadsafe(admission.release)
+
+def _run_chat(request: ChatRequest, loop: asyncio.AbstractEventLoop) -> ChatResponse:
+    """Process one chat message while holding the session's lock"""
+    with session_locks.lock_for(request.session_id):
+        state = session_store.get(request.session_id)
+        if state is None:
+            logger.info(f"Session {request.session_id} not found")
             raise HTTPException(status_code=404, detail="Session not found")
         
-        state = conversation_states[request.session_id]
-        print(f"Found existing session")
-        
-        # Process the message
-        print("Processing message with conversation manager...")
-        result = conversation_manager.process_message(state, request.message)
-        
-        print(f" CHAT RESPONSE:")
-        print(f"Session ID: {request.session_id}")
-        print(f"Response: '{result['response'][:100]}...' (truncated)")
-        print(f"Is Complete: {result['is_complete']}")
+        # Process the message; the one that runs the analysis first takes an analysis slot
+        with _admission_slot(loop) if conversation_manager.needs_analysis(state) else nullcontext():
+            result = conversation_manager.process_message(state, request.message, session_id=request.session_id)
+        session_store.put(request.session_id, state)
+    
+    # The message that completes the questionnaire gets the recommendation itself
+    response_text, structured_cards = _split_recommendation(result)
+    
+    logger.debug("Chat response for session %s (complete: %s): %s", request.session_id, result["is_complete"], response_text, extra={"payload": True})
+    
+    return ChatResponse(
+        response=response_text,
+        session_id=request.session_id,
+        is_complete=result["is_complete"],
+        structured_cards=structured_cards or None,
+        current_question=result.get("current_question")
+    )
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, response: Response, idempotency_key: Optional[str] = Header(None), x_profile: Optional[str] = Header(None)):
+    """Send a message to the agent
+
+    Requests repeated with the same Idempotency-Key header return the first request's result.
+    With profiling enabled, a request sent with an X-Profile header is profiled.
+    """
+    try:
+        logger.debug("Received message for session %s: %r", request.session_id, request.message)
         
-        return ChatResponse(
-            response=result["response"],
-            session_id=request.session_id,
-            is_complete=result["is_complete"]
-        )
+        loop = asyncio.get_running_loop()
+        return await _run_idempotent("chat", idempotency_key, request, _profiled("chat", x_profile, response, lambda: _run_chat(request, loop)))
     
     except HTTPException:
         raise
     except Exception as e:
-        print(f"ERROR in chat: {str(e)}")
+        logger.error(f"ERROR in chat: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
-@app.post("/submit-profile", response_model=ChatResponse)
-async def submit_complete_profile(request: CompleteProfileRequest):
-    """Submit a complete user profile and get recommendations in one call"""
-    try:
-        print(f"\nSUBMIT PROFILE ENDPOINT CALLED")
-        print(f" Session ID: {request.session_id}")
-        
+def _run_submit_profile(request: CompleteProfileRequest, on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                        cancel: Optional[CancelToken] = None) -> ChatResponse:
+    """Run the recommendation pipeline for a complete profile while holding the session's lock"""
+    # A request without a session gets a new one that nothing else can see yet
+    with session_locks.lock_for(request.session_id) if request.session_id else nullcontext():
         # Get or create session
-        if request.session_id and request.session_id in conversation_states:
-            state = conversation_states[request.session_id]
-            print(f"Using existing session")
-        else:
-            # Create new session if none exists
-            from agent.nodes import State
-            state = State()
-            import uuid
-            session_id = str(uuid.uuid4())
-            conversation_states[session_id] = state
-            request.session_id = session_id
-            print(f" Created new session: {session_id}")
+        state, request.session_id = _get_or_create_session(request.session_id)
         
         # Convert request to profile dictionary
-        complete_profile = {
-            'primary_goal': request.primary_goal,
-            'top_spend_category': request.top_spend_category,
-            'brand_preferences': request.brand_preferences,
-            'travel_frequency': request.travel_frequency,
-            'monthly_spending': request.monthly_spending,
-            'payment_behavior': request.payment_behavior,
-            'income': request.income,
-            'credit_score': request.credit_score,
-            'credit_situation': request.credit_situation
-        }
+        complete_profile = _profile_from_request(request)
         
         # Log the incoming profile
-        print(f"\nRECEIVED PROFILE:")
-        print(f"Session ID: {request.session_id}")
-        print(f"Primary Goal: {request.primary_goal}")
-        print(f"Spend Category: {request.top_spend_category}")
-        print(f"Brand Preferences: {request.brand_preferences}")
-        print(f"Travel Frequency: {request.travel_frequency}")
-        print(f"Monthly Spending: {request.monthly_spending}")
-        print(f"Payment Behavior: {request.payment_behavior}")
-        print(f"Income: {request.income}")
-        print(f"Credit Score: {request.credit_score}")
-        print(f"Credit Situation: {request.credit_situation}")
+        logger.debug("Received profile for session %s: %s", request.session_id, complete_profile, extra={"payload": True})
         
         # Submit complete profile and get recommendations
-        print("Submitting complete profile to conversation manager...")
-        result = conversation_manager.submit_complete_profile(state, complete_profile)
+        result = conversation_manager.submit_complete_profile(state, complete_profile, on_event=on_event, mode=request.mode, cancel=cancel,
+                                                              session_id=request.session_id)
+        session_store.put(request.session_id, state)
         
         # Get conversation summary
         summary = conversation_manager.get_conversation_summary(state)
-        
-        # Handle structured response
-        response_text = result["response"]
-        structured_cards = []
-        
-        # Check if result contains structured data
-        if isinstance(result["response"], dict):
-            response_text = result["response"].get("text_response", str(result["response"]))
-            structured_cards = result["response"].get("structured_cards", [])
-            print(f"DEBUG: Found structured response with {len(structured_cards)} cards")
-        else:
-            print(f"DEBUG: Response is string, no structured cards")
-        
-        # Log the response
-        print(f"\n RESPONSE:")
-        print(f"Session ID: {request.session_id}")
-        print(f"Is Complete: {result['is_complete']}")
-        print(f"Questions Completed: {summary.get('questions_completed', 0)}/{summary.get('total_questions', 0)}")
-        print(f"Response Length: {len(response_text)} characters")
-        print(f"Structured Cards: {len(structured_cards)}")
-        print(f"\nFULL CREDIT CARD RECOMMENDATIONS:")
-        print("=" * 80)
-        print(response_text)
-        print("=" * 80)
-        
-        return ChatResponse(
-            response=response_text,
-            session_id=request.session_id,
-            is_complete=result["is_complete"],
-            conversation_summary=summary,
-            structured_cards=structured_cards
-        )
     
+    # Handle structured response
+    response_text, structured_cards = _split_recommendation(result)
+    
+    # Log the response
+    logger.info(f"Recommended {len(structured_cards)} cards for session {request.session_id} ({len(response_text)} characters)")
+    logger.debug("Recommendation for session %s: %s", request.session_id, response_text, extra={"payload": True})
+    
+    return ChatResponse(
+        response=response_text,
+        session_id=request.session_id,
+        is_complete=result["is_complete"],
+        conversation_summary=summary,
+        structured_cards=structured_cards,
+        usage=(state.analysis_result or {}).get("usage") if request.include_usage else None
+    )
+
+@app.post("/submit-profile", response_model=ChatResponse)
+async def submit_complete_profile(request: CompleteProfileRequest, http_request: Request, response: Response,
+                                  idempotency_key: Optional[str] = Header(None), x_profile: Optional[str] = Header(None)):
+    """Submit a complete user profile and get recommendations in one call
+
+    Requests repeated with the same Idempotency-Key header return the first request's result
+    (joining it while it is still running) instead of running the pipeline again. Without a
+    key, the analysis is cancelled if the client disconnects before it finishes; with one it
+    runs on so a retry can pick the result up. With profiling enabled, a request sent with an
+    X-Profile header is profiled.
+    """
+    try:
+        if idempotency_key:
+            work = _profiled("submit-profile", x_profile, response, lambda: _run_submit_profile(request))
+            return await _run_idempotent("submit-profile", idempotency_key, request, work, admission=admission)
+        cancel = CancelToken()
+        work = _profiled("submit-profile", x_profile, response, lambda: _run_submit_profile(request, cancel=cancel))
+        return await _run_cancellable(http_request, cancel, _run_idempotent("submit-profile", None, request, work, admission=admission))
+    
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"\nERROR: {str(e)}")
+        logger.error(f"ERROR: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing complete profile: {str(e)}")
 
+@app.post("/jobs", status_code=202)
+async def submit_profile_job(request: CompleteProfileRequest):
+    """Queue a complete profile for background analysis and return its job id straight away
+
+    Poll GET /jobs/{job_id} for progress; the result has the same shape as /submit-profile.
+    Turned away with a 429 and Retry-After while the analysis queue is full; an accepted job
+    waits for an analysis slot when it starts.
+    """
+    try:
+        admission.check()
+    except OverloadedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    # Create the session now so the caller knows it before the job runs
+    _, request.session_id = _get_or_create_session(request.session_id)
+    loop = asyncio.get_running_loop()
+    
+    def run_job(on_event):
+        with _admission_slot(loop, wait=True):
+            return _run_submit_profile(request, on_event=on_event).model_dump()
+    
+    try:
+        job = job_manager.submit(run_job, metadata={"session_id": request.session_id})
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    logger.info(f"Queued job {job['job_id']} for session {request.session_id}")
+    return {**job, "status_url": f"/jobs/{job['job_id']}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status, progress and, once finished, the result of a background job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/submit-profiles")
+async def submit_profiles(request: BatchProfilesRequest):
+    """Score many profiles in one call, streaming one NDJSON line per profile as it completes
+
+    Lines arrive in completion order and carry the profile's "index" in the request. Profiles
+    that share goal, credit score band, spending band and credit situation share one run of the
+    shard sub-agents. Each line has the LLM usage of its profile, with a shared shard run billed
+    to the first profile of its group to finish. A final "summary" line reports the batch counts
+    and usage totals.
+    """
+    max_profiles = int(os.getenv("BATCH_MAX_PROFILES", 1000))
+    if len(request.profiles) > max_profiles:
+        raise HTTPException(status_code=413, detail=f"At most {max_profiles} profiles per batch")
+    
+    fields = list(State().user_profile.keys())
+    profiles = [{field: profile.get(field) for field in fields} for profile in request.profiles]
+    max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+    logger.info(f"Batch of {len(profiles)} profiles received")
+    
+    def result_lines():
+        # A plain generator: StreamingResponse iterates it in a worker thread
+        stats = {}
+        totals = empty_totals()
+        for index, state, result in conversation_manager.submit_profiles_batch(profiles, mode=request.mode, max_concurrency=max_concurrency, stats=stats):
+            response_text, structured_cards = _split_recommendation(result)
+            line = {
+                "index": index,
+                "id": request.profiles[index].get("id"),
+                "is_complete": result["is_complete"],
+                "mode": (state.analysis_result or {}).get("mode"),
+                "response": response_text,
+                "structured_cards": structured_cards
+            }
+            usage = (state.analysis_result or {}).get("usage")
+            if usage is not None:
+                # Totals only; a shard run shared by several profiles is billed to the first to finish
+                line["usage"] = {"totals": usage["totals"], "shared_totals": usage["shared_totals"]}
+                totals = add_totals(totals, usage["totals"])
+            if result.get("error"):
+                line["error"] = result["error"]
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"summary": dict(stats, usage=totals)}) + "\n"
+    
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+@app.post("/submit-profile/stream")
+async def submit_complete_profile_stream(request: CompleteProfileRequest, http_request: Request):
+    """Submit a complete user profile and stream progress and the recommendation as Server-Sent Events
+
+    Emits "session", "stage" and "shard_complete" events while the sub-agents run, a "token"
+    event for each chunk of the final answer, then a "complete" event with the structured cards.
+    The analysis is cancelled if the client disconnects before it finishes.
+    """
+    state, session_id = _get_or_create_session(request.session_id)
+    complete_profile = _profile_from_request(request)
+    
+    # Nothing between here and starting run_analysis, which releases it, may raise
+    cancel = CancelToken()
+    try:
+        await _run_cancellable(http_request, cancel, admission.acquire())
+    except OverloadedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    def on_event(event: str, data: Dict[str, Any]):
+        # Called from worker threads, so hand the event over to the event loop
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+    
+    def run_analysis():
+        try:
+            with session_locks.lock_for(session_id):
+                # Re-read under the lock to build on any request that finished in the meantime
+                current_state = session_store.get(session_id) or state
+                result = conversation_manager.submit_complete_profile(current_state, complete_profile, on_event=on_event, mode=request.mode, cancel=cancel,
+                                                                      session_id=session_id)
+                session_store.put(session_id, current_state)
+            response_text, structured_cards = _split_recommendation(result)
+            on_event("complete", {
+                "response": response_text,
+                "session_id": session_id,
+                "is_complete": result["is_complete"],
+                "conversation_summary": conversation_manager.get_conversation_summary(current_state),
+                "structured_cards": structured_cards
+            })
+        except RequestCancelledError:
+            logger.info(f"Streamed profile for session {session_id} cancelled")
+        except Exception as e:
+            logger.error(f"ERROR in streamed profile: {str(e)}")
+            on_event("error", {"detail": f"Error processing complete profile: {str(e)}"})
+        finally:
+            loop.call_soon_threadsafe(admission.release)
+            on_event(None, None)
+    
+    # Run the blocking pipeline in a worker thread so the event loop stays free to send events.
+    # It starts here rather than in the stream so its admission slot is always released.
+    analysis = loop.run_in_executor(analysis_executor, tracer.wrap(run_analysis))
+    
+    async def event_stream():
+        # Starlette only notices a disconnect when it next sends, which can be a while mid-analysis
+        watcher = asyncio.ensure_future(_wait_for_disconnect(http_request))
+        watcher.add_done_callback(lambda done: done.cancelled() or analysis.done() or _cancel_request(cancel))
+        try:
+            yield _format_sse("session", {"session_id": session_id})
+            while True:
+                event, data = await queue.get()
+                if event is None:
+                    break
+                yield _format_sse(event, data)
+            await analysis
+        finally:
+            # Also reached when Starlette closes the stream because the client went away
+            watcher.cancel()
+            if not analysis.done():
+                _cancel_request(cancel)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/status/{session_id}")
 async def get_conversation_status(session_id: str):
     """Get the status of a conversation"""
     try:
-        if session_id not in conversation_states:
+        state = session_store.get(session_id)
+        if state is None:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        state = conversation_states[session_id]
         summary = conversation_manager.get_conversation_summary(state)
         
         return {
             "session_id": session_id,
             "status": summary,
             "current_question": state.current_question["field"] if state.current_question else None,
-            "conversation_history": state.conversation_history
+            "conversation_history": state.history_for_display(),
+            "usage": state.usage or empty_totals()
         }
     
     except HTTPException:
@@ -268,8 +715,7 @@ async def get_conversation_status(session_id: str):
 async def delete_session(session_id: str):
     """Delete a conversation session"""
     try:
-        if session_id in conversation_states:
-            del conversation_states[session_id]
+        if session_store.delete(session_id):
             return {"message": "Session deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Session not found")
@@ -283,14 +729,83 @@ async def delete_session(session_id: str):
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy",
+        "status": "saturated" if admission.state() == "saturated" else "healthy",
         "components": {
             "database": "connected",
             "llm": "available",
             "tools": "loaded"
-        }
+        },
+        "admission": admission.stats(),
+        "sessions": session_store.stats(),
+        "session_locks": session_locks.stats(),
+        "idempotency": idempotency_cache.stats(),
+        "speculation": {
+            "shards": final_analyzer.speculative_shards.stats(),
+            "final": final_analyzer.speculative_finals.stats()
+        },
+        "cancellation": {
+            **cancellation_counters,
+            "sub_agent": final_analyzer.shard_caller.cancellation_stats(),
+            "final_agent": final_analyzer.final_caller.cancellation_stats()
+        },
+        "jobs": job_manager.stats(),
+        "logging": logging_stats(),
+        "tracing": tracer.stats(),
+        "profiling": request_profiler.stats()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, LLM tokens and calls, fallbacks, cache lookups and memory"""
+    # Rendered in a worker thread: measuring memory can take a while with many sessions
+    content = await asyncio.get_running_loop().run_in_executor(None, metrics_registry.render)
+    return Response(content=content, media_type=METRICS_CONTENT_TYPE)
+
+def _require_admin(x_admin_token: Optional[str]):
+    if admin_token is None:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token")
+
+def _memory_report(largest: int) -> Dict[str, Any]:
+    report = memory_accountant.report()
+    sizes = session_store.session_sizes()
+    sessions = {"backend": session_store.stats().get("backend")}
+    if sizes is None:
+        sessions["detail"] = "Session sizes aren't available for this backend"
+    else:
+        sessions["distribution"] = size_distribution(list(sizes.values()))
+        # Session ids are credentials, so only a prefix is shown
+        sessions["largest"] = [
+            {"session": f"{session_id[:8]}...", "bytes": size}
+            for session_id, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:largest]
+        ]
+    report["sessions"] = sessions
+    report["tracemalloc"] = tracemalloc_tracker.stats()
+    return report
+
+@app.get("/admin/memory")
+async def memory_usage(largest: int = 10, x_admin_token: Optional[str] = Header(None)):
+    """Approximate bytes retained by sessions, the catalog and the caches, the session size
+    distribution and the largest sessions. Sessions are measured by walking their objects, so
+    this takes a while with many sessions."""
+    _require_admin(x_admin_token)
+    return await asyncio.get_running_loop().run_in_executor(None, _memory_report, max(0, min(largest, 100)))
+
+@app.post("/admin/memory/snapshot")
+async def memory_snapshot(x_admin_token: Optional[str] = Header(None)):
+    """Take a tracemalloc snapshot and list the allocation sites that grew most since the previous
+    one. The first call starts tracing (slowing the process down) and only records a baseline."""
+    _require_admin(x_admin_token)
+    return await asyncio.get_running_loop().run_in_executor(None, tracemalloc_tracker.snapshot)
+
+@app.delete("/admin/memory/snapshot")
+async def stop_memory_snapshots(x_admin_token: Optional[str] = Header(None)):
+    """Stop tracemalloc and forget the snapshot baseline"""
+    _require_admin(x_admin_token)
+    tracemalloc_tracker.stop()
+    return {"tracemalloc": tracemalloc_tracker.stats()}
+
 # Run the data pipeline on startup
 @app.on_event("startup")
 async def startup_event():
@@ -299,7 +814,7 @@ async def startup_event():
         # Initialize the JSON database manager
         from data_pipeline.database import JSONDatabaseManager
         
-        print("Initializing credit card database from JSON...")
+        logger.info("Initializing credit card database from JSON...")
         
         # Initialize database manager
         db_manager = JSONDatabaseManager()
@@ -307,10 +822,10 @@ async def startup_event():
         # Get all cards from JSON
         all_cards = db_manager.get_all_cards()
         
-        print(f"Database initialized with {len(all_cards)} credit cards from JSON")
+        logger.info(f"Database initialized with {len(all_cards)} credit cards from JSON")
         
     except Exception as e:
-        print(f"Warning: Could not initialize database on startup: {e}")
+        logger.warning(f"Could not initialize database on startup: {e}")
  
 
 if __name__ == "__main__":
@@ -319,6 +834,13 @@ if __name__ == "__main__":
     # Get configuration from environment
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8001))  # Changed to port 8001
+    workers = int(os.getenv("WORKERS", 1))
     
-    print(f"Starting Credit Card Recommendation API on {host}:{port}")
-    uvicorn.run(app, host=host, port=port) 
+    logger.info(f"Starting Credit Card Recommendation API on {host}:{port}")
+    if workers > 1:
+        # Several workers need a shared session store (SESSION_BACKEND=sqlite or redis)
+        if isinstance(session_store, InMemorySessionStore):
+            logger.warning(f" WORKERS={workers} with in-memory sessions: sessions, /jobs, session locks and idempotency keys are only found on the worker that created them; set SESSION_BACKEND=sqlite or redis")
+        uvicorn.run("api_server:app", host=host, port=port, workers=workers)
+    else:
+        uvicorn.run(app, host=host, port=port) 
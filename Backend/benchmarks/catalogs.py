@@ -0,0 +1,63 @@
+"""
+Synthetic card catalogs for the benchmarks
+
+Catalogs of any size in the database.json format (cards by issuer, with the scraped field
+names), made by varying the real catalog: the first len(database.json) cards are the real ones,
+the rest are copies with a numbered series in their name and a different annual fee, credit
+score and sign-up bonus, so the catalog narrows and ranks like a real one of that size.
+
+    python -m benchmarks.catalogs 10000 -o /tmp/catalog-10000.json
+"""
+
+import argparse
+import json
+import random
+import sys
+from typing import Dict, Any, List
+
+# Values the copies draw from
+ANNUAL_FEES = ["$0", "$0", "$39", "$95", "$99", "$150", "$250", "$395", "$550", "$695"]
+CREDIT_SCORES = ["Excellent", "Good/Excellent", "Good", "Fair/Good", "Fair", "Poor/Fair"]
+SIGNUP_BONUSES = ["None", "$200 after $500 in 3 months", "60,000 points after $4,000 in 3 months",
+                  "75,000 miles after $4,000 in 3 months", "Cashback Match at the end of the first year"]
+
+def load_template(path: str = "database.json") -> List[Dict[str, Any]]:
+    """The real catalog's cards, in file order, each with its issuer"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return [dict(card, Issuer=card.get("Issuer") or issuer) for issuer, cards in data.items() for card in cards]
+
+def synthetic_catalog(size: int, template: List[Dict[str, Any]], seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """A catalog of size cards by issuer, the same for the same size, template and seed"""
+    rng = random.Random(seed)
+    catalog = {}
+    for number in range(size):
+        card = dict(template[number % len(template)])
+        series = number // len(template)
+        if series:
+            card["Card name"] = f"{card.get('Card name', 'Card')} Series {series}"
+            card["Annual fee"] = rng.choice(ANNUAL_FEES)
+            card["Credit score"] = rng.choice(CREDIT_SCORES)
+            card["Sign-up bonus"] = rng.choice(SIGNUP_BONUSES)
+        catalog.setdefault(card["Issuer"], []).append(card)
+    return catalog
+
+def write_catalog(size: int, path: str, template_path: str = "database.json", seed: int = 0) -> str:
+    """Write a synthetic catalog of size cards to path, returning path"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(synthetic_catalog(size, load_template(template_path), seed), f)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic card catalog in the database.json format")
+    parser.add_argument("size", type=int, help="number of cards")
+    parser.add_argument("-o", "--output", required=True, help="catalog file to write")
+    parser.add_argument("--template", default="database.json", help="real catalog the cards are varied from (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+    args = parser.parse_args()
+
+    write_catalog(args.size, args.output, args.template, args.seed)
+    print(f"Wrote {args.size} cards to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
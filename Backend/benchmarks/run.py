@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the recommendation pipeline
+
+Times the stages whose cost grows with the catalog, over synthetic catalogs of each size
+(see benchmarks/catalogs.py), and /submit-profile end to end against the fake LLM (no network,
+no pacing, so only our own time is measured). Results are written as JSON and compared with a
+stored baseline: a benchmark whose fastest run is more than --tolerance slower than its baseline,
+in its first run and again when run once more to confirm, fails the run with exit status 1, as
+does a benchmark that raises.
+
+The fastest run is compared rather than the median because other processes only ever add time,
+and a fixed calibration workload (tens of milliseconds) runs before and after each benchmark.
+Results are compared through the median calibration over the whole run, so a machine that is
+slower throughout (a busy neighbour, a lower clock) doesn't look like a regression, while one
+noisy calibration can't hide or fake one; the machine factor is clamped to MACHINE_FACTOR_RANGE.
+Still, timings depend on the machine, so the baseline is only meaningful on the machine that
+recorded it; record one with --update-baseline before comparing on a new machine.
+
+    python -m benchmarks.run                                          # all benchmarks, all sizes
+    python -m benchmarks.run --sizes 77 1000 --only name_resolution   # a quick subset
+    python -m benchmarks.run -o results.json --tolerance 0.5          # keep the results, allow 50%
+    python -m benchmarks.run --update-baseline                        # record this run as the baseline
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import cached_property
+from typing import Dict, Any, List, Optional, Callable, NamedTuple
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Benchmarks never reach the network; the fake answers instantly so only our own time is measured
+BENCHMARK_ENV = {
+    "LLM_PROVIDER": "fake",
+    "FAKE_LLM_LATENCY_MS": "0",
+    "FAKE_LLM_LATENCY_SIGMA": "0",
+    "FAKE_LLM_TOKENS_PER_SECOND": "0",
+    "FAKE_LLM_ERROR_RATE": "0",
+    "FAKE_LLM_RATE_LIMIT_RATE": "0",
+    "FAKE_LLM_SEED": "1",
+    "SESSION_BACKEND": "memory",
+    "SPECULATION_ENABLED": "false",
+    "TRACING_ENABLED": "false",
+    "PROFILING_ENABLED": "false",
+    "MEMORY_TRACEMALLOC": "false",
+    "LOG_LEVEL": "WARNING",
+    "LOG_FILE": ""
+}
+os.environ.update(BENCHMARK_ENV)
+
+from agent.nodes import FinalAnalysisNode
+from agent.profile_parser import parse_profile
+from agent.ranker import narrow_candidates
+from agent.retrieval import CardIndex, CardRetriever
+from agent.tools import SubAgentCardAnalysisTool
+from benchmarks.catalogs import load_template, synthetic_catalog
+from benchmarks.submit_profile import PROFILES
+from data_pipeline.database import JSONDatabaseManager
+
+DEFAULT_SIZES = [77, 1000, 10000, 100000]
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# Entries in the final answer parsed by extract_structured_cards; real answers have 3
+LARGE_RESPONSE_ENTRIES = 50
+
+class Budget(NamedTuple):
+    # How long each benchmark runs: at least min_runs and min_seconds, at most max_runs, and no
+    # more runs once max_seconds have passed
+    min_runs: int
+    max_runs: int
+    min_seconds: float
+    max_seconds: float
+
+class Workload:
+    # The catalog of one size and the inputs the benchmarks derive from it, built on first use
+
+    def __init__(self, size: int, path: str, template: List[Dict[str, Any]]):
+        self.size = size
+        self.path = path
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(synthetic_catalog(size, template), f)
+
+    def sample(self, count: int, seed: str) -> List[Dict[str, Any]]:
+        """count cards of the catalog, the same for the same seed whatever else has run"""
+        return random.Random(f"{seed}/{self.size}").sample(self.cards, min(count, len(self.cards)))
+
+    @cached_property
+    def db_manager(self) -> JSONDatabaseManager:
+        return JSONDatabaseManager(self.path)
+
+    @cached_property
+    def cards(self) -> List[Dict[str, Any]]:
+        return self.db_manager.get_all_cards()
+
+    @cached_property
+    def sub_agents(self) -> List[SubAgentCardAnalysisTool]:
+        return [SubAgentCardAnalysisTool(self.db_manager, f"agent_{number}") for number in range(3)]
+
+    @cached_property
+    def profiles(self) -> List[tuple]:
+        return [(profile, parse_profile(profile)) for profile in PROFILES]
+
+# One node for every size: the benchmarks only call its parsing and profile helpers
+_node = None
+
+def analysis_node() -> FinalAnalysisNode:
+    global _node
+    if _node is None:
+        _node = FinalAnalysisNode({})
+    return _node
+
+def measure(function: Callable[[], Any], budget: Budget) -> List[float]:
+    """Seconds taken by each timed run of function, after one untimed warm-up run"""
+    function()
+    seconds = []
+    started = time.perf_counter()
+    while len(seconds) < budget.max_runs:
+        elapsed = time.perf_counter() - started
+        if len(seconds) >= budget.min_runs and elapsed >= budget.min_seconds:
+            break
+        if len(seconds) >= 3 and elapsed >= budget.max_seconds:
+            break
+        run_started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - run_started)
+    return seconds
+
+# Cards the calibration workload builds, serializes and sorts, like the pipeline does with the
+# catalog; enough of them that one run takes tens of milliseconds, well above timer noise
+_CALIBRATION_CARDS = [
+    {"name": f"Calibration Card {number}", "issuer": f"Issuer {number % 14}", "annual_fee": number % 7 * 95,
+     "rewards": "3x points on dining, 2x on travel, 1x on everything else"}
+    for number in range(6000)
+]
+
+# Bounds of the machine factor compare() applies: a change beyond them is a different machine
+# (record a new baseline), not a busy one, and mustn't scale a regression out of sight
+MACHINE_FACTOR_RANGE = (0.5, 2.0)
+
+def calibrate(runs: int = 5) -> float:
+    """Fastest of runs timings of a fixed workload, in seconds: how fast the machine is right now"""
+    def workload():
+        cards = [dict(card, name=card["name"].lower()) for card in _CALIBRATION_CARDS]
+        json.dumps(cards, indent=1)
+        sorted(cards, key=lambda card: (card["rewards"][::-1], card["name"]))
+
+    fastest = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        workload()
+        fastest = min(fastest, time.perf_counter() - started)
+    return fastest
+
+def final_response(cards: List[Dict[str, Any]]) -> str:
+    """A final answer in the numbered format the final prompt asks for, one entry per card"""
+    entries = []
+    for position, card in enumerate(cards, start=1):
+        entries.append("\n".join([
+            f"{position}. **{card['name']}**",
+            f"   - **Issuer:** {card['issuer']}",
+            f"   - **Annual Fee:** {card['annual_fee']}",
+            f"   - **Credit Score:** {card['credit_score']}",
+            f"   - **Regular APR:** {card['regular_apr']}",
+            f"   - **Rewards:** {card['rewards']}",
+            f"   - **Sign-up Bonus:** {card['signup_bonus']}",
+            f"   - **Target Audience:** {card['target_audience']}",
+            "",
+            f"   **Reasoning:** Its rewards and requirements match the stated goal and credit profile."
+        ]))
+    return "\n\n".join(entries)
+
+# Benchmarks: each takes the workload of one size and returns the seconds of each timed run
+
+def bench_catalog_load(workload: Workload, budget: Budget) -> List[float]:
+    """Read and parse the catalog file"""
+    return measure(lambda: JSONDatabaseManager(workload.path), budget)
+
+def bench_catalog_standardize(workload: Workload, budget: Budget) -> List[float]:
+    """Standardize every card of the catalog (get_all_cards, run by every analysis)"""
+    return measure(workload.db_manager.get_all_cards, budget)
+
+def bench_retrieval_index(workload: Workload, budget: Budget) -> List[float]:
+    """Build the candidate retrieval index over the catalog"""
+    return measure(lambda: CardIndex(workload.cards), budget)
+
+def bench_shard_prompt(workload: Workload, budget: Budget) -> List[float]:
+    """Narrow, retrieve and build the three shard prompts, for each benchmark profile"""
+    retriever = CardRetriever()
+    retriever.index_for(workload.cards)
+    node = analysis_node()
+
+    def run():
+        for profile, parsed in workload.profiles:
+            candidates = narrow_candidates(workload.cards, parsed)
+            candidates = retriever.retrieve(workload.cards, candidates, node.shard_profile(profile, parsed))
+            for sub_agent in workload.sub_agents:
+                sub_agent._run(profile, cards=candidates)
+    return measure(run, budget)
+
+def bench_shard_prompt_no_retrieval(workload: Workload, budget: Budget) -> List[float]:
+    """Narrow and build the three shard prompts without retrieval (RETRIEVAL_TOP_K=0)"""
+    def run():
+        for profile, parsed in workload.profiles:
+            candidates = narrow_candidates(workload.cards, parsed)
+            for sub_agent in workload.sub_agents:
+                sub_agent._run(profile, cards=candidates)
+    return measure(run, budget)
+
+def bench_extract_structured_cards(workload: Workload, budget: Budget) -> List[float]:
+    """Parse a final answer of LARGE_RESPONSE_ENTRIES cards spread over the catalog"""
+    response = final_response(workload.sample(LARGE_RESPONSE_ENTRIES, "extract_structured_cards"))
+    node = analysis_node()
+    return measure(lambda: node._extract_structured_cards(response, workload.cards), budget)
+
+def bench_name_resolution(workload: Workload, budget: Budget) -> List[float]:
+    """Resolve LLM-reported names to cards: exact in another case, reworded, and made up"""
+    picked = workload.sample(20, "name_resolution")
+    names = [card["name"].upper() for card in picked[:10]]
+    names += [card["name"].replace("®", "").replace("℠", "").replace(" Card", "") for card in picked[10:15]]
+    names += ["Zephyr Quokka Rewards", "Quixotic Lumen Visa", "Xylo Cashback Plus", "Vortex Nimbus Elite", "Obsidian Zeal Signature"]
+    node = analysis_node()
+    return measure(lambda: [node._resolve_card_name(name, workload.cards) for name in names], budget)
+
+def bench_submit_profile(workload: Workload, budget: Budget) -> List[float]:
+    """POST /submit-profile end to end, in a fresh API process over the catalog"""
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.submit_profile", "--requests", str(budget.max_runs),
+         "--min-requests", str(budget.min_runs), "--max-seconds", str(budget.max_seconds)],
+        cwd=BACKEND_DIR, env=dict(os.environ, CARD_DATABASE_PATH=workload.path),
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"benchmarks.submit_profile exited with {completed.returncode}: {completed.stderr.strip()[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])["seconds"]
+
+BENCHMARKS: Dict[str, Callable[[Workload, Budget], List[float]]] = {
+    "catalog_load": bench_catalog_load,
+    "catalog_standardize": bench_catalog_standardize,
+    "retrieval_index": bench_retrieval_index,
+    "shard_prompt": bench_shard_prompt,
+    "shard_prompt_no_retrieval": bench_shard_prompt_no_retrieval,
+    "extract_structured_cards": bench_extract_structured_cards,
+    "name_resolution": bench_name_resolution,
+    "submit_profile": bench_submit_profile
+}
+
+def summarize(seconds: List[float]) -> Dict[str, Any]:
+    """Run count, median, p95, min and mean of a benchmark's timings"""
+    ordered = sorted(seconds)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "runs": len(ordered),
+        "median_seconds": round(percentile(50), 6),
+        "p95_seconds": round(percentile(95), 6),
+        "min_seconds": round(ordered[0], 6),
+        "mean_seconds": round(sum(ordered) / len(ordered), 6)
+    }
+
+def run_suite(plan: Dict[int, List[str]], budget: Budget, template_path: str) -> Dict[str, Dict[str, Any]]:
+    """Run the benchmarks named in plan for each catalog size, keyed "<benchmark>/<size>" """
+    template = load_template(template_path)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="card-benchmarks-") as directory:
+        for size, names in plan.items():
+            print(f"Catalog of {size} cards", file=sys.stderr)
+            workload = Workload(size, os.path.join(directory, f"catalog-{size}.json"), template)
+            for name in names:
+                key = f"{name}/{size}"
+                gc.collect()
+                try:
+                    calibration = calibrate()
+                    seconds = BENCHMARKS[name](workload, budget)
+                    # Averaged over before and after, as the benchmark may run for a while
+                    calibration = (calibration + calibrate()) / 2
+                    result = {"benchmark": name, "cards": size, **summarize(seconds), "calibration_seconds": round(calibration, 6)}
+                    print(f"  {name:<28} min {result['min_seconds'] * 1000:10.3f} ms   median {result['median_seconds'] * 1000:10.3f} ms   "
+                          f"p95 {result['p95_seconds'] * 1000:10.3f} ms   ({result['runs']} runs)", file=sys.stderr)
+                except Exception as e:
+                    result = {"benchmark": name, "cards": size, "error": f"{type(e).__name__}: {e}"}
+                    print(f"  {name:<28} FAILED: {result['error']}", file=sys.stderr)
+                results[key] = result
+            # The largest catalogs and their indexes take a good part of memory
+            del workload
+            gc.collect()
+    return results
+
+def median_calibration(results: Dict[str, Dict[str, Any]]) -> Optional[float]:
+    """Median calibration timing over every benchmark of a run, None if none has one"""
+    timings = [result["calibration_seconds"] for result in results.values() if result.get("calibration_seconds")]
+    return statistics.median(timings) if timings else None
+
+def machine_factor(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]) -> float:
+    """How much slower the machine was over this run than over the baseline's, by their median
+    calibration timings, clamped to MACHINE_FACTOR_RANGE"""
+    current, previous = median_calibration(results), median_calibration(baseline)
+    if not current or not previous:
+        return 1.0
+    low, high = MACHINE_FACTOR_RANGE
+    factor = current / previous
+    if not low <= factor <= high:
+        print(f"Warning: calibration takes x{factor:.2f} as long as when the baseline was recorded; comparing at "
+              f"x{min(high, max(low, factor)):.2f}, record a new baseline if the machine changed", file=sys.stderr)
+    return min(high, max(low, factor))
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float, min_delta: float) -> List[Dict[str, Any]]:
+    """Each result's fastest run against its baseline's, scaled by the machine factor:
+    "regression" when it is more than tolerance (a fraction) and min_delta seconds slower,
+    "improved" when more than tolerance faster"""
+    machine = machine_factor(results, baseline)
+    rows = []
+    for key, result in results.items():
+        row = {"key": key}
+        base = baseline.get(key)
+        if "error" in result:
+            row["status"] = "error"
+        elif base is None or "min_seconds" not in base:
+            row["status"] = "new"
+        else:
+            current, previous = result["min_seconds"], base["min_seconds"]
+            ratio = current / (previous * machine) if previous else 1.0
+            row.update(baseline_min_seconds=previous, min_seconds=current, machine_ratio=round(machine, 3), ratio=round(ratio, 3))
+            if ratio > 1 + tolerance and current - previous * machine > min_delta:
+                row["status"] = "regression"
+            elif ratio < 1 - tolerance:
+                row["status"] = "improved"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+def confirm_regressions(results: Dict[str, Dict[str, Any]], rows: List[Dict[str, Any]], budget: Budget, template_path: str) -> List[str]:
+    """Run the regressed benchmarks again, keeping the faster of the two results of each, so a
+    regression only fails the run when it shows up twice; returns the keys run again"""
+    keys = [row["key"] for row in rows if row["status"] == "regression"]
+    if not keys:
+        return keys
+    print(f"\nRunning {len(keys)} regressed benchmark(s) again to confirm", file=sys.stderr)
+    plan = {}
+    for key in keys:
+        plan.setdefault(results[key]["cards"], []).append(results[key]["benchmark"])
+    for key, result in run_suite(plan, budget, template_path).items():
+        first = results[key]
+        if "error" not in result and result["min_seconds"] / result["calibration_seconds"] < first["min_seconds"] / first["calibration_seconds"]:
+            results[key] = result
+        results[key]["attempts"] = 2
+    return keys
+
+def print_comparison(rows: List[Dict[str, Any]], tolerance: float):
+    print(f"\nCompared with the baseline (tolerance {tolerance:.0%}):", file=sys.stderr)
+    for row in rows:
+        if "ratio" in row:
+            detail = (f"{row['baseline_min_seconds'] * 1000:10.3f} ms -> {row['min_seconds'] * 1000:10.3f} ms   "
+                      f"x{row['ratio']:<6} (machine x{row['machine_ratio']})")
+        else:
+            detail = ""
+        marker = "!!" if row["status"] in ("regression", "error") else "  "
+        print(f"{marker} {row['status'].upper():<10} {row['key']:<36} {detail}", file=sys.stderr)
+    failed = [row["key"] for row in rows if row["status"] in ("regression", "error")]
+    if failed:
+        print(f"\nFAILED: {len(failed)} benchmark(s) regressed or failed: {', '.join(failed)}", file=sys.stderr)
+
+def metadata(sizes: List[int]) -> Dict[str, Any]:
+    """Where and when the results were measured"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "sizes": sizes
+    }
+
+def load_baseline(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation pipeline and compare with a baseline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="catalog sizes in cards (default: %(default)s)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file (default: stdout)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline results to compare with (default: benchmarks/baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results in the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="fraction a benchmark may be slower than its baseline by (default: %(default)s)")
+    parser.add_argument("--no-confirm", dest="confirm", action="store_false", help="fail on a regression without running it again")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1, help="slowdowns smaller than this never fail (default: %(default)s)")
+    parser.add_argument("--min-runs", type=int, default=5, help="timed runs of each benchmark at least (default: %(default)s)")
+    parser.add_argument("--max-runs", type=int, default=1000, help="timed runs of each benchmark at most (default: %(default)s)")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="seconds each benchmark runs for at least (default: %(default)s)")
+    parser.add_argument("--max-seconds", type=float, default=15.0, help="no new runs after this many seconds, once 3 are done (default: %(default)s)")
+    parser.add_argument("--template", default=os.path.join(BACKEND_DIR, "database.json"), help="real catalog the synthetic ones are varied from")
+    args = parser.parse_args()
+
+    names = args.only or list(BENCHMARKS)
+    budget = Budget(args.min_runs, args.max_runs, args.min_seconds, args.max_seconds)
+    report = {"metadata": metadata(args.sizes), "benchmarks": run_suite({size: names for size in args.sizes}, budget, args.template)}
+    errors = [key for key, result in report["benchmarks"].items() if "error" in result]
+
+    if args.update_baseline:
+        baseline = load_baseline(args.baseline) or {"benchmarks": {}}
+        # Benchmarks and sizes not run this time keep their baseline
+        baseline["metadata"] = report["metadata"]
+        baseline["benchmarks"].update({key: result for key, result in report["benchmarks"].items() if "error" not in result})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nUpdated the baseline in {args.baseline}", file=sys.stderr)
+        failed = bool(errors)
+        report["failed"] = failed
+    else:
+        baseline = load_baseline(args.baseline)
+        if baseline is None:
+            print(f"\nNo baseline at {args.baseline}; record one with --update-baseline", file=sys.stderr)
+            failed = bool(errors)
+        else:
+            for field in ("machine", "cpus", "python"):
+                if baseline.get("metadata", {}).get(field) != report["metadata"][field]:
+                    print(f"Warning: the baseline was recorded with {field}={baseline['metadata'].get(field)}, this run has {report['metadata'][field]}", file=sys.stderr)
+            rows = compare(report["benchmarks"], baseline.get("benchmarks", {}), args.tolerance, args.min_delta_ms / 1000)
+            if args.confirm and confirm_regressions(report["benchmarks"], rows, budget, args.template):
+                rows = compare(report["benchmarks"], baseline.get("benchmarks", {}), args.tolerance, args.min_delta_ms / 1000)
+            report["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "results": rows}
+            print_comparison(rows, args.tolerance)
+            failed = any(row["status"] in ("regression", "error") for row in rows)
+        report["failed"] = failed
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Wrote results to {args.output}", file=sys.stderr)
+    elif not args.update_baseline:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
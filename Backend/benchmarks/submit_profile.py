@@ -0,0 +1,79 @@
+"""
+End-to-end /submit-profile benchmark against the fake LLM
+
+Starts the API in-process with whatever catalog and settings the environment gives it (the
+benchmark runner sets CARD_DATABASE_PATH and LLM_PROVIDER=fake and runs this once per catalog
+size, so each size gets a fresh process), sends warm-up requests, then times each request and
+prints the timings as JSON on stdout.
+
+    LLM_PROVIDER=fake FAKE_LLM_LATENCY_MS=0 FAKE_LLM_TOKENS_PER_SECOND=0 \\
+        python -m benchmarks.submit_profile --requests 20
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Any, List
+
+# Complete profiles the benchmarks cycle through, one per goal the pipeline narrows differently
+PROFILES: List[Dict[str, Any]] = [
+    {"primary_goal": "Travel rewards", "top_spend_category": "Travel", "brand_preferences": "United",
+     "travel_frequency": "6-10 trips", "monthly_spending": "$3,000-$5,000", "payment_behavior": "Pay in full",
+     "income": "$100k-$150k", "credit_score": "740-799", "credit_situation": "Established credit"},
+    {"primary_goal": "Cash back", "top_spend_category": "Groceries", "brand_preferences": "None",
+     "travel_frequency": "0-1 trips", "monthly_spending": "$500-$1,000", "payment_behavior": "Pay in full",
+     "income": "Under $25k", "credit_score": "No credit history", "credit_situation": "Student with little history"},
+    {"primary_goal": "Build credit", "top_spend_category": "Gas", "brand_preferences": "None",
+     "travel_frequency": "0-1 trips", "monthly_spending": "Under $500", "payment_behavior": "Sometimes carry a balance",
+     "income": "$25k-$50k", "credit_score": "580-669", "credit_situation": "Building/rebuilding credit"},
+    {"primary_goal": "Balance transfer", "top_spend_category": "Dining", "brand_preferences": "Chase",
+     "travel_frequency": "2-5 trips", "monthly_spending": "$1,000-$3,000", "payment_behavior": "Carry a balance",
+     "income": "$50k-$100k", "credit_score": "670-739", "credit_situation": "Established credit"}
+]
+
+def run(requests: int, warmup: int, min_requests: int = 3, max_seconds: float = float("inf")) -> Dict[str, Any]:
+    """Start the API and time up to requests /submit-profile calls after warmup untimed ones,
+    stopping early once min_requests are timed and max_seconds have passed"""
+    started = time.perf_counter()
+    import api_server
+    from fastapi.testclient import TestClient
+
+    timings = []
+    # Entered, so startup runs and every request shares one event loop
+    with TestClient(api_server.app) as client:
+        startup_seconds = time.perf_counter() - started
+        timed_started = None
+        for number in range(warmup + requests):
+            if number == warmup:
+                timed_started = time.perf_counter()
+            if len(timings) >= min_requests and time.perf_counter() - timed_started >= max_seconds:
+                break
+            # A different profile each time, so no result is served from a cache
+            profile = dict(PROFILES[number % len(PROFILES)], income=f"${50 + number}k")
+            request_started = time.perf_counter()
+            response = client.post("/submit-profile", json=profile)
+            elapsed = time.perf_counter() - request_started
+            body = response.json()
+            if response.status_code != 200 or not body.get("structured_cards"):
+                raise RuntimeError(f"/submit-profile failed ({response.status_code}): {str(body)[:300]}")
+            if number >= warmup:
+                timings.append(elapsed)
+        cards = len(api_server.tools["final_agent"].get_all_cards())
+    return {"seconds": timings, "startup_seconds": startup_seconds, "catalog_cards": cards}
+
+def main():
+    parser = argparse.ArgumentParser(description="Time /submit-profile end to end in-process")
+    parser.add_argument("--requests", type=int, default=20, help="timed requests at most (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests first (default: %(default)s)")
+    parser.add_argument("--min-requests", type=int, default=3, help="timed requests before --max-seconds applies (default: %(default)s)")
+    parser.add_argument("--max-seconds", type=float, default=float("inf"), help="no new requests after this many seconds of timed ones")
+    args = parser.parse_args()
+
+    result = run(args.requests, args.warmup, args.min_requests, args.max_seconds)
+    print(f"Timed {len(result['seconds'])} requests over {result['catalog_cards']} cards", file=sys.stderr)
+    json.dump(result, sys.stdout)
+    print()
+
+if __name__ == "__main__":
+    main()
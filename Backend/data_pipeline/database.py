@@ -10,9 +10,10 @@ from datetime import datetime
 class JSONDatabaseManager:
     
     
-    def __init__(self, json_file_path: str = "database.json"):
-        self.json_file_path = json_file_path
-        logger.info(f"i nitializing JSONDatabaseManager with file: {json_file_path}")
+    def __init__(self, json_file_path: Optional[str] = None):
+        # CARD_DATABASE_PATH points the API, CLI and benchmarks at another catalog file
+        self.json_file_path = json_file_path or os.getenv("CARD_DATABASE_PATH", "database.json")
+        logger.info(f"i nitializing JSONDatabaseManager with file: {self.json_file_path}")
         self.cards_data = self._load_cards_data()
     
     def _load_cards_data(self) -> Dict[str, List[Dict[str, Any]]]:
@@ -25,23 +26,21 @@ class JSONDatabaseManager:
                 return data
             else:
                 logger.warning(f" {self.json_file_path} not found. Using empty database.")
-                print(f"Warning: {self.json_file_path} not found. Using empty database.")
                 return {}
         except Exception as e:
             logger.error(f"❌ Error loading database: {e}")
-            print(f"Error loading database: {e}")
             return {}
     
     def get_all_cards(self) -> List[Dict[str, Any]]:
         
-        logger.info("getting all cards from database...")
+        logger.debug("getting all cards from database...")
         all_cards = []
         for issuer, cards in self.cards_data.items():
             for card in cards:
                 # Standardize card format
                 standardized_card = self._standardize_card_format(card, issuer)
                 all_cards.append(standardized_card)
-        logger.info("retrieved cards from database")
+        logger.debug("retrieved cards from database")
         return all_cards
     
     def _standardize_card_format(self, card: Dict[str, Any], issuer: str) -> Dict[str, Any]:
@@ -130,10 +129,7 @@ class JSONDatabaseManager:
     def get_all_cards_for_llm(self) -> List[Dict[str, Any]]:
         """Get all cards in a format optimized for LLM analysis"""
         all_cards = self.get_all_cards()
-        print(f"DEBUG: Total cards loaded from database: {len(all_cards)}")
-        print(f"DEBUG: First 3 card names: {[card.get('Card name', 'Unknown') for card in all_cards[:3]]}")
-        print(f"DEBUG: Last 3 card names: {[card.get('Card name', 'Unknown') for card in all_cards[-3:]]}")
-        logger.info(f"total cards available for LLM analysis: {len(all_cards)}")
+        logger.debug("total cards available for LLM analysis: %d", len(all_cards))
         return all_cards
     
     def close(self):
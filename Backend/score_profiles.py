@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Score a file of customer profiles offline
+
+Reads profiles from CSV or JSONL (one column or key per profile field, plus an optional "id"),
+recommends cards for each one and appends one JSON line per profile to the output file as it
+completes. The output file is also the checkpoint: rerunning the same command after a crash
+skips the profiles already in it.
+
+    python score_profiles.py customers.csv -o scores.jsonl                # local ranker, all cores
+    python score_profiles.py customers.jsonl -o scores.jsonl --mode llm   # full LLM pipeline
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Dict, Any, List, Iterator, Tuple
+
+from dotenv import load_dotenv
+
+from agent.profile_parser import FIELD_PARSERS, parse_profile
+
+# Profile fields read from each input row
+PROFILE_FIELDS = list(FIELD_PARSERS)
+
+def read_profiles(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (row id, profile) for each row of a CSV or JSONL file, streaming"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for number, row in enumerate(rows, 1):
+            row_id = str(row.get("id") or f"row-{number}")
+            yield row_id, {field: row.get(field) or None for field in PROFILE_FIELDS}
+
+def load_checkpoint(output_path: str) -> set:
+    """Ids already written to the output file. A line cut short by a crash is removed, and a
+    complete last record missing its newline gets one so the next record starts a new line."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    good_bytes = 0
+    missing_newline = False
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            good_bytes += len(line)
+            missing_newline = not line.endswith(b"\n")
+    if good_bytes < os.path.getsize(output_path):
+        print(f"Removing incomplete line at the end of {output_path}", file=sys.stderr)
+        with open(output_path, "r+b") as f:
+            f.truncate(good_bytes)
+    elif missing_newline:
+        with open(output_path, "ab") as f:
+            f.write(b"\n")
+    return done
+
+def chunked(rows: Iterator[Tuple[str, Dict[str, Any]]], size: int) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Local ranking runs in worker processes, each with its own copy of the catalog and ranker
+_worker = {}
+
+def _init_local_worker():
+    from data_pipeline.database import JSONDatabaseManager
+    from agent.ranker import LocalRanker
+    _worker["cards"] = JSONDatabaseManager().get_all_cards()
+    _worker["ranker"] = LocalRanker()
+
+def score_locally(chunk: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Rank the catalog for each profile of a chunk with the local ranker"""
+    results = []
+    for row_id, profile in chunk:
+        missing = [field for field in PROFILE_FIELDS if not profile.get(field)]
+        if missing:
+            results.append({"id": row_id, "is_complete": False, "error": f"Missing fields: {missing}"})
+            continue
+        recommendation = _worker["ranker"].recommend(_worker["cards"], profile, parsed_profile=parse_profile(profile))
+        results.append({"id": row_id, "is_complete": True, "mode": "fast", "structured_cards": recommendation["structured_cards"]})
+    return results
+
+def run_local(rows: Iterator[Tuple[str, Dict[str, Any]]], workers: int, chunk_size: int) -> Iterator[Dict[str, Any]]:
+    """Score rows in a process pool, keeping a bounded number of chunks in flight"""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_local_worker) as pool:
+        chunks = chunked(rows, chunk_size)
+        in_flight = set()
+        while True:
+            for chunk in islice(chunks, workers * 2 - len(in_flight)):
+                in_flight.add(pool.submit(score_locally, chunk))
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+def run_llm(rows: Iterator[Tuple[str, Dict[str, Any]]], workers: int, chunk_size: int) -> Iterator[Dict[str, Any]]:
+    """Score rows with the LLM pipeline, a chunk at a time so profiles in a chunk share shard runs"""
+    from agent.nodes import QuestionAskerNode, FinalAnalysisNode
+    from agent.edges import ConversationManager
+    from agent.tools import create_tools
+
+    tools = create_tools()
+    manager = ConversationManager(QuestionAskerNode(), FinalAnalysisNode(tools), tools)
+    for chunk in chunked(rows, chunk_size):
+        profiles = [profile for _, profile in chunk]
+        for index, state, result in manager.submit_profiles_batch(profiles, max_concurrency=workers):
+            line = {"id": chunk[index][0], "is_complete": result["is_complete"]}
+            if result.get("error"):
+                line["error"] = result["error"]
+            else:
+                line["mode"] = (state.analysis_result or {}).get("mode")
+                recommendation = result["response"]
+                line["structured_cards"] = recommendation.get("structured_cards", []) if isinstance(recommendation, dict) else []
+            yield line
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CSV or JSONL file of customer profiles")
+    parser.add_argument("input", help="CSV or JSONL file of profiles")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to; also the checkpoint")
+    parser.add_argument("--mode", choices=["fast", "llm"], default="fast", help="fast: local ranker (default); llm: full LLM pipeline")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (fast) or concurrent LLM selections (llm)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Profiles per work unit")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.workers:
+        workers = args.workers
+    else:
+        workers = (os.cpu_count() or 1) if args.mode == "fast" else 4
+    chunk_size = args.chunk_size or (200 if args.mode == "fast" else 100)
+
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"Resuming: {len(done)} profiles already scored in {args.output}", file=sys.stderr)
+    rows = ((row_id, profile) for row_id, profile in read_profiles(args.input) if row_id not in done)
+    results = run_local(rows, workers, chunk_size) if args.mode == "fast" else run_llm(rows, workers, chunk_size)
+
+    started = time.monotonic()
+    scored = 0
+    with open(args.output, "a", encoding="utf-8") as out:
+        for line in results:
+            out.write(json.dumps(line) + "\n")
+            scored += 1
+            if scored % 1000 == 0:
+                # Make finished rows durable so a crash loses at most the last thousand
+                out.flush()
+                os.fsync(out.fileno())
+                rate = scored / max(time.monotonic() - started, 1e-9)
+                print(f"Scored {scored} profiles ({rate:,.0f}/s)", file=sys.stderr)
+
+    elapsed = time.monotonic() - started
+    print(f"Scored {scored} profiles in {elapsed:.1f}s, {len(done) + scored} total in {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Every answer option of the questionnaire (Frontend/src/pages/Questionnaire.jsx) through parse_answer
+
+    cd Backend && python -m pytest tests
+"""
+
+import os
+import re
+
+import pytest
+
+from agent.profile_parser import parse_answer, parse_credit_score, parse_money, CREDIT_TIERS
+
+QUESTIONNAIRE = os.path.join(os.path.dirname(__file__), "..", "..", "Frontend", "src", "pages", "Questionnaire.jsx")
+
+def money(low, high, value=None):
+    return {"min": low, "max": high, "value": value if value is not None else (low + high) / 2 if high is not None else low}
+
+# Expected parse of each option the questionnaire offers, by field
+EXPECTED = {
+    "primary_goal": {
+        "Maximizing travel rewards (miles, hotel points)": "maximizing travel rewards (miles, hotel points)",
+        "Earning cash back": "earning cash back",
+        "Building or rebuilding credit": "building or rebuilding credit",
+        "Financing purchases with a 0% intro APR": "financing purchases with a 0% intro apr",
+        "Earning benefits with a specific brand/store (e.g. Amazon, Apple, Costco)": "earning benefits with a specific brand/store (e.g. amazon, apple, costco)"
+    },
+    "top_spend_category": {
+        "Dining & restaurants": "dining",
+        "Groceries": "groceries",
+        "Gas or transportation": "gas",
+        "Streaming, entertainment, subscriptions": "entertainment",
+        "Online or retail shopping": "shopping",
+        "General purchases spread evenly across categories": "other"
+    },
+    "brand_preferences": {
+        "Amazon": ["amazon"],
+        "Apple or Apple Pay": ["apple"],
+        "Costco": ["costco"],
+        "Walmart": ["walmart"],
+        "Airlines or hotel loyalty programs": ["airline", "hotel"],
+        "Other big-name retailers (e.g. Ulta, Sephora, Best Buy)": [],
+        "None of these": []
+    },
+    "travel_frequency": {
+        "> 10 times": money(10.0, None),
+        "3–10 times": money(3.0, 10.0),
+        "< 3 times or rarely": money(0.0, 3.0)
+    },
+    "monthly_spending": {
+        "< $500": money(0.0, 500.0),
+        "$500–$1,000": money(500.0, 1000.0),
+        "$1,000–$3,000": money(1000.0, 3000.0),
+        "> $3,000": money(3000.0, None)
+    },
+    "payment_behavior": {
+        "I usually pay in full (avoid interest)": {"carries_balance": False},
+        "I often carry a balance (would prefer no-interest intro offers)": {"carries_balance": True}
+    },
+    "income": {
+        "< $25K": money(0.0, 25000.0),
+        "$25K–$50K": money(25000.0, 50000.0),
+        "$50K–$75K": money(50000.0, 75000.0),
+        "$75K–$120K": money(75000.0, 120000.0),
+        "> $120K": money(120000.0, None)
+    },
+    "credit_score": {
+        "Excellent (740+)": {"min": 740, "max": 850, "value": 795.0, "tier": CREDIT_TIERS.index("excellent")},
+        "Good (670–739)": {"min": 670, "max": 739, "value": 704.5, "tier": CREDIT_TIERS.index("good")},
+        "Fair (580–669)": {"min": 580, "max": 669, "value": 624.5, "tier": CREDIT_TIERS.index("fair")},
+        "Poor (< 580)": {"min": 300, "max": 579, "value": 439.5, "tier": CREDIT_TIERS.index("poor")},
+        "I don't know": None
+    },
+    "credit_situation": {
+        "I'm a student with little or no credit history": {"is_student": True, "is_building": True},
+        "I'm trying to build or rebuild my credit (e.g., low score, no credit, or recent issues)": {"is_student": False, "is_building": True},
+        "Neither — I already have established credit": {"is_student": False, "is_building": False}
+    }
+}
+
+def questionnaire_options():
+    """(field, option) for every option in Questionnaire.jsx"""
+    with open(QUESTIONNAIRE, encoding="utf-8") as f:
+        source = f.read()
+    options = []
+    for field, body in re.findall(r'(\w+): \{\s*question: "[^"]*",\s*options: \[(.*?)\]', source, re.DOTALL):
+        options.extend((field, option) for option in re.findall(r'"((?:[^"\\]|\\.)*)"', body))
+    return options
+
+@pytest.mark.parametrize("field,option", [(field, option) for field, options in EXPECTED.items() for option in options])
+def test_questionnaire_option(field, option):
+    assert parse_answer(field, option) == EXPECTED[field][option]
+
+@pytest.mark.skipif(not os.path.exists(QUESTIONNAIRE), reason="frontend not checked out")
+def test_every_questionnaire_option_is_covered():
+    options = questionnaire_options()
+    assert options, "no options found in Questionnaire.jsx"
+    missing = [(field, option) for field, option in options if option not in EXPECTED.get(field, {})]
+    assert not missing, f"questionnaire options without an expected parse: {missing}"
+
+@pytest.mark.parametrize("text,low,high", [
+    ("Under $500", 0.0, 500.0),
+    ("less than 2,000/mo", 0.0, 2000.0),
+    ("<$500", 0.0, 500.0),
+    ("$5k+", 5000.0, None),
+    ("more than $3,000", 3000.0, None),
+    (">$3,000", 3000.0, None),
+    ("around 2,500", 2500.0, 2500.0)
+])
+def test_money_bounds(text, low, high):
+    parsed = parse_money(text, period="month")
+    assert (parsed["min"], parsed["max"]) == (low, high)
+
+@pytest.mark.parametrize("text,tier", [
+    ("< 580", "poor"),
+    ("under 600", "poor"),
+    ("700+", "good"),
+    ("over 740", "excellent"),
+    ("720", "good"),
+    ("fair", "fair"),
+    ("no credit", "poor")
+])
+def test_credit_score_tiers(text, tier):
+    assert parse_credit_score(text)["tier"] == CREDIT_TIERS.index(tier)
@@ -71,6 +71,61 @@ export async function submitCompleteProfile(profileData) {
   }
 }
 
+// Streams progress events, recommendation tokens and the final cards as they are produced.
+// onEvent is called as onEvent(eventName, data); resolves with the data of the "complete" event.
+export async function submitCompleteProfileStream(profileData, onEvent) {
+  try {
+    console.log("Submitting complete profile to backend (streaming):", profileData);
+    const res = await fetch(`${BASE_URL}/submit-profile/stream`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(profileData),
+    });
+
+    if (!res.ok) {
+      const errorText = await res.text();
+      console.error("Backend error:", errorText);
+      throw new Error(`Failed to submit profile: ${res.status} ${res.statusText}`);
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let completeData = null;
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Server-Sent Events frames are separated by a blank line
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let eventName = "message";
+        let dataText = "";
+        for (const line of frame.split("\n")) {
+          if (line.startsWith("event:")) eventName = line.slice(6).trim();
+          else if (line.startsWith("data:")) dataText += line.slice(5).trim();
+        }
+        const data = dataText ? JSON.parse(dataText) : {};
+
+        if (eventName === "error") throw new Error(data.detail);
+        if (eventName === "complete") completeData = data;
+        if (onEvent) onEvent(eventName, data);
+      }
+    }
+
+    console.log("Profile stream completed:", completeData);
+    return completeData;
+  } catch (error) {
+    console.error("Error streaming profile:", error);
+    throw error;
+  }
+}
+
 // Helper function to check backend health
 export async function checkBackendHealth() {
   try {
@@ -1,7 +1,15 @@
 import React, { useState, useEffect } from 'react';
 import { motion } from 'framer-motion';
 
-export default function LoadingAnimation({ onComplete, waitForSignal = false }) {
+// Labels for the "stage" events streamed by /submit-profile/stream
+const stageLabels = {
+  sub_agents: "AI agents reviewing candidate cards",
+  final_selection: "Choosing your best matches",
+  local_ranking: "Ranking cards for your profile",
+  speculative_final: "Finishing your recommendation"
+};
+
+export default function LoadingAnimation({ onComplete, waitForSignal = false, stage = null, streamedText = "" }) {
   const [currentStep, setCurrentStep] = useState(0);
   const [isComplete, setIsComplete] = useState(false);
   const [canFinish, setCanFinish] = useState(false);
@@ -141,6 +149,14 @@ export default function LoadingAnimation({ onComplete, waitForSignal = false })
                 {steps[currentStep]}
               </h2>
               
+              {/* Live stage reported by the backend */}
+              {stage && stageLabels[stage.stage] && (
+                <p className="text-sm text-blue-300 font-light mb-4">
+                  {stageLabels[stage.stage]}
+                  {stage.total_shards ? ` (${stage.completed_shards || 0} / ${stage.total_shards} agents done)` : ""}
+                </p>
+              )}
+              
               {/* Step-specific animations */}
               {currentStep === 0 && (
                 <motion.div
@@ -219,6 +235,13 @@ export default function LoadingAnimation({ onComplete, waitForSignal = false })
               )}
             </motion.div>
 
+            {/* Recommendation text as the backend streams it */}
+            {streamedText && (
+              <div className="text-left text-sm text-gray-300 font-light bg-gray-800/50 border border-gray-700 rounded-xl p-4 mb-6 max-h-40 overflow-y-auto whitespace-pre-wrap">
+                {streamedText.slice(-600)}
+              </div>
+            )}
+
             {/* Loading Dots */}
             {!isComplete && (
               <div className="flex justify-center space-x-2">
@@ -1,6 +1,6 @@
 import { useEffect, useState } from "react";
 import { useNavigate, useLocation } from "react-router-dom";
-import { startConversation, sendChat, submitCompleteProfile } from "../api/agent";
+import { startConversation, sendChat, submitCompleteProfileStream } from "../api/agent";
 import LoadingAnimation from '../components/LoadingAnimation';
 
 export default function Questionnaire() {
@@ -17,6 +17,9 @@ export default function Questionnaire() {
   const navigate = useNavigate();
   const location = useLocation();
   const [showLoading, setShowLoading] = useState(false);
+  // Progress streamed by the backend while it analyzes the profile
+  const [analysisStage, setAnalysisStage] = useState(null);
+  const [streamedText, setStreamedText] = useState("");
 
   // Question configurations with options
   const questionConfigs = {
@@ -373,7 +376,17 @@ export default function Questionnaire() {
     try {
       console.log("Submitting complete profile to backend:", profileData);
       
-      const res = await submitCompleteProfile(profileData);
+      setAnalysisStage(null);
+      setStreamedText("");
+      const res = await submitCompleteProfileStream(profileData, (event, data) => {
+        if (event === "stage") {
+          setAnalysisStage(data);
+        } else if (event === "shard_complete") {
+          setAnalysisStage((prev) => ({ ...prev, completed_shards: data.completed_shards, total_shards: data.total_shards }));
+        } else if (event === "token") {
+          setStreamedText((prev) => prev + data.text);
+        }
+      });
               console.log("Received recommendations from backend:", {
         response: res.response,
         sessionId: res.session_id,
@@ -425,7 +438,7 @@ export default function Questionnaire() {
 
   // Show loading animation if active
   if (showLoading) {
-    return <LoadingAnimation onComplete={handleLoadingComplete} waitForSignal={true} />;
+    return <LoadingAnimation onComplete={handleLoadingComplete} waitForSignal={true} stage={analysisStage} streamedText={streamedText} />;
   }
 
   const progressPercentage = ((currentQuestionIndex + 1) / questionOrder.length) * 100;